@@ -0,0 +1,122 @@
+"""
+Seeded synthetic league: players, and matches spread over locales and game types.
+
+    python -m benchmarks.league ./league.db --players 50 --matches 10000
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import sqlite3
+
+from utils import LOCALES
+
+
+def generate_league(
+    conn,
+    players=50,
+    matches=10_000,
+    locales=LOCALES,
+    one_vs_one=0.3,
+    seed=0,
+    start=dt.datetime(2023, 1, 1),
+):
+    """
+    Writes a synthetic league to an empty, migrated database, without computing
+    any rating.
+
+    players: number of players, with aliases player0, player1, ...
+    matches: number of matches, one every 15 to 20 minutes from start.
+    locales: locales the matches are spread over, uniformly.
+    one_vs_one: share of 1v1 matches, the others are 2v2.
+    seed: seed of the random generator, the same arguments give the same league.
+
+    Returns the aliases of the players.
+    """
+    rnd = random.Random(seed)
+    aliases = [f"player{i}" for i in range(players)]
+    conn.executemany(
+        "INSERT INTO players (alias, elo, games_played, games_won) VALUES (?, ?, ?, ?)",
+        [(alias, 1000, 0, 0) for alias in aliases],
+    )
+    player_ids = [
+        conn.execute("SELECT id FROM players WHERE alias = ?", [alias]).fetchone()[0]
+        for alias in aliases
+    ]
+
+    def rows():
+        timestamp = start
+        for _ in range(matches):
+            timestamp += dt.timedelta(minutes=rnd.randint(15, 20))
+            if rnd.random() < one_vs_one:
+                blue_att, red_att = rnd.sample(player_ids, 2)
+                teams, match_type = (blue_att, None, red_att, None), "1v1"
+            else:
+                teams, match_type = tuple(rnd.sample(player_ids, 4)), "2v2"
+
+            blue_score, red_score = 10, rnd.randint(0, 9)
+            if rnd.random() < 0.5:
+                blue_score, red_score = red_score, blue_score
+
+            yield (
+                rnd.choice(locales),
+                *teams,
+                match_type,
+                blue_score,
+                red_score,
+                timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            )
+
+    conn.executemany(
+        "INSERT INTO matches(locale, blue_team_att_id, blue_team_def_id, red_team_att_id, red_team_def_id, match_type, blue_score, red_score, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows(),
+    )
+    conn.commit()
+    return aliases
+
+
+def add_league_arguments(parser):
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--matches", type=int, default=10_000)
+    parser.add_argument("--locales", nargs="+", default=LOCALES)
+    parser.add_argument(
+        "--one-vs-one", type=float, default=0.3, help="share of 1v1 matches"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def league_arguments(args):
+    return {
+        "players": args.players,
+        "matches": args.matches,
+        "locales": args.locales,
+        "one_vs_one": args.one_vs_one,
+        "seed": args.seed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("database", help="created and migrated if missing")
+    add_league_arguments(parser)
+    args = parser.parse_args(argv)
+
+    os.environ["DATABASE_PATH"] = args.database
+
+    from utils.db import upgrade_database
+    from utils.elo import recompute_elo
+
+    upgrade_database(args.database)
+    conn = sqlite3.connect(args.database)
+    try:
+        generate_league(conn, **league_arguments(args))
+    finally:
+        conn.close()
+    recompute_elo()
+    print(
+        f"{args.players} players and {args.matches} matches written to {args.database}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Match registrations per second under concurrent writers.
+
+Every writer is a thread with its own connection, as Streamlit sessions are.
+Run from the repository root:
+
+    python -m benchmarks.registration --writers 1 2 4 8 --matches 200
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from .league import generate_league
+
+
+def run(writers, matches):
+    from utils.db import DATABASE_PATH
+    from utils.games import get_player_aliases, register_match
+
+    aliases = get_player_aliases()
+    # Successful registrations of each writer, and the errors of the failed ones
+    registered = [0] * writers
+    errors = []
+
+    def writer(i):
+        rnd = random.Random(i)
+        for _ in range(matches):
+            blue_att, blue_def, red_att, red_def = rnd.sample(aliases, 4)
+            blue_score, red_score = 10, rnd.randint(0, 9)
+            if rnd.random() < 0.5:
+                blue_score, red_score = red_score, blue_score
+            try:
+                register_match(
+                    "IT",
+                    blue_att,
+                    blue_def,
+                    red_att,
+                    red_def,
+                    "2v2",
+                    blue_score,
+                    red_score,
+                )
+            except Exception as e:
+                errors.append(e)
+            else:
+                registered[i] += 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "database": DATABASE_PATH,
+        "writers": writers,
+        "registrations": sum(registered),
+        "errors": len(errors),
+        "seconds": elapsed,
+        "registrations_per_second": sum(registered) / elapsed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--matches", type=int, default=200, help="per writer")
+    parser.add_argument("--players", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DATABASE_PATH"] = os.path.join(tmp, "database.db")
+
+        from utils import get_db_engine
+        from utils.db import upgrade_database
+
+        upgrade_database(os.environ["DATABASE_PATH"])
+        generate_league(get_db_engine(), players=args.players, matches=0)
+
+        for writers in args.writers:
+            result = run(writers, args.matches)
+            print(
+                f"{result['writers']:>3} writers: "
+                f"{result['registrations_per_second']:8.1f} registrations/s "
+                f"({result['errors']} errors)"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Times the rating and storage paths on a synthetic league.
+
+Every benchmark runs on the same seeded league in a temporary database, and the
+timings are written as JSON to compare runs across commits. Run from the
+repository root:
+
+    python -m benchmarks.suite --players 50 --matches 10000 --output results.json
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .league import add_league_arguments, generate_league, league_arguments
+
+
+def measure(func, repeat, setup=None):
+    # Seconds taken by each call, setup excluded
+    timings = []
+    for i in range(repeat):
+        args = setup(i) if setup is not None else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    return {
+        "runs": len(timings),
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "max": max(timings),
+    }
+
+
+def benchmarks(aliases, locales, seed, csv_path):
+    from utils import get_db_engine
+    from utils.cache import clear_caches
+    from utils.elo import recompute_elo
+    from utils.games import (
+        edit_match,
+        get_match_info,
+        get_matches_page,
+        get_ranking,
+        register_match,
+    )
+    from utils.importer import import_matches
+
+    rnd = random.Random(seed)
+    conn = get_db_engine()
+
+    def random_match(i):
+        blue_att, blue_def, red_att, red_def = rnd.sample(aliases, 4)
+        blue_score, red_score = 10, rnd.randint(0, 9)
+        if rnd.random() < 0.5:
+            blue_score, red_score = red_score, blue_score
+        return (
+            rnd.choice(locales),
+            blue_att,
+            blue_def,
+            red_att,
+            red_def,
+            "2v2",
+            blue_score,
+            red_score,
+        )
+
+    def middle_match(i):
+        # Swapping the scores keeps the match valid, and half of the history
+        # has to be replayed
+        (match_id,) = conn.execute(
+            "SELECT id FROM matches ORDER BY timestamp, id LIMIT 1 OFFSET (SELECT COUNT(*) / 2 FROM matches)"
+        ).fetchone()
+        match = list(get_match_info(match_id))
+        match[7], match[8] = match[8], match[7]
+        return match
+
+    def uncached(i):
+        # Reads are cached until the next write, this measures the queries
+        clear_caches()
+        return ()
+
+    def deep_page(i):
+        clear_caches()
+        (timestamp, match_id) = conn.execute(
+            "SELECT timestamp, id FROM matches ORDER BY timestamp, id LIMIT 1 OFFSET 20"
+        ).fetchone()
+        return ((timestamp, match_id),)
+
+    # name, function, setup
+    return [
+        ("full_recompute", recompute_elo, None),
+        ("match_registration", register_match, random_match),
+        ("match_edit", edit_match, middle_match),
+        ("ranking_query", get_ranking, uncached),
+        ("locale_ranking_query", lambda: get_ranking(locales[0]), uncached),
+        ("history_first_page", lambda: get_matches_page(limit=21), uncached),
+        (
+            "history_deep_page",
+            lambda before: get_matches_page(limit=21, before=before),
+            deep_page,
+        ),
+        (
+            "history_player_page",
+            lambda: get_matches_page(limit=21, alias=aliases[0]),
+            uncached,
+        ),
+        ("csv_import", lambda: import_matches(csv_path), None),
+    ]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(league, repeat, only=None):
+    """
+    Generates the league in a temporary database and runs the benchmarks on it.
+
+    league: keyword arguments of generate_league.
+    repeat: number of timed runs of each benchmark.
+    only: names of the benchmarks to run, all of them when None.
+
+    Returns the results as a JSON serializable dict.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "database.db")
+        os.environ["DATABASE_PATH"] = path
+
+        from utils.backup import export_csv
+        from utils.db import upgrade_database
+        from utils.elo import recompute_elo
+
+        upgrade_database(path)
+        conn = sqlite3.connect(path)
+        try:
+            aliases = generate_league(conn, **league)
+        finally:
+            conn.close()
+        csv_path = os.path.join(tmp, "matches.csv")
+        export_csv(csv_path, "matches", path)
+        recompute_elo()
+
+        results = {}
+        for name, func, setup in benchmarks(
+            aliases, league["locales"], league["seed"], csv_path
+        ):
+            if only is None or name in only:
+                results[name] = summarize(measure(func, repeat, setup))
+
+    return {
+        "commit": git_commit(),
+        "created": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "league": league,
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_league_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", nargs="+", help="names of the benchmarks to run")
+    parser.add_argument("--output", help="JSON file, printed when not given")
+    args = parser.parse_args(argv)
+
+    results = run(league_arguments(args), args.repeat, args.only)
+
+    for name, timing in results["results"].items():
+        print(
+            f"{name:>24}: median {timing['median'] * 1000:9.2f} ms, "
+            f"min {timing['min'] * 1000:9.2f} ms",
+            file=sys.stderr,
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
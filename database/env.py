@@ -1,3 +1,4 @@
+import os
 from logging.config import fileConfig
 
 from sqlalchemy import engine_from_config
@@ -14,6 +15,11 @@ config = context.config
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
+# Follow the database used by the app when it is configured
+database_path = config.attributes.get("database_path", os.environ.get("DATABASE_PATH"))
+if database_path:
+    config.set_main_option("sqlalchemy.url", f"sqlite:///{database_path}")
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
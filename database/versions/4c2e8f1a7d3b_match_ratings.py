@@ -0,0 +1,44 @@
+"""match ratings
+
+Revision ID: 4c2e8f1a7d3b
+Revises: 9bb9b612be14
+Create Date: 2026-10-18 09:12:41.208113
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "4c2e8f1a7d3b"
+down_revision = "9bb9b612be14"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE TABLE IF NOT EXISTS match_ratings (
+        match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        elo_before REAL,
+        elo_after REAL,
+        games_played_before INTEGER,
+        games_played_after INTEGER,
+        games_won_before INTEGER,
+        games_won_after INTEGER,
+        PRIMARY KEY (match_id, player_id)
+    );
+    CREATE INDEX IF NOT EXISTS ix_match_ratings_player_id
+        ON match_ratings (player_id, match_id);
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE IF EXISTS match_ratings"))
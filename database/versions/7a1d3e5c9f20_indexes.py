@@ -0,0 +1,56 @@
+"""indexes
+
+Revision ID: 7a1d3e5c9f20
+Revises: 4c2e8f1a7d3b
+Create Date: 2026-10-18 11:40:03.517730
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "7a1d3e5c9f20"
+down_revision = "4c2e8f1a7d3b"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE INDEX IF NOT EXISTS ix_matches_timestamp
+        ON matches (timestamp);
+    CREATE INDEX IF NOT EXISTS ix_matches_blue_team_att
+        ON matches (blue_team_att, timestamp);
+    CREATE INDEX IF NOT EXISTS ix_matches_blue_team_def
+        ON matches (blue_team_def, timestamp);
+    CREATE INDEX IF NOT EXISTS ix_matches_red_team_att
+        ON matches (red_team_att, timestamp);
+    CREATE INDEX IF NOT EXISTS ix_matches_red_team_def
+        ON matches (red_team_def, timestamp);
+    CREATE INDEX IF NOT EXISTS ix_players_ranking
+        ON players (elo DESC, alias, games_played, games_won, win_rate)
+        WHERE games_played > 0;
+    ANALYZE;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP INDEX IF EXISTS ix_matches_timestamp;
+    DROP INDEX IF EXISTS ix_matches_blue_team_att;
+    DROP INDEX IF EXISTS ix_matches_blue_team_def;
+    DROP INDEX IF EXISTS ix_matches_red_team_att;
+    DROP INDEX IF EXISTS ix_matches_red_team_def;
+    DROP INDEX IF EXISTS ix_players_ranking;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
@@ -0,0 +1,69 @@
+"""seasons
+
+Revision ID: a7c3e1f5d9b2
+Revises: f2b8d4a6c1e3
+Create Date: 2026-10-18 18:12:06.204871
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "a7c3e1f5d9b2"
+down_revision = "f2b8d4a6c1e3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # A season starts at starts_at, when the ratings keep carry_over of their
+    # distance to the initial one (1 keeps them as they are). The ratings right
+    # before that soft reset, i.e. the final standings of the previous season,
+    # are kept by season as checkpoints replays can start from.
+    statements = """
+    CREATE TABLE IF NOT EXISTS seasons (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        starts_at TIMESTAMP NOT NULL UNIQUE,
+        carry_over REAL NOT NULL DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS season_ratings (
+        season_id INTEGER NOT NULL REFERENCES seasons(id) ON DELETE CASCADE,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        elo REAL,
+        games_played INTEGER,
+        games_won INTEGER,
+        win_rate REAL,
+        PRIMARY KEY (season_id, player_id)
+    );
+    CREATE TABLE IF NOT EXISTS season_locale_ratings (
+        season_id INTEGER NOT NULL REFERENCES seasons(id) ON DELETE CASCADE,
+        locale TEXT NOT NULL,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        elo REAL,
+        games_played INTEGER,
+        games_won INTEGER,
+        win_rate REAL,
+        PRIMARY KEY (season_id, locale, player_id)
+    );
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP TABLE IF EXISTS season_locale_ratings;
+    DROP TABLE IF EXISTS season_ratings;
+    DROP TABLE IF EXISTS seasons;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
@@ -0,0 +1,42 @@
+"""history filters
+
+Revision ID: b3f5a2c8d1e4
+Revises: 7a1d3e5c9f20
+Create Date: 2026-10-18 13:05:52.340871
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "b3f5a2c8d1e4"
+down_revision = "7a1d3e5c9f20"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE INDEX IF NOT EXISTS ix_matches_locale
+        ON matches (locale, timestamp);
+    CREATE INDEX IF NOT EXISTS ix_matches_match_type
+        ON matches (match_type, timestamp);
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP INDEX IF EXISTS ix_matches_locale;
+    DROP INDEX IF EXISTS ix_matches_match_type;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
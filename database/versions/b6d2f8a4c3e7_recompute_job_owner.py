@@ -0,0 +1,35 @@
+"""recompute job owner
+
+Revision ID: b6d2f8a4c3e7
+Revises: c4e8a2f6b1d9
+Create Date: 2026-10-19 09:12:48.274915
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "b6d2f8a4c3e7"
+down_revision = "c4e8a2f6b1d9"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Process id of the worker running the job, so that a restarting worker
+    # only requeues the jobs of the processes that are gone
+    statements = """
+    ALTER TABLE recompute_jobs
+        ADD owner INTEGER;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("ALTER TABLE recompute_jobs DROP COLUMN owner"))
@@ -0,0 +1,138 @@
+"""match events
+
+Revision ID: c4e8a2f6b1d9
+Revises: a7c3e1f5d9b2
+Create Date: 2026-10-18 20:41:37.518302
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "c4e8a2f6b1d9"
+down_revision = "a7c3e1f5d9b2"
+branch_labels = None
+depends_on = None
+
+MATCH_COLUMNS = """
+            locale,
+            blue_team_att_id,
+            blue_team_def_id,
+            red_team_att_id,
+            red_team_def_id,
+            match_type,
+            blue_score,
+            red_score,
+            timestamp"""
+
+
+def new_values(row):
+    return ", ".join(f"{row}.{c.strip()}" for c in MATCH_COLUMNS.split(","))
+
+
+# Every change of a match is appended to match_events by these triggers, with
+# the values the match has after the change (before it, for deletions). They
+# hold statements of their own, so they are not split on ";"
+TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS match_events_insert AFTER INSERT ON matches
+    BEGIN
+        INSERT INTO match_events (match_id, event, {MATCH_COLUMNS})
+        VALUES (
+            NEW.id,
+            CASE WHEN EXISTS (SELECT 1 FROM match_events WHERE match_id = NEW.id)
+                THEN 'restored' ELSE 'created' END,
+            {new_values("NEW")}
+        );
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS match_events_update AFTER UPDATE ON matches
+    WHEN {" OR ".join(f"NEW.{c.strip()} IS NOT OLD.{c.strip()}" for c in MATCH_COLUMNS.split(","))}
+    BEGIN
+        INSERT INTO match_events (match_id, event, {MATCH_COLUMNS})
+        VALUES (NEW.id, 'edited', {new_values("NEW")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS match_events_delete AFTER DELETE ON matches
+    BEGIN
+        INSERT INTO match_events (match_id, event, {MATCH_COLUMNS})
+        VALUES (OLD.id, 'deleted', {new_values("OLD")});
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS match_events_no_update BEFORE UPDATE ON match_events
+    BEGIN
+        SELECT RAISE(ABORT, 'match_events is append-only');
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS match_events_no_delete BEFORE DELETE ON match_events
+    BEGIN
+        SELECT RAISE(ABORT, 'match_events is append-only');
+    END
+    """,
+]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # The log starts with the creation of the existing matches. The player
+    # ratings after every SNAPSHOT_INTERVAL events (see utils.events) are kept in
+    # rating_snapshots, folding the log from there on is cheaper than replaying it
+    statements = f"""
+    CREATE TABLE IF NOT EXISTS match_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_id INTEGER NOT NULL,
+        event TEXT NOT NULL,
+        locale TEXT,
+        blue_team_att_id INTEGER,
+        blue_team_def_id INTEGER,
+        red_team_att_id INTEGER,
+        red_team_def_id INTEGER,
+        match_type TEXT,
+        blue_score INTEGER,
+        red_score INTEGER,
+        timestamp TIMESTAMP,
+        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS ix_match_events_match_id
+        ON match_events (match_id, id);
+    INSERT INTO match_events (match_id, event, {MATCH_COLUMNS}, recorded_at)
+        SELECT id, 'created', {MATCH_COLUMNS}, timestamp
+        FROM matches
+        ORDER BY timestamp, id;
+    CREATE TABLE IF NOT EXISTS rating_snapshots (
+        event_id INTEGER NOT NULL,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        elo REAL,
+        games_played INTEGER,
+        games_won INTEGER,
+        PRIMARY KEY (event_id, player_id)
+    );
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+    for q in TRIGGERS:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP TRIGGER IF EXISTS match_events_no_delete;
+    DROP TRIGGER IF EXISTS match_events_no_update;
+    DROP TRIGGER IF EXISTS match_events_delete;
+    DROP TRIGGER IF EXISTS match_events_update;
+    DROP TRIGGER IF EXISTS match_events_insert;
+    DROP TABLE IF EXISTS rating_snapshots;
+    DROP TABLE IF EXISTS match_events;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
@@ -0,0 +1,62 @@
+"""locale ratings
+
+Revision ID: c8e4a6f2b915
+Revises: b3f5a2c8d1e4
+Create Date: 2026-10-18 16:02:17.553104
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "c8e4a6f2b915"
+down_revision = "b3f5a2c8d1e4"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE TABLE IF NOT EXISTS locale_ratings (
+        locale TEXT NOT NULL,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        elo REAL,
+        games_played INTEGER,
+        games_won INTEGER,
+        win_rate REAL,
+        PRIMARY KEY (locale, player_id)
+    );
+    CREATE INDEX IF NOT EXISTS ix_locale_ratings_ranking
+        ON locale_ratings (locale, elo DESC, player_id, games_played, games_won, win_rate)
+        WHERE games_played > 0;
+    CREATE TABLE IF NOT EXISTS locale_match_ratings (
+        match_id INTEGER NOT NULL REFERENCES matches(id) ON DELETE CASCADE,
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        locale TEXT NOT NULL,
+        elo_before REAL,
+        elo_after REAL,
+        games_played_before INTEGER,
+        games_played_after INTEGER,
+        games_won_before INTEGER,
+        games_won_after INTEGER,
+        PRIMARY KEY (match_id, player_id)
+    );
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP TABLE IF EXISTS locale_match_ratings;
+    DROP TABLE IF EXISTS locale_ratings;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
@@ -0,0 +1,42 @@
+"""recompute jobs
+
+Revision ID: d5b1f7e3a2c6
+Revises: c8e4a6f2b915
+Create Date: 2026-10-18 16:09:41.870263
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "d5b1f7e3a2c6"
+down_revision = "c8e4a6f2b915"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE TABLE IF NOT EXISTS recompute_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_match_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'queued',
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS ix_recompute_jobs_status
+        ON recompute_jobs (status, id);
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(text("DROP TABLE IF EXISTS recompute_jobs"))
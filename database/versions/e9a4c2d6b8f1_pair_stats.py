@@ -0,0 +1,57 @@
+"""pair stats
+
+Revision ID: e9a4c2d6b8f1
+Revises: d5b1f7e3a2c6
+Create Date: 2026-10-18 16:31:08.126734
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "e9a4c2d6b8f1"
+down_revision = "d5b1f7e3a2c6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Snapshots are dropped so that the next write replays the whole history,
+    # which fills the new columns and the pair statistics
+    statements = """
+    ALTER TABLE match_ratings ADD COLUMN side TEXT;
+    ALTER TABLE match_ratings ADD COLUMN role TEXT;
+    ALTER TABLE match_ratings ADD COLUMN goal_difference INTEGER;
+    DELETE FROM match_ratings;
+    CREATE TABLE IF NOT EXISTS pair_stats (
+        player_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        relation TEXT NOT NULL,
+        other_id INTEGER NOT NULL REFERENCES players(id) ON DELETE CASCADE,
+        role TEXT NOT NULL,
+        games INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        goal_difference INTEGER NOT NULL DEFAULT 0,
+        elo_delta REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (player_id, relation, other_id, role)
+    );
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    DROP TABLE IF EXISTS pair_stats;
+    ALTER TABLE match_ratings DROP COLUMN goal_difference;
+    ALTER TABLE match_ratings DROP COLUMN role;
+    ALTER TABLE match_ratings DROP COLUMN side;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
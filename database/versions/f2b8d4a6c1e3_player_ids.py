@@ -0,0 +1,146 @@
+"""player ids
+
+Revision ID: f2b8d4a6c1e3
+Revises: e9a4c2d6b8f1
+Create Date: 2026-10-18 17:05:42.518390
+
+"""
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy import text
+
+# revision identifiers, used by Alembic.
+revision = "f2b8d4a6c1e3"
+down_revision = "e9a4c2d6b8f1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    # Aliases are matched regardless of case, and the ones not registered yet
+    # become players so that no match loses its teams. Snapshots are dropped so
+    # that the next write replays the whole history with the new players.
+    statements = """
+    INSERT INTO players (alias, elo, games_played, games_won)
+        SELECT MIN(alias), 1000, 0, 0
+        FROM (
+            SELECT blue_team_att AS alias FROM matches
+            UNION SELECT blue_team_def FROM matches
+            UNION SELECT red_team_att FROM matches
+            UNION SELECT red_team_def FROM matches
+        )
+        WHERE alias IS NOT NULL
+            AND LOWER(alias) NOT IN (SELECT LOWER(alias) FROM players WHERE alias IS NOT NULL)
+        GROUP BY LOWER(alias);
+    CREATE TABLE matches_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        locale TEXT,
+        blue_team_att_id INTEGER REFERENCES players(id),
+        blue_team_def_id INTEGER REFERENCES players(id),
+        red_team_att_id INTEGER REFERENCES players(id),
+        red_team_def_id INTEGER REFERENCES players(id),
+        match_type TEXT,
+        blue_score INTEGER,
+        red_score INTEGER,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TEMP TABLE player_ids (alias TEXT PRIMARY KEY, id INTEGER);
+    INSERT INTO player_ids
+        SELECT LOWER(alias), MIN(id) FROM players
+        WHERE alias IS NOT NULL
+        GROUP BY LOWER(alias);
+    INSERT INTO matches_new
+        SELECT
+            m.id,
+            m.locale,
+            ba.id,
+            bd.id,
+            ra.id,
+            rd.id,
+            m.match_type,
+            m.blue_score,
+            m.red_score,
+            m.timestamp
+        FROM matches m
+        LEFT JOIN player_ids ba ON ba.alias = LOWER(m.blue_team_att)
+        LEFT JOIN player_ids bd ON bd.alias = LOWER(m.blue_team_def)
+        LEFT JOIN player_ids ra ON ra.alias = LOWER(m.red_team_att)
+        LEFT JOIN player_ids rd ON rd.alias = LOWER(m.red_team_def);
+    DROP TABLE player_ids;
+    DROP TABLE matches;
+    ALTER TABLE matches_new RENAME TO matches;
+    CREATE INDEX ix_matches_timestamp
+        ON matches (timestamp);
+    CREATE INDEX ix_matches_blue_team_att_id
+        ON matches (blue_team_att_id, timestamp);
+    CREATE INDEX ix_matches_blue_team_def_id
+        ON matches (blue_team_def_id, timestamp);
+    CREATE INDEX ix_matches_red_team_att_id
+        ON matches (red_team_att_id, timestamp);
+    CREATE INDEX ix_matches_red_team_def_id
+        ON matches (red_team_def_id, timestamp);
+    CREATE INDEX ix_matches_locale
+        ON matches (locale, timestamp);
+    CREATE INDEX ix_matches_match_type
+        ON matches (match_type, timestamp);
+    DELETE FROM match_ratings;
+    ANALYZE;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    statements = """
+    CREATE TABLE matches_old (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        locale TEXT,
+        blue_team_att TEXT,
+        blue_team_def TEXT,
+        red_team_att TEXT,
+        red_team_def TEXT,
+        match_type TEXT,
+        blue_score INTEGER,
+        red_score INTEGER,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO matches_old
+        SELECT
+            m.id,
+            m.locale,
+            (SELECT alias FROM players WHERE id = m.blue_team_att_id),
+            (SELECT alias FROM players WHERE id = m.blue_team_def_id),
+            (SELECT alias FROM players WHERE id = m.red_team_att_id),
+            (SELECT alias FROM players WHERE id = m.red_team_def_id),
+            m.match_type,
+            m.blue_score,
+            m.red_score,
+            m.timestamp
+        FROM matches m;
+    DROP TABLE matches;
+    ALTER TABLE matches_old RENAME TO matches;
+    CREATE INDEX ix_matches_timestamp
+        ON matches (timestamp);
+    CREATE INDEX ix_matches_blue_team_att
+        ON matches (blue_team_att, timestamp);
+    CREATE INDEX ix_matches_blue_team_def
+        ON matches (blue_team_def, timestamp);
+    CREATE INDEX ix_matches_red_team_att
+        ON matches (red_team_att, timestamp);
+    CREATE INDEX ix_matches_red_team_def
+        ON matches (red_team_def, timestamp);
+    CREATE INDEX ix_matches_locale
+        ON matches (locale, timestamp);
+    CREATE INDEX ix_matches_match_type
+        ON matches (match_type, timestamp);
+    DELETE FROM match_ratings;
+    ANALYZE;
+    """.split(
+        ";"
+    )
+    for q in statements:
+        conn.execute(text(q))
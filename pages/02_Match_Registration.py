@@ -1,11 +1,35 @@
 import streamlit as st
-from utils import LOCALES, get_db_cursor, get_db_engine, page_init
-from utils.elo import calculate_elo_rating
-from utils.games import get_player_aliases, valid_goals, valid_teams
+from utils import LOCALES, page_init
+from utils.elo import win_probability_matrix
+from utils.games import (
+    delete_match,
+    get_player_aliases,
+    get_player_ratings,
+    register_match,
+    valid_goals,
+    valid_teams,
+)
+from utils.helpers import session
+from utils.metrics import timed_page
 
 page_init("Match Registration")
 
 
+def show_prediction(blue_team, red_team):
+    ratings = get_player_ratings()
+    players = [alias for alias in (*blue_team, *red_team) if alias in ratings]
+    # Nothing to predict until every player is selected, once
+    if len(set(players)) != len(blue_team) + len(red_team):
+        return
+
+    blue = range(len(blue_team))
+    red = range(len(blue_team), len(players))
+    probabilities = win_probability_matrix(
+        [ratings[alias] for alias in players], teams=[blue, red]
+    )
+    st.caption(f"Predicted: Blue Team wins {probabilities[0, 1]:.0%} of the time")
+
+
 def register_1v1_match():
     st.write("1v1 Match")
     st.write("Enter the details:")
@@ -30,6 +54,8 @@ def register_1v1_match():
             "Score", min_value=0, max_value=10, step=1, key="blue_score"
         )
 
+    show_prediction([blue_alias], [red_alias])
+
     # Submit button
     if st.button("Register"):
         log_match(
@@ -63,6 +89,8 @@ def register_2v2_match():
             "Score", min_value=0, max_value=10, step=1, key="blue_score"
         )
 
+    show_prediction([blue_att, blue_def], [red_att, red_def])
+
     # Submit button
     if st.button("Register"):
         log_match(
@@ -86,94 +114,44 @@ def log_match(
     if not valid_goals(blue_score, red_score):
         return st.error("One team must have scored ten goals")
 
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
-
-    # Insert the new player into the database with a starting Elo score of 1000
-    c.execute(
-        "INSERT INTO matches (locale, blue_team_att, blue_team_def, red_team_att, red_team_def, match_type, blue_score, red_score) "
-        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-        (
-            locale,
-            blue_team_att,
-            blue_team_def,
-            red_team_att,
-            red_team_def,
-            match_type,
-            blue_score,
-            red_score,
-        ),
-    )
-    conn.commit()
-
-    # Update elo for all players:
-    # Get Elo for each player
-    blue_team_elo = c.execute(
-        "SELECT alias, elo, games_played, games_won FROM players WHERE alias IN (?, ?)",
-        [blue_team_att, blue_team_def],
-    ).fetchall()
-    red_team_elo = c.execute(
-        "SELECT alias, elo, games_played, games_won FROM players WHERE alias IN (?, ?)",
-        [red_team_att, red_team_def],
-    ).fetchall()
-
-    blue_team_new_elo, red_team_new_elo = calculate_elo_rating(
-        [_[1] for _ in blue_team_elo],
-        [_[1] for _ in red_team_elo],
-        1 * (blue_score == 10),
-        k_factor=40,
+    match_id = register_match(
+        locale,
+        blue_team_att,
+        blue_team_def,
+        red_team_att,
+        red_team_def,
+        match_type,
+        blue_score,
+        red_score,
     )
-
-    for i, (player_, _, games_played_, games_won_) in enumerate(blue_team_elo):
-        new_games_played_ = games_played_ + 1
-        new_games_won_ = games_won_ + 1 * (blue_score == 10)
-        new_win_rate = new_games_won_ / new_games_played_
-        c.execute(
-            """
-            UPDATE players
-            SET elo = ?, games_played = ?, games_won = ?, win_rate = ?
-            WHERE alias = ?;
-            """,
-            [
-                blue_team_new_elo[i],
-                new_games_played_,
-                new_games_won_,
-                new_win_rate,
-                player_,
-            ],
-        )
-        conn.commit()
-
-    for i, (player_, _, games_played_, games_won_) in enumerate(red_team_elo):
-        new_games_played_ = games_played_ + 1
-        new_games_won_ = games_won_ + 1 * (blue_score != 10)
-        new_win_rate = new_games_won_ / new_games_played_
-        c.execute(
-            """
-            UPDATE players
-            SET elo = ?, games_played = ?, games_won = ?, win_rate = ?
-            WHERE alias = ?;
-            """,
-            [
-                red_team_new_elo[i],
-                new_games_played_,
-                new_games_won_,
-                new_win_rate,
-                player_,
-            ],
-        )
-        conn.commit()
+    session("registered_match", match_id)
 
     st.success("Match registered successfully!")
 
 
-st.write("Register a new match")
+def undo_registration(match_id):
+    # e.g. after a double click on Register: the latest match is rolled back
+    # from its own rating snapshots
+    delete_match(match_id)
+    session("registered_match", None)
+
 
-# Get user input for game type
-game_type = st.selectbox("Game Type", ["1v1", "2v2"])
+with timed_page("Match Registration"):
+    st.write("Register a new match")
 
-# Register match based on game type
-if game_type == "1v1":
-    register_1v1_match()
-elif game_type == "2v2":
-    register_2v2_match()
+    # Get user input for game type
+    game_type = st.selectbox("Game Type", ["1v1", "2v2"])
+
+    # Register match based on game type
+    if game_type == "1v1":
+        register_1v1_match()
+    elif game_type == "2v2":
+        register_2v2_match()
+
+    registered = session("registered_match", init=None)
+    if registered is not None:
+        st.button(
+            f"Undo registration of match {registered}",
+            on_click=undo_registration,
+            args=(registered,),
+        )
@@ -1,38 +1,24 @@
+import datetime as dt
+
 import pandas as pd
 import streamlit as st
-from utils import LOCALES, get_db_cursor, get_db_engine, page_init
-from utils.elo import recompute_elo
-from utils.games import get_player_aliases, valid_goals, valid_teams
+from utils import LOCALES, page_init
+from utils.events import get_match_events, revert_edit
+from utils.games import (
+    delete_match,
+    edit_match,
+    get_match_info,
+    get_matches_page,
+    get_player_aliases,
+    restore_match,
+    valid_goals,
+    valid_teams,
+)
+from utils.helpers import session, wait_for_job
+from utils.metrics import timed_page
 
 
 # Helper functions for database operations
-def get_match_info(game_id):
-    # Retrieve match information from the database based on the game_id
-
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
-
-    c.execute(
-        """
-        SELECT 
-            id,
-            locale,
-            blue_team_att,
-            blue_team_def,
-            red_team_att,
-            red_team_def,
-            match_type,
-            blue_score,
-            red_score
-        FROM matches 
-        WHERE id = ?
-    """,
-        (game_id,),
-    )
-    match = c.fetchone()
-    return match
-
-
 def update_match_info(
     game_id,
     locale,
@@ -50,51 +36,8 @@ def update_match_info(
     if not valid_goals(blue_score, red_score):
         return st.error("One team must have scored ten goals")
 
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
-
-    # Update the match information in the database based on the game_id
-    c.execute(
-        """
-        UPDATE matches 
-        SET 
-            locale = ?,
-            blue_team_att = ?,
-            blue_team_def = ?,
-            red_team_att = ?,
-            red_team_def = ?,
-            match_type = ?,
-            blue_score = ?,
-            red_score = ?
-        WHERE id = ?
-    """,
-        (
-            locale,
-            blue_team_att,
-            blue_team_def,
-            red_team_att,
-            red_team_def,
-            match_type,
-            blue_score,
-            red_score,
-            game_id,
-        ),
-    )
-    conn.commit()
-
-    st.success("Match successfully Edited.")
-
-
-page_init("Match History")
-
-conn = get_db_engine()
-c = get_db_cursor(conn)
-
-# Retrieve player rankings from the database
-c.execute(
-    """
-    SELECT 
-        id,
+    job_id = edit_match(
+        game_id,
         locale,
         blue_team_att,
         blue_team_def,
@@ -103,131 +46,261 @@ c.execute(
         match_type,
         blue_score,
         red_score,
-        timestamp
-    FROM matches 
-    ORDER BY timestamp DESC
-    LIMIT 10
-"""
-)
-matches = pd.DataFrame(
-    c.fetchall(),
-    columns=[
-        "GAME_ID",
-        "LOCALE",
-        "BLUE_TEAM_ATT",
-        "BLUE_TEAM_DEF",
-        "RED_TEAM_ATT",
-        "RED_TEAM_DEF",
-        "MATCH_TYPE",
-        "BLUE_SCORE",
-        "RED_SCORE",
-        "TIMESTAMP",
-    ],
-).fillna(
-    {
-        "BLUE_TEAM_ATT": "",
-        "BLUE_TEAM_DEF": "",
-        "RED_TEAM_ATT": "",
-        "RED_TEAM_DEF": "",
+        background=True,
+    )
+
+    st.success("Match successfully Edited.")
+    show_recompute(job_id)
+
+
+def show_recompute(job_id):
+    job = wait_for_job(job_id)
+    if job is not None and job["status"] == "failed":
+        st.error(f"ELO recompute failed: {job['error']}")
+    else:
+        st.write("ELO scores recomputed.")
+
+
+def remove_match(game_id):
+    delete_match(game_id)
+    session("deleted_match", game_id)
+
+
+def undo_delete(game_id):
+    restore_match(game_id)
+    session("deleted_match", None)
+
+
+PAGE_SIZE = 20
+
+
+def fetch_page(cursor, filters):
+    # One more match than needed tells whether there is a page after this one
+    direction, key = cursor or (None, None)
+    return get_matches_page(
+        limit=PAGE_SIZE + 1,
+        before=key if direction == "before" else None,
+        after=key if direction == "after" else None,
+        **filters,
+    )
+
+
+page_init("Match History")
+
+with timed_page("Match History"):
+    with st.expander("Filters"):
+        col1, col2, col3 = st.columns(3)
+        alias_filter = col1.selectbox("Player", ["All", *get_player_aliases()])
+        locale_filter = col2.selectbox("Locale", ["All", *LOCALES])
+        match_type_filter = col3.selectbox("Game Type", ["All", "1v1", "2v2"])
+
+        date_range = ()
+        if st.checkbox("Filter by date"):
+            date_range = st.date_input(
+                "Dates",
+                value=(dt.date.today() - dt.timedelta(days=30), dt.date.today()),
+            )
+
+    filters = {
+        "alias": None if alias_filter == "All" else alias_filter,
+        "locale": None if locale_filter == "All" else locale_filter,
+        "match_type": None if match_type_filter == "All" else match_type_filter,
+        "date_from": date_range[0] if len(date_range) == 2 else None,
+        "date_to": date_range[1] if len(date_range) == 2 else None,
     }
-)
 
-st.table(matches)
+    # Start from the newest matches whenever the filters change
+    if session("history_filters", init=filters) != filters:
+        session("history_filters", filters)
+        session("history_cursor", None)
+
+    # The cursor is the (timestamp, id) of the match the page starts after
+    cursor = session("history_cursor", init=None)
+    rows = fetch_page(cursor, filters)
+    if cursor is not None and cursor[0] == "after" and len(rows) <= PAGE_SIZE:
+        # Back to the newest matches
+        cursor = session("history_cursor", None)
+        rows = fetch_page(cursor, filters)
 
-with st.expander("Edit Match"):
-    # Fields to edit match
-    game_id = st.text_input("Enter the Game ID to edit:", value=matches.iloc[0].GAME_ID)
-    match = get_match_info(game_id)
+    if cursor is not None and cursor[0] == "after":
+        rows = rows[-PAGE_SIZE:]
+        has_newer, has_older = True, True
+    else:
+        has_newer, has_older = cursor is not None, len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
 
-    if not match:
-        st.write("Game ID not found.")
+    if not rows:
+        st.write("No matches found.")
         st.stop()
 
-    all_players = get_player_aliases()
-
-    locale = match[1]
-    match_type = match[6]
-    blue_team_att = match[2]
-    blue_team_att_ix = all_players.index(str(blue_team_att))
-    blue_team_def = match[3]
-    blue_team_def_ix = 0
-    if match_type == "2v2":
-        blue_team_def_ix = all_players.index(str(blue_team_def))
-    red_team_att = match[4]
-    red_team_att_ix = all_players.index(str(red_team_att))
-    red_team_def = match[5]
-    red_team_def_ix = 0
-    if match_type == "2v2":
-        red_team_def_ix = all_players.index(str(red_team_def))
-        alias_title = "Attacker alias"
-    else:
-        alias_title = "Alias"
-    blue_score = match[7]
-    red_score = match[8]
+    matches = pd.DataFrame(
+        rows,
+        columns=[
+            "GAME_ID",
+            "LOCALE",
+            "BLUE_TEAM_ATT",
+            "BLUE_TEAM_DEF",
+            "RED_TEAM_ATT",
+            "RED_TEAM_DEF",
+            "MATCH_TYPE",
+            "BLUE_SCORE",
+            "RED_SCORE",
+            "TIMESTAMP",
+        ],
+    ).fillna(
+        {
+            "BLUE_TEAM_ATT": "",
+            "BLUE_TEAM_DEF": "",
+            "RED_TEAM_ATT": "",
+            "RED_TEAM_DEF": "",
+        }
+    )
+
+    deleted = session("deleted_match", init=None)
+    if deleted is not None:
+        col1, col2 = st.columns([5, 1])
+        col1.info(f"Match {deleted} deleted and ELO scores recomputed.")
+        col2.button("Undo", on_click=undo_delete, args=(deleted,))
 
-    locale = st.selectbox("locale", LOCALES, index=LOCALES.index(locale))
-    match_type_sel = st.selectbox(
-        "Game Type", ["1v1", "2v2"], index=["1v1", "2v2"].index(match_type)
+    st.table(matches)
+
+    col1, _, col2 = st.columns([1, 4, 1])
+    col1.button(
+        "⬅ Newer",
+        disabled=not has_newer,
+        on_click=session,
+        args=("history_cursor", ("after", (rows[0][9], rows[0][0]))),
+    )
+    col2.button(
+        "Older ➡",
+        disabled=not has_older,
+        on_click=session,
+        args=("history_cursor", ("before", (rows[-1][9], rows[-1][0]))),
     )
-    # Missing locale and game type
-
-    col1, col2 = st.columns(2)
-    # Get user input for team aliases
-    with col1:
-        st.write("Red Team:")
-        red_att = st.selectbox(
-            alias_title, all_players, key="red_att", index=red_team_att_ix
+
+    with st.expander("Edit Match"):
+        # Fields to edit match
+        labels = {
+            m[0]: f"{m[0]} - {m[9]}: "
+            f"{' & '.join(filter(None, m[2:4]))} vs {' & '.join(filter(None, m[4:6]))}"
+            for m in rows
+        }
+        game_id = st.selectbox(
+            "Select the match to edit:", list(labels), format_func=labels.get
         )
-        if match_type_sel == "2v2":
-            red_def = st.selectbox(
-                "Defender alias", all_players, key="red_def", index=red_team_def_ix
-            )
+        match = get_match_info(game_id)
+
+        if not match:
+            st.write("Game ID not found.")
+            st.stop()
+
+        all_players = get_player_aliases()
+        positions = {alias: i for i, alias in enumerate(all_players)}
+
+        locale = match[1]
+        match_type = match[6]
+        blue_team_att = match[2]
+        blue_team_att_ix = positions.get(blue_team_att, 0)
+        blue_team_def = match[3]
+        blue_team_def_ix = 0
+        if match_type == "2v2":
+            blue_team_def_ix = positions.get(blue_team_def, 0)
+        red_team_att = match[4]
+        red_team_att_ix = positions.get(red_team_att, 0)
+        red_team_def = match[5]
+        red_team_def_ix = 0
+        if match_type == "2v2":
+            red_team_def_ix = positions.get(red_team_def, 0)
+            alias_title = "Attacker alias"
         else:
-            red_def = None
-        red_score_ = st.number_input(
-            "Score",
-            min_value=0,
-            max_value=10,
-            step=1,
-            key="red_score",
-            value=red_score,
-        )
+            alias_title = "Alias"
+        blue_score = match[7]
+        red_score = match[8]
 
-    with col2:
-        st.write("Blue Team:")
-        blue_att = st.selectbox(
-            alias_title, all_players, key="blue_att", index=blue_team_att_ix
+        locale = st.selectbox("locale", LOCALES, index=LOCALES.index(locale))
+        match_type_sel = st.selectbox(
+            "Game Type", ["1v1", "2v2"], index=["1v1", "2v2"].index(match_type)
         )
-        if match_type_sel == "2v2":
-            blue_def = st.selectbox(
-                "Defender alias",
-                all_players,
-                key="blue_def",
-                index=blue_team_def_ix,
+        # Missing locale and game type
+
+        col1, col2 = st.columns(2)
+        # Get user input for team aliases
+        with col1:
+            st.write("Red Team:")
+            red_att = st.selectbox(
+                alias_title, all_players, key="red_att", index=red_team_att_ix
+            )
+            if match_type_sel == "2v2":
+                red_def = st.selectbox(
+                    "Defender alias", all_players, key="red_def", index=red_team_def_ix
+                )
+            else:
+                red_def = None
+            red_score_ = st.number_input(
+                "Score",
+                min_value=0,
+                max_value=10,
+                step=1,
+                key="red_score",
+                value=red_score,
             )
-        else:
-            blue_def = None
-        blue_score_ = st.number_input(
-            "Score",
-            min_value=0,
-            max_value=10,
-            step=1,
-            key="blue_score",
-            value=blue_score,
-        )
 
-    # Save button
-    if st.button("Save"):
-        update_match_info(
-            game_id,
-            locale,
-            blue_att,
-            blue_def,
-            red_att,
-            red_def,
-            match_type_sel,
-            blue_score_,
-            red_score_,
+        with col2:
+            st.write("Blue Team:")
+            blue_att = st.selectbox(
+                alias_title, all_players, key="blue_att", index=blue_team_att_ix
+            )
+            if match_type_sel == "2v2":
+                blue_def = st.selectbox(
+                    "Defender alias",
+                    all_players,
+                    key="blue_def",
+                    index=blue_team_def_ix,
+                )
+            else:
+                blue_def = None
+            blue_score_ = st.number_input(
+                "Score",
+                min_value=0,
+                max_value=10,
+                step=1,
+                key="blue_score",
+                value=blue_score,
+            )
+
+        # Save button
+        if st.button("Save"):
+            update_match_info(
+                game_id,
+                locale,
+                blue_att,
+                blue_def,
+                red_att,
+                red_def,
+                match_type_sel,
+                blue_score_,
+                red_score_,
+            )
+        st.button("Delete match", on_click=remove_match, args=(game_id,))
+
+        changes = get_match_events(game_id)
+        st.write("Changes:")
+        st.table(
+            pd.DataFrame(
+                [
+                    (
+                        e[1],
+                        e[2],
+                        e[4],
+                        " & ".join(filter(None, e[5:7])),
+                        " & ".join(filter(None, e[7:9])),
+                        f"{e[10]} - {e[11]}",
+                    )
+                    for e in changes
+                ],
+                columns=["RECORDED_AT", "EVENT", "LOCALE", "BLUE", "RED", "SCORE"],
+            )
         )
-        recompute_elo()
-        st.write("ELO scores recomputed.")
+        if changes and changes[0][2] == "edited" and st.button("Undo last edit"):
+            revert_edit(game_id)
+            st.success("Edit undone and ELO scores recomputed.")
@@ -1,162 +1,242 @@
 import datetime as dt
+import os
+import tempfile
 
 import pandas as pd
 import streamlit as st
 from utils import get_db_cursor, get_db_engine, page_init
-from utils.helpers import download_string_as_file
+from utils.backup import backup_database, dump_database
+from utils.events import get_match_events, get_ratings_at
+from utils.games import TEAM_JOINS
+from utils.helpers import download_string_as_file, wait_for_job
+from utils.importer import import_matches, import_players
+from utils.jobs import submit_recompute
+from utils.metrics import METRICS, timed_page
+from utils.parquet import export_parquet, import_parquet
+from utils.seasons import delete_season, get_season_list, start_season
 
 USER = "admin"
 PASSWORD = "admin"
 
 page_init("Admin")
 
-col1, col2 = st.columns(2)
+with timed_page("Admin"):
+    col1, col2 = st.columns(2)
 
-usr = col1.text_input("Username")
-pwd = col2.text_input("Password", type="password")
+    usr = col1.text_input("Username")
+    pwd = col2.text_input("Password", type="password")
 
-if not (usr == USER and pwd == PASSWORD):
-    st.subheader("Please log in")
-    st.stop()
+    if not (usr == USER and pwd == PASSWORD):
+        st.subheader("Please log in")
+        st.stop()
 
+    def reset_db():
+        from sqlalchemy import text
 
-def reset_db():
-    from sqlalchemy import text
+        engine = get_db_engine()
 
-    engine = get_db_engine()
-
-    with engine.connect() as con:
-        sql = text(
-            "select 'drop table ' || name || ';' from sqlite_master where type = 'table';"
+        with engine.connect() as con:
+            sql = text(
+                "select 'drop table ' || name || ';' from sqlite_master where type = 'table';"
+            )
+            result = con.execute(sql)
+            statements = [row[0] for row in result]
+
+            for s in statements:
+                con.execute(text(s))
+
+    def copy_db(export_format, compress):
+        file_name = EXPORT_FILES[export_format]
+        # Parquet files are compressed already
+        if compress and export_format != "Parquet":
+            file_name += ".gz"
+
+        # Export a snapshot to a temporary file, which the download button then serves
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, file_name)
+            if export_format == "SQLite file":
+                backup_database(path, compress)
+            elif export_format == "SQL dump":
+                dump_database(path, compress)
+            else:
+                export_parquet(path)
+
+            with open(path, "rb") as f:
+                st.download_button(
+                    f"Save {file_name}",
+                    f,
+                    file_name=f"{dt.date.today()}_{file_name}",
+                    mime="application/octet-stream",
+                )
+
+    EXPORT_FILES = {
+        "SQLite file": "database.db",
+        "SQL dump": "database.sql",
+        "Parquet": "league.zip",
+    }
+
+    col1, col2, col3 = st.columns(3)
+
+    export_format = col3.selectbox("Export format", list(EXPORT_FILES))
+    compress = col3.checkbox("Compress (gzip)")
+
+    if col1.button("Download DB"):
+        copy_db(export_format, compress)
+
+    if col2.button("Update DB (Run migrations)"):
+        import alembic.config
+
+        alembicArgs = [
+            "--raiseerr",
+            "upgrade",
+            "head",
+        ]
+        alembic.config.main(argv=alembicArgs)
+        st.success("You are done!")
+
+    if col2.button("Recompute ELO"):
+        # Requests made while a recompute runs are merged into the next one
+        job = wait_for_job(submit_recompute())
+        if job["status"] == "failed":
+            st.error(f"ELO recompute failed: {job['error']}")
+        else:
+            st.success("ELO scores recomputed.")
+
+    st.subheader("Seasons")
+
+    seasons = get_season_list()
+    if seasons:
+        st.dataframe(
+            pd.DataFrame(
+                seasons, columns=["id", "name", "starts_at", "carry_over", "ends_at"]
+            ).set_index("id")
         )
-        result = con.execute(sql)
-        statements = [row[0] for row in result]
-
-        for s in statements:
-            con.execute(text(s))
-
-
-def copy_db():
-    con = get_db_engine().raw_connection()
-    contents = ""
-    for line in con.iterdump():
-        contents = contents + ("%s\n" % line)
-    return contents
-
-
-col1, col2, col3 = st.columns(3)
-
-if col1.button("Download DB"):
-    download_string_as_file(copy_db(), "database.sql")
-    st.success("You are done!")
-
-if col2.button("Update DB (Run migrations)"):
-    import alembic.config
-
-    alembicArgs = [
-        "--raiseerr",
-        "upgrade",
-        "head",
-    ]
-    alembic.config.main(argv=alembicArgs)
-    st.success("You are done!")
 
-st.subheader("Upload")
+    col1, col2 = st.columns(2)
 
-col1, col2 = st.columns(2)
+    with col1.form("start_season"):
+        name = st.text_input("Season name")
+        start_date = st.date_input(
+            "Starts on", value=dt.date.today(), max_value=dt.date.today()
+        )
+        carry_over = st.slider(
+            "Rating kept (soft reset)",
+            min_value=0.0,
+            max_value=1.0,
+            value=1.0,
+            help="Share of each player's distance to the initial Elo kept at the start of the season: 0 resets everybody, 1 keeps the ratings as they are.",
+        )
+        if st.form_submit_button("Start season"):
+            # A season starting today starts now, after today's matches
+            starts_at = (
+                None if start_date == dt.date.today() else f"{start_date} 00:00:00"
+            )
+            try:
+                start_season(
+                    name or f"Season {len(seasons) + 1}", starts_at, carry_over
+                )
+                st.success("Season started and Elo recomputed.")
+            except ValueError as e:
+                st.error(e)
+
+    if seasons:
+        names = {s[0]: f"{s[1]} ({s[2]})" for s in seasons}
+        season = col2.selectbox("Season", list(names), format_func=names.get)
+        if col2.button("Delete season"):
+            delete_season(season)
+            col2.success("Season merged into the previous one and Elo recomputed.")
+
+    st.subheader("Audit log")
+
+    events = get_match_events()
+    if events:
+        st.dataframe(
+            pd.DataFrame(
+                events,
+                columns=[
+                    "event_id",
+                    "recorded_at",
+                    "event",
+                    "match_id",
+                    "locale",
+                    "blue_team_att",
+                    "blue_team_def",
+                    "red_team_att",
+                    "red_team_def",
+                    "match_type",
+                    "blue_score",
+                    "red_score",
+                ],
+            ).set_index("event_id")
+        )
 
+        event_id = st.number_input(
+            "Standings right after event",
+            min_value=1,
+            max_value=events[0][0],
+            value=events[0][0],
+            step=1,
+        )
+        st.dataframe(
+            pd.DataFrame(
+                get_ratings_at(int(event_id)),
+                columns=["ALIAS", "ELO", "GAMES", "GAMES WON", "WIN RATE"],
+            )
+        )
 
-def upload_players(df):
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
+    st.subheader("Upload")
 
-    df = df[["alias", "elo", "games_played", "games_won", "win_rate"]]
+    col1, col2 = st.columns(2)
 
-    # df.rename(columns={"index": "id"})
-    c.execute("DELETE FROM players")
-    conn.commit()
-    for i, row in df.iterrows():
-        c.execute(
-            "INSERT INTO players (alias, elo, games_played, games_won, win_rate) VALUES (?, ?, ?, ?, ?)",
-            row,
-        )
-        if i % 10 == 9:
-            conn.commit()
+    def show_upload_report(imported, rejected, name):
+        st.success(f"Done! {imported} {name} imported and Elo recomputed.")
+        if len(rejected):
+            st.warning(f"{len(rejected)} rows were rejected:")
+            st.dataframe(rejected)
 
-    conn.commit()
+    def upload_players(data):
+        imported, rejected = import_players(data)
+        show_upload_report(imported, rejected, "players")
 
-
-with col1:
-    players_data = st.file_uploader("Upload players data")
-    if players_data is not None:
-        # Can be used wherever a "file-like" object is accepted:
-        players = pd.read_csv(players_data)
-        st.write(
-            "Preview the data and please ensure that the dataframe contains the following columns:"
-        )
-        st.text(
-            """
+    with col1:
+        players_data = st.file_uploader("Upload players data")
+        if players_data is not None:
+            # Can be used wherever a "file-like" object is accepted:
+            players = pd.read_csv(players_data, nrows=5)
+            st.write(
+                "Preview the data and please ensure that the dataframe contains the following columns:"
+            )
+            st.text(
+                """
             - alias
             - elo
             - games_played
             - games_won
             - win_rate
             """
-        )
-        st.write(players.head(5))
-        st.write("Note that this will overwrite players table:")
-        if st.button(label="Confirm upload", key="ply_conf"):
-            try:
-                upload_players(players)
-                st.success("Done!")
-            except Exception as e:
-                st.write(e)
-
-
-def upload_matches(df):
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
-
-    try:
-        df = df[
-            [
-                "locale",
-                "blue_team_att",
-                "blue_team_def",
-                "red_team_att",
-                "red_team_def",
-                "match_type",
-                "blue_score",
-                "red_score",
-                "timestamp",
-            ]
-        ]
-
-        # df.rename(columns={"index": "id"})
-        c.execute("DELETE FROM matches")
-        conn.commit()
-        for i, row in df.iterrows():
-            c.execute(
-                "INSERT INTO matches(locale, blue_team_att, blue_team_def, red_team_att, red_team_def, match_type, blue_score, red_score, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                row,
             )
-            if i % 10 == 9:
-                conn.commit()
-        conn.commit()
-    except Exception as e:
-        st.write(e)
-
-
-with col2:
-    match_data = st.file_uploader("Upload match data")
-    if match_data is not None:
-        # Can be used wherever a "file-like" object is accepted:
-        matches = pd.read_csv(match_data)
-        st.write(
-            "Preview the data and please ensure that the dataframe contains the following columns:"
-        )
-        st.text(
-            """
+            st.write(players.head(5))
+            st.write("Note that this will overwrite players table:")
+            if st.button(label="Confirm upload", key="ply_conf"):
+                try:
+                    upload_players(players_data)
+                except Exception as e:
+                    st.write(e)
+
+    def upload_matches(data):
+        imported, rejected = import_matches(data)
+        show_upload_report(imported, rejected, "matches")
+
+    with col2:
+        match_data = st.file_uploader("Upload match data")
+        if match_data is not None:
+            # Can be used wherever a "file-like" object is accepted:
+            matches = pd.read_csv(match_data, nrows=5)
+            st.write(
+                "Preview the data and please ensure that the dataframe contains the following columns:"
+            )
+            st.text(
+                """
             - locale
             - blue_team_att
             - blue_team_def
@@ -166,31 +246,46 @@ with col2:
             - blue_score
             - red_score
             - timestamp"""
+            )
+            st.write(matches.head(5))
+            st.write("Note that this will overwrite matches table:")
+
+            if st.button(
+                label="Confirm upload",
+                key="mtc_conf",
+            ):
+                try:
+                    upload_matches(match_data)
+                except Exception as e:
+                    st.write(e)
+
+    def upload_league(data):
+        rows = import_parquet(data)
+        st.success(
+            f"Done! {rows['players']} players and {rows['matches']} matches restored and Elo recomputed."
         )
-        st.write(matches.head(5))
-        st.write("Note that this will overwrite matches table:")
 
-        if st.button(
-            label="Confirm upload",
-            key="mtc_conf",
-        ):
+    league_data = st.file_uploader(
+        "Restore league (Parquet archive exported above)", type="zip"
+    )
+    if league_data is not None:
+        st.write("Note that this will overwrite both the players and matches tables:")
+        if st.button(label="Confirm restore", key="lg_conf"):
             try:
-                upload_matches(matches)
-                st.success("Done!")
+                upload_league(league_data)
             except Exception as e:
                 st.write(e)
 
-st.subheader("Download")
-
-col1, col2 = st.columns(2)
+    st.subheader("Download")
 
+    col1, col2 = st.columns(2)
 
-def download_players():
-    conn = get_db_engine()
-    c = get_db_cursor(conn)
+    def download_players():
+        conn = get_db_engine()
+        c = get_db_cursor(conn)
 
-    c.execute(
-        """
+        c.execute(
+            """
     SELECT
             alias
             , elo
@@ -199,64 +294,104 @@ def download_players():
             , win_rate
         FROM players 
         """
-    )
-    player_data = c.fetchall()
-    player = pd.DataFrame(
-        player_data, columns=["alias", "elo", "games_played", "games_won", "win_rate"]
-    )
-
-    download_string_as_file(
-        player.to_csv(index=False),
-        f"players_{dt.date.today()}.csv",
-    )
-
+        )
+        player_data = c.fetchall()
+        player = pd.DataFrame(
+            player_data,
+            columns=["alias", "elo", "games_played", "games_won", "win_rate"],
+        )
 
-col1.button(label="Download players data", on_click=download_players)
+        download_string_as_file(
+            player.to_csv(index=False),
+            f"players_{dt.date.today()}.csv",
+        )
 
+    col1.button(label="Download players data", on_click=download_players)
 
-def download_matches():
-    conn = get_db_engine()
-    print(conn)
-    c = get_db_cursor(conn)
+    def download_matches():
+        conn = get_db_engine()
+        print(conn)
+        c = get_db_cursor(conn)
 
-    c.execute(
-        """
+        c.execute(
+            f"""
     SELECT
-            locale
-        , blue_team_att
-        , blue_team_def
-        , red_team_att
-        , red_team_def
-        , match_type
-        , blue_score
-        , red_score
-        , timestamp
-        FROM matches 
+            m.locale
+        , ba.alias
+        , bd.alias
+        , ra.alias
+        , rd.alias
+        , m.match_type
+        , m.blue_score
+        , m.red_score
+        , m.timestamp
+        FROM matches m
+        {TEAM_JOINS}
     """
+        )
+
+        matches_data = c.fetchall()
+        matches = pd.DataFrame(
+            matches_data,
+            columns=[
+                "locale",
+                "blue_team_att",
+                "blue_team_def",
+                "red_team_att",
+                "red_team_def",
+                "match_type",
+                "blue_score",
+                "red_score",
+                "timestamp",
+            ],
+        )
+
+        download_string_as_file(
+            matches.to_csv(index=False), f"matches_{dt.date.today()}.csv"
+        )
+
+    col2.button(
+        label="Download matches data",
+        on_click=download_matches,
     )
 
-    matches_data = c.fetchall()
-    matches = pd.DataFrame(
-        matches_data,
+    st.subheader("Metrics")
+
+    st.write("Queries")
+    queries = pd.DataFrame(
+        METRICS.query_stats(),
         columns=[
-            "locale",
-            "blue_team_att",
-            "blue_team_def",
-            "red_team_att",
-            "red_team_def",
-            "match_type",
-            "blue_score",
-            "red_score",
-            "timestamp",
+            "statement",
+            "calls",
+            "total_ms",
+            "mean_ms",
+            "p95_ms",
+            "max_ms",
+            "rows",
         ],
     )
+    st.dataframe(queries.sort_values("total_ms", ascending=False))
 
-    download_string_as_file(
-        matches.to_csv(index=False), f"matches_{dt.date.today()}.csv"
+    st.write("Page renders")
+    st.dataframe(
+        pd.DataFrame(
+            METRICS.page_stats(),
+            columns=["page", "renders", "mean_ms", "p95_ms", "max_ms"],
+        )
     )
 
+    st.write(f"Slow queries (above {METRICS.slow_query_seconds * 1000:.0f} ms)")
+    st.dataframe(
+        pd.DataFrame(
+            METRICS.slow_query_log(), columns=["time", "ms", "rows", "statement"]
+        )
+    )
 
-col2.button(
-    label="Download matches data",
-    on_click=download_matches,
-)
+    col1, col2 = st.columns(2)
+    col1.download_button(
+        "Download metrics (Prometheus)",
+        METRICS.to_prometheus(),
+        file_name=f"metrics_{dt.date.today()}.prom",
+        mime="text/plain",
+    )
+    col2.button("Reset metrics", on_click=METRICS.reset)
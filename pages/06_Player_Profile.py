@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils import page_init
+from utils.games import get_pair_stats, get_player_aliases, get_rating_history
+from utils.metrics import timed_page
+from utils.profile import lttb, streaks
+
+RECENT_GAMES = 10
+
+page_init("Player Profile")
+
+
+def pair_table(rows):
+    df = pd.DataFrame(
+        rows, columns=["ALIAS", "GAMES", "WINS", "GOAL DIFF", "ELO DELTA"]
+    )
+    df["WIN RATE"] = df["WINS"] / df["GAMES"]
+    df["ELO DELTA"] = df["ELO DELTA"].round(1)
+    return df.sort_values(["WIN RATE", "GAMES"], ascending=False).style.format(
+        {"WIN RATE": "{:.1%}"}
+    )
+
+
+with timed_page("Player Profile"):
+    alias = st.selectbox("Player", get_player_aliases())
+
+    history = get_rating_history(alias) if alias else []
+    if not history:
+        st.info("This player has no registered matches yet.")
+        st.stop()
+
+    timestamps, elo, won = zip(*history)
+    elo = np.array(elo)
+    won = np.array(won, dtype=bool)
+    current, longest_win, longest_loss = streaks(won)
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("ELO", int(elo[-1]), int(elo[-1] - elo[-2]) if len(elo) > 1 else None)
+    col2.metric("Peak ELO", int(elo.max()))
+    col3.metric("Games", len(won))
+    col4.metric("Win rate", f"{won.mean():.1%}")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Current streak", f"{abs(current)} {'won' if current > 0 else 'lost'}")
+    col2.metric("Longest winning streak", longest_win)
+    col3.metric("Longest losing streak", longest_loss)
+    col4.metric(
+        f"Form (last {RECENT_GAMES})",
+        f"{int(won[-RECENT_GAMES:].sum())} - {int((~won[-RECENT_GAMES:]).sum())}",
+    )
+    st.write(
+        "Recent games (oldest first): "
+        + " ".join("🟢" if w else "🔴" for w in won[-RECENT_GAMES:])
+    )
+
+    st.subheader("ELO over time")
+    # Only a few hundred points are sent to the browser, whatever the number of games
+    kept = lttb(np.arange(len(elo)), elo)
+    dates = pd.to_datetime(pd.Series(timestamps).iloc[kept], errors="coerce")
+    st.line_chart(pd.DataFrame({"ELO": elo[kept]}, index=dates))
+    if len(kept) < len(elo):
+        st.caption(f"Showing {len(kept)} of {len(elo)} games.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("Partners")
+        st.dataframe(pair_table(get_pair_stats(alias, "teammate")))
+    with col2:
+        st.subheader("Opponents")
+        st.dataframe(pair_table(get_pair_stats(alias, "opponent")))
@@ -0,0 +1,68 @@
+import altair as alt
+import pandas as pd
+import streamlit as st
+from utils import page_init
+from utils.elo import win_probability_matrix
+from utils.games import get_player_ratings, get_win_probabilities
+from utils.matchmaker import balanced_matches
+from utils.metrics import timed_page
+
+page_init("Matchmaker")
+
+
+def show_matches(present, ratings, limit):
+    matches = balanced_matches([ratings[alias] for alias in present], limit)
+
+    df = pd.DataFrame(
+        [
+            (
+                " & ".join(present[p] for p in blue),
+                " & ".join(present[p] for p in red),
+                f"{probability:.1%}",
+            )
+            for blue, red, probability in matches
+        ],
+        columns=["BLUE TEAM", "RED TEAM", "BLUE WINS"],
+    )
+    df.index += 1
+    st.table(df)
+
+
+def show_heatmap(aliases, probabilities):
+    df = pd.DataFrame(probabilities, index=aliases, columns=aliases)
+    df = df.rename_axis("PLAYER").reset_index()
+    df = df.melt("PLAYER", var_name="OPPONENT", value_name="WINS")
+
+    chart = (
+        alt.Chart(df)
+        .mark_rect()
+        .encode(
+            x=alt.X("OPPONENT:N", sort=aliases),
+            y=alt.Y("PLAYER:N", sort=aliases),
+            color=alt.Color("WINS:Q", scale=alt.Scale(scheme="redblue", domain=[0, 1])),
+            tooltip=["PLAYER", "OPPONENT", alt.Tooltip("WINS:Q", format=".1%")],
+        )
+    )
+    st.altair_chart(chart, use_container_width=True)
+
+
+with timed_page("Matchmaker"):
+    st.write("Pick the players at the table to get the fairest 2v2 matches.")
+
+    ratings = get_player_ratings()
+    present = st.multiselect("Players", sorted(ratings))
+    limit = st.number_input("Matches", min_value=1, max_value=50, value=5, step=1)
+
+    if len(present) < 4:
+        st.info("Select at least four players.")
+    else:
+        show_matches(present, ratings, int(limit))
+
+    st.subheader("Win probabilities")
+    if len(present) >= 2:
+        show_heatmap(
+            present, win_probability_matrix([ratings[alias] for alias in present])
+        )
+    else:
+        st.write("Probability of each ranked player beating another one, in 1v1:")
+        show_heatmap(*get_win_probabilities())
@@ -1,12 +1,20 @@
-import streamlit as st
+import functools
+import sys
 
-try:
-    from streamlit import cache_resource
-except:
-    from streamlit import experimental_singleton as cache_resource
+# Streamlit is only imported by the pages: the command line and the scripts run
+# without it, and without its import time
+if "streamlit" in sys.modules:
+    try:
+        from streamlit import cache_resource
+    except:
+        from streamlit import experimental_singleton as cache_resource
+else:
+    cache_resource = functools.lru_cache(maxsize=None)
 
 
 def page_init(title: str):
+    import streamlit as st
+
     st.set_page_config(
         page_title=f"{title} - Table Football",
         page_icon="⚽",
@@ -17,10 +25,15 @@ def page_init(title: str):
     st.header(title)
 
 
-def get_db_engine():
-    import sqlite3
+@cache_resource
+def get_db_pool():
+    from .db import create_pool
+
+    return create_pool()
 
-    return sqlite3.connect("./database.db")
+
+def get_db_engine():
+    return get_db_pool().connection()
 
 
 def get_db_cursor(engine):
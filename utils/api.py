@@ -0,0 +1,399 @@
+"""
+Serves the leaderboard, the player stats and the matches as a JSON HTTP API.
+
+    python -m utils.api [--host 127.0.0.1] [--port 8502] [--threads 4]
+
+    GET  /health
+    GET  /leaderboard[?locale=IT][&season=ID]
+    GET  /players/<alias>
+    GET  /matches/recent[?limit=10]
+    POST /matches
+         {"locale": "IT", "blue_team_att": "alice", "blue_team_def": "bob",
+          "red_team_att": "carol", "red_team_def": "dave",
+          "blue_score": 10, "red_score": 7}
+
+Defenders are left out (or null) for 1v1 matches. Errors are returned as
+{"error": message} with a 4xx status.
+
+The server runs on asyncio streams alone, with HTTP/1.1 keep-alive. SQLite work
+runs on a bounded thread pool, and the encoded responses of the reads are
+cached until the next write to the database.
+"""
+import argparse
+import asyncio
+import functools
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from . import LOCALES
+from .cache import versioned_cache
+from .games import (
+    get_player_ratings,
+    get_ranking,
+    get_rating_history,
+    get_recent_matches,
+    player_id,
+    register_match,
+    valid_goals,
+    valid_teams,
+)
+from .profile import streaks
+from .seasons import get_season_list, get_season_ranking
+
+# Threads running the database work
+THREADS = 4
+# Seconds an idle keep-alive connection stays open
+IDLE_TIMEOUT = 30
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+MAX_RECENT_MATCHES = 100
+
+TEAM_FIELDS = ["blue_team_att", "blue_team_def", "red_team_att", "red_team_def"]
+MATCH_FIELDS = [
+    "id",
+    "locale",
+    *TEAM_FIELDS,
+    "match_type",
+    "blue_score",
+    "red_score",
+    "timestamp",
+]
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def integer(params, name, default=None, minimum=None, maximum=None):
+    value = params.get(name)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"{name} must be an integer")
+    if (minimum is not None and value < minimum) or (
+        maximum is not None and value > maximum
+    ):
+        raise ApiError(
+            HTTPStatus.BAD_REQUEST, f"{name} must be between {minimum} and {maximum}"
+        )
+    return value
+
+
+def locale_param(params):
+    locale = params.get("locale")
+    if locale is not None and locale not in LOCALES:
+        raise ApiError(
+            HTTPStatus.BAD_REQUEST, f"locale must be one of {', '.join(LOCALES)}"
+        )
+    return locale
+
+
+def ranking_rows(rows):
+    return [
+        {
+            "rank": rank,
+            "alias": alias,
+            "elo": elo,
+            "games": int(games_played),
+            "wins": int(games_won),
+            "win_rate": win_rate,
+        }
+        for rank, (alias, elo, games_played, games_won, win_rate) in enumerate(rows, 1)
+    ]
+
+
+def health(params):
+    return {"status": "ok"}
+
+
+def leaderboard(params):
+    locale = locale_param(params)
+    season = integer(params, "season")
+    if season is None:
+        return ranking_rows(get_ranking(locale))
+    if season not in {row[0] for row in get_season_list()}:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown season: {season}")
+    return ranking_rows(get_season_ranking(season, locale))
+
+
+def player(params, alias):
+    alias = alias.lower()
+    ratings = get_player_ratings()
+    if alias not in ratings:
+        raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown player: {alias}")
+
+    rankings = {None: ranking_rows(get_ranking())}
+    for locale in LOCALES:
+        rankings[locale] = ranking_rows(get_ranking(locale))
+    ranked = {
+        locale: next((row for row in rows if row["alias"] == alias), None)
+        for locale, rows in rankings.items()
+    }
+
+    history = get_rating_history(alias)
+    current, longest_win, longest_loss = streaks([row[2] for row in history])
+    overall = ranked.pop(None) or {"rank": None, "games": 0, "wins": 0}
+    return {
+        "alias": alias,
+        "elo": ratings[alias],
+        "rank": overall["rank"],
+        "games": overall["games"],
+        "wins": overall["wins"],
+        "win_rate": overall.get("win_rate"),
+        "peak_elo": max((row[1] for row in history), default=None),
+        "current_streak": current,
+        "longest_winning_streak": longest_win,
+        "longest_losing_streak": longest_loss,
+        "locales": {
+            locale: {key: row[key] for key in ("rank", "elo", "games", "wins")}
+            for locale, row in ranked.items()
+            if row is not None
+        },
+    }
+
+
+def recent_matches(params):
+    limit = integer(params, "limit", 10, 1, MAX_RECENT_MATCHES)
+    return [dict(zip(MATCH_FIELDS, row)) for row in get_recent_matches(limit)]
+
+
+def submit_match(body):
+    """
+    Registers a match from its JSON body, with the checks of the registration
+    page. Returns the id of the match and the new Elo of its players.
+    """
+    try:
+        match = json.loads(body)
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "The body must be JSON")
+    if not isinstance(match, dict):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "The body must be a JSON object")
+
+    locale = locale_param(match)
+    if locale is None:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "locale is required")
+
+    teams = []
+    for field in TEAM_FIELDS:
+        alias = match.get(field)
+        if alias is not None and not isinstance(alias, str):
+            raise ApiError(HTTPStatus.BAD_REQUEST, f"{field} must be an alias")
+        teams.append(alias.strip().lower() if alias else None)
+    blue_att, blue_def, red_att, red_def = teams
+    if blue_att is None or red_att is None:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Both teams need an attacker")
+    if (blue_def is None) != (red_def is None):
+        raise ApiError(
+            HTTPStatus.BAD_REQUEST, "Either both teams or none have a defender"
+        )
+    unknown = [alias for alias in teams if alias and player_id(alias) is None]
+    if unknown:
+        raise ApiError(HTTPStatus.BAD_REQUEST, f"Unknown players: {', '.join(unknown)}")
+
+    scores = [match.get("blue_score"), match.get("red_score")]
+    if not all(type(score) is int and 0 <= score <= 10 for score in scores):
+        raise ApiError(
+            HTTPStatus.BAD_REQUEST, "Scores must be integers between 0 and 10"
+        )
+
+    if not valid_teams(*teams):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Player names must be different")
+    if not valid_goals(*scores):
+        raise ApiError(HTTPStatus.BAD_REQUEST, "One team must have scored ten goals")
+
+    match_type = "1v1" if blue_def is None else "2v2"
+    match_id = register_match(locale, *teams, match_type, *scores)
+
+    ratings = get_player_ratings()
+    return {"id": match_id, "elo": {alias: ratings[alias] for alias in teams if alias}}
+
+
+# Paths of the GET requests, with the handlers of their query parameters and
+# path groups
+ROUTES = [
+    (re.compile(r"/health"), health),
+    (re.compile(r"/leaderboard"), leaderboard),
+    (re.compile(r"/players/([^/]+)"), player),
+    (re.compile(r"/matches/recent"), recent_matches),
+]
+
+
+def encode(status, payload):
+    return status, json.dumps(payload, separators=(",", ":")).encode()
+
+
+def error(status, message):
+    return encode(status, {"error": message})
+
+
+@versioned_cache(maxsize=1024)
+def read(path, query):
+    """
+    Returns the status and the encoded body of a GET request, cached until the
+    next write to the database.
+    """
+    params = dict(parse_qsl(query))
+    for pattern, handler in ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            try:
+                return encode(
+                    HTTPStatus.OK,
+                    handler(params, *[unquote(g) for g in match.groups()]),
+                )
+            except ApiError as e:
+                return error(e.status, str(e))
+    return error(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+
+
+def write(path, body):
+    if path != "/matches":
+        return error(HTTPStatus.NOT_FOUND, f"No such resource: {path}")
+    try:
+        return encode(HTTPStatus.CREATED, submit_match(body))
+    except ApiError as e:
+        return error(e.status, str(e))
+
+
+def respond(method, target, body):
+    url = urlsplit(target)
+    if method in ("GET", "HEAD"):
+        return read(url.path, url.query)
+    if method == "POST":
+        return write(url.path, body)
+    return error(HTTPStatus.METHOD_NOT_ALLOWED, f"Method not allowed: {method}")
+
+
+async def read_request(reader):
+    """
+    Reads a request, returns (method, target, version, headers, body), or None
+    when the client closed the connection.
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ApiError(
+                HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Too many headers"
+            )
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise ApiError(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+    if length > MAX_BODY:
+        raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target, version, headers, body
+
+
+def response(status, body, keep_alive, head=False):
+    status = HTTPStatus(status)
+    header = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        "\r\n"
+    )
+    return header.encode("latin-1") + (b"" if head else body)
+
+
+async def handle_connection(executor, reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), IDLE_TIMEOUT)
+            except ApiError as e:
+                writer.write(response(*error(e.status, str(e)), keep_alive=False))
+                break
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                break
+            if request is None:
+                break
+
+            method, target, version, headers, body = request
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" and (
+                version != "HTTP/1.0" or connection == "keep-alive"
+            )
+
+            try:
+                status, payload = await loop.run_in_executor(
+                    executor, respond, method, target, body
+                )
+            except Exception as e:
+                status, payload = error(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+            writer.write(response(status, payload, keep_alive, head=method == "HEAD"))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_api(host="127.0.0.1", port=8502, threads=THREADS):
+    """
+    Starts serving the API, returns the asyncio server. With port 0 the system
+    picks a free port, see server.sockets[0].getsockname().
+    """
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api")
+    server = await asyncio.start_server(
+        functools.partial(handle_connection, executor), host, port
+    )
+    server.executor = executor
+    return server
+
+
+async def serve(host, port, threads):
+    server = await start_api(host, port, threads)
+    address = server.sockets[0].getsockname()
+    print(f"Serving the API on http://{address[0]}:{address[1]}", file=sys.stderr)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        server.executor.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument(
+        "--threads", type=int, default=THREADS, help="threads running the queries"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.threads))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
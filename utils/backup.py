@@ -0,0 +1,119 @@
+import csv
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from .db import DATABASE_PATH
+from .games import TEAM_JOINS
+from .importer import MATCH_COLUMNS, PLAYER_COLUMNS
+
+# Bytes copied at a time when compressing or streaming files
+CHUNK_SIZE = 1024 * 1024
+
+# Queries of the CSV exports, in the format read back by the importer. The
+# players of the teams are written by alias
+CSV_EXPORTS = {
+    "players": (
+        PLAYER_COLUMNS,
+        f"SELECT {', '.join(PLAYER_COLUMNS)} FROM players ORDER BY id",
+    ),
+    "matches": (
+        MATCH_COLUMNS,
+        f"""
+        SELECT
+            m.locale,
+            ba.alias,
+            bd.alias,
+            ra.alias,
+            rd.alias,
+            m.match_type,
+            m.blue_score,
+            m.red_score,
+            m.timestamp
+        FROM matches m
+        {TEAM_JOINS}
+        ORDER BY m.timestamp, m.id
+        """,
+    ),
+}
+
+
+def open_output(path, compress=False):
+    if compress:
+        return gzip.open(path, "wb", compresslevel=6)
+    return open(path, "wb")
+
+
+def snapshot_database(dest, source=DATABASE_PATH):
+    """
+    Copies a consistent snapshot of the database to dest with the SQLite backup API.
+
+    All pages are copied in a single step, under one read transaction: in WAL mode
+    writers keep working meanwhile, and the copy never has to restart.
+    """
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(dest)
+    try:
+        with dst:
+            src.backup(dst, pages=-1)
+    finally:
+        dst.close()
+        src.close()
+    return dest
+
+
+def backup_database(dest, compress=False, source=DATABASE_PATH):
+    """
+    Writes a snapshot of the database file to dest, optionally gzip compressed.
+    """
+    if not compress:
+        return snapshot_database(dest, source)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = snapshot_database(os.path.join(tmp, "database.db"), source)
+        with open(snapshot, "rb") as f, open_output(dest, compress) as out:
+            shutil.copyfileobj(f, out, CHUNK_SIZE)
+    return dest
+
+
+def dump_database(dest, compress=False, source=DATABASE_PATH):
+    """
+    Writes a SQL dump of a snapshot of the database to dest, optionally gzip
+    compressed. Lines are written as they are produced by iterdump.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = snapshot_database(os.path.join(tmp, "database.db"), source)
+        conn = sqlite3.connect(snapshot)
+        try:
+            with open_output(dest, compress) as out:
+                for line in conn.iterdump():
+                    out.write(line.encode("utf-8"))
+                    out.write(b"\n")
+        finally:
+            conn.close()
+    return dest
+
+
+def export_csv(dest, table, source=DATABASE_PATH):
+    """
+    Writes the players or the matches to a CSV file, as import_players and
+    import_matches read them. Rows are written as they are fetched.
+
+    Returns the number of rows written.
+    """
+    columns, query = CSV_EXPORTS[table]
+    conn = sqlite3.connect(source)
+    try:
+        with open(dest, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            rows = 0
+            cursor = conn.execute(query)
+            while batch := cursor.fetchmany(CHUNK_SIZE // 1024):
+                writer.writerows(batch)
+                rows += len(batch)
+    finally:
+        conn.close()
+    return rows
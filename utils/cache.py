@@ -0,0 +1,65 @@
+import functools
+import threading
+
+from . import get_db_pool
+
+# Every function decorated with versioned_cache, so they can be cleared together
+CACHES = []
+
+
+def data_version():
+    return get_db_pool().data_version()
+
+
+def versioned_cache(func=None, maxsize=256):
+    """
+    Caches the results of a read-only database function until the next write.
+
+    Results are keyed on the arguments and stored for the current data version:
+    every cached entry is dropped as soon as any write is committed, so readers
+    never see data older than the last write. Cached results are shared between
+    sessions and must not be mutated.
+    """
+    if func is None:
+        return functools.partial(versioned_cache, maxsize=maxsize)
+
+    lock = threading.Lock()
+    cache = {}
+    state = {"version": None}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        version = data_version()
+        key = (args, tuple(sorted(kwargs.items())))
+
+        with lock:
+            if state["version"] != version:
+                cache.clear()
+                state["version"] = version
+            elif key in cache:
+                return cache[key]
+
+        value = func(*args, **kwargs)
+
+        # A write committed meanwhile changes the version, which drops this
+        # entry on the next call
+        with lock:
+            if state["version"] == version:
+                if len(cache) >= maxsize:
+                    cache.pop(next(iter(cache)))
+                cache[key] = value
+        return value
+
+    def cache_clear():
+        with lock:
+            cache.clear()
+            state["version"] = None
+
+    wrapper.cache_clear = cache_clear
+    CACHES.append(wrapper)
+    return wrapper
+
+
+def clear_caches():
+    for cached in CACHES:
+        cached.cache_clear()
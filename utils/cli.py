@@ -0,0 +1,347 @@
+"""
+Runs the maintenance operations against the database, without the app.
+
+    python -m utils.cli [--database ./database.db] migrate
+    python -m utils.cli recompute [--from-match ID]
+    python -m utils.cli import {players,matches,parquet} FILE [--no-recompute]
+    python -m utils.cli export {players,matches,parquet,sqlite,sql} FILE [--compress]
+    python -m utils.cli check
+    python -m utils.cli benchmark [benchmarks.suite arguments]
+
+Modules are imported by the command that needs them, so that short commands
+start fast, and Streamlit is never imported.
+"""
+import argparse
+import os
+import sys
+import time
+
+
+def migrate(args):
+    from .db import upgrade_database
+
+    upgrade_database(args.database, args.revision)
+    return 0
+
+
+def recompute(args):
+    from .elo import recompute_elo
+
+    start = time.perf_counter()
+    recompute_elo(args.from_match)
+    print(f"Elo recomputed in {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+def import_file(args):
+    if args.kind == "parquet":
+        from .parquet import import_parquet
+
+        rows = import_parquet(args.file, recompute=args.recompute)
+        print(
+            ", ".join(f"{count} {table}" for table, count in rows.items()), "imported"
+        )
+        return 0
+
+    from .importer import import_matches, import_players
+
+    func = import_players if args.kind == "players" else import_matches
+    imported, rejected = func(args.file, recompute=args.recompute)
+    print(f"{imported} {args.kind} imported, {len(rejected)} rows rejected")
+    if len(rejected):
+        if args.rejected:
+            rejected.to_csv(args.rejected, index=False)
+        else:
+            print(rejected.to_string(index=False), file=sys.stderr)
+    return 0
+
+
+def export_file(args):
+    from .backup import backup_database, dump_database, export_csv
+
+    if args.kind == "sqlite":
+        backup_database(args.file, args.compress, args.database)
+    elif args.kind == "sql":
+        dump_database(args.file, args.compress, args.database)
+    elif args.kind == "parquet":
+        from .parquet import export_parquet
+
+        rows = export_parquet(args.file, source=args.database)
+        print(
+            ", ".join(f"{count} {table}" for table, count in rows.items()), "exported"
+        )
+    else:
+        rows = export_csv(args.file, args.kind, args.database)
+        print(f"{rows} {args.kind} exported")
+    return 0
+
+
+def integrity_checks(conn):
+    """
+    Checks the database file, the references, the matches and their event log,
+    and that the stored ratings and match snapshots, globally and per locale, are
+    the ones a full replay of the history gives.
+
+    Returns (check, problems) pairs, problems being empty for passed checks.
+    """
+    from .elo import compute_replay, get_all_matches, has_snapshots
+    from .events import fold_events
+
+    checks = []
+
+    rows = conn.execute("PRAGMA integrity_check").fetchall()
+    checks.append(("database file", [r[0] for r in rows if r[0] != "ok"]))
+
+    checks.append(
+        (
+            "references",
+            [
+                f"{table} row {rowid} refers to a missing {parent}"
+                for table, rowid, parent, _ in conn.execute("PRAGMA foreign_key_check")
+            ],
+        )
+    )
+
+    checks.append(
+        (
+            "matches",
+            [
+                f"match {match_id}: {reason}"
+                for match_id, reason in conn.execute(
+                    """
+                    SELECT id, 'a team has no attacker' FROM matches
+                    WHERE blue_team_att_id IS NULL OR red_team_att_id IS NULL
+                    UNION ALL
+                    SELECT id, 'no team scored 10' FROM matches
+                    WHERE blue_score IS NOT 10 AND red_score IS NOT 10
+                    ORDER BY 1
+                    """
+                )
+            ],
+        )
+    )
+
+    # The log folds into the matches as they are
+    logged = {m[0]: m for m in fold_events(conn)}
+    matches = {m[0]: m for m in get_all_matches()}
+    checks.append(
+        (
+            "event log",
+            [
+                f"match {match_id} differs from its logged values"
+                for match_id in sorted(logged.keys() | matches.keys())
+                if logged.get(match_id) != matches.get(match_id)
+            ],
+        )
+    )
+
+    problems = []
+    if not has_snapshots(conn):
+        problems.append("no rating snapshots, run a recompute")
+    conn.execute("BEGIN")
+    try:
+        replay = compute_replay(conn)
+        stored = dict(
+            (row[0], row[1:])
+            for row in conn.execute(
+                "SELECT id, elo, games_played, games_won FROM players"
+            )
+        )
+        stored_locales = dict(
+            (row[:2], row[2:])
+            for row in conn.execute(
+                "SELECT locale, player_id, elo, games_played, games_won "
+                "FROM locale_ratings"
+            )
+        )
+        stored_snapshots = dict(
+            (row[:3], row[3:])
+            for row in conn.execute(
+                """
+                SELECT NULL, match_id, player_id, elo_before, elo_after
+                FROM match_ratings
+                UNION ALL
+                SELECT locale, match_id, player_id, elo_before, elo_after
+                FROM locale_match_ratings
+                """
+            )
+        )
+    finally:
+        conn.commit()
+    for player_id, elo, games_played, games_won in zip(
+        replay["ids"].tolist(),
+        replay["elo"].tolist(),
+        replay["games_played"].tolist(),
+        replay["games_won"].tolist(),
+    ):
+        elo_, games_played_, games_won_ = stored[player_id]
+        if (
+            elo_ is None
+            or abs(elo_ - elo) > 1e-6
+            or (games_played_, games_won_) != (games_played, games_won)
+        ):
+            problems.append(
+                f"player {player_id} has Elo {elo_} after {games_played_} games, "
+                f"replayed {elo:.6f} after {games_played}"
+            )
+    checks.append(("ratings", problems))
+
+    # Ratings of every locale, and the snapshots of every match, globally and in
+    # its locale
+    player_ids = replay["ids"].tolist()
+    problems = []
+    replayed_snapshots = {
+        (None, s[0], player_ids[s[1]]): s[2:4] for s in replay["snapshots"]
+    }
+    for locale, (elo, games_played, games_won, snapshots, *_) in replay[
+        "locales"
+    ].items():
+        for player_id, elo_, games_played_, games_won_ in zip(
+            player_ids, elo.tolist(), games_played.tolist(), games_won.tolist()
+        ):
+            if not games_played_:
+                continue
+            row = stored_locales.get((locale, player_id))
+            if (
+                row is None
+                or abs(row[0] - elo_) > 1e-6
+                or tuple(row[1:]) != (games_played_, games_won_)
+            ):
+                problems.append(
+                    f"player {player_id} in {locale} has {row}, replayed "
+                    f"Elo {elo_:.6f} after {games_played_} games"
+                )
+        replayed_snapshots.update(
+            ((locale, s[0], player_ids[s[1]]), s[2:4]) for s in snapshots
+        )
+    for key in sorted(
+        replayed_snapshots.keys() | stored_snapshots.keys(),
+        key=lambda key: (key[1], key[0] or "", key[2]),
+    ):
+        replayed, row = replayed_snapshots.get(key), stored_snapshots.get(key)
+        if (
+            replayed is None
+            or row is None
+            or any(abs(a - b) > 1e-6 for a, b in zip(replayed, row))
+        ):
+            locale, match_id, player_id = key
+            problems.append(
+                f"match {match_id}{f' in {locale}' if locale else ''}: player "
+                f"{player_id} has Elo {row} before and after, replayed {replayed}"
+            )
+    checks.append(("locale ratings and snapshots", problems))
+
+    return checks
+
+
+def check(args):
+    from . import get_db_engine
+
+    failed = 0
+    for name, problems in integrity_checks(get_db_engine()):
+        print(f"{'FAIL' if problems else 'ok':>4}  {name}")
+        for problem in problems[: args.limit]:
+            print(f"      {problem}")
+        if len(problems) > args.limit:
+            print(f"      ... {len(problems) - args.limit} more")
+        failed += bool(problems)
+    return 1 if failed else 0
+
+
+def benchmark(args):
+    from benchmarks.suite import main as suite
+
+    # The suite runs on its own temporary database
+    suite(args.arguments)
+    return 0
+
+
+def parser():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--database", default=os.environ.get("DATABASE_PATH", "./database.db")
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("migrate", help="run the database migrations")
+    command.add_argument("--revision", default="head")
+    command.set_defaults(func=migrate)
+
+    command = commands.add_parser(
+        "recompute", help="replay the match history, all of it by default"
+    )
+    command.add_argument(
+        "--from-match", type=int, help="replay from this match onward only"
+    )
+    command.set_defaults(func=recompute)
+
+    command = commands.add_parser(
+        "import", help="replace the players or the matches with the ones of a file"
+    )
+    command.add_argument("kind", choices=["players", "matches", "parquet"])
+    command.add_argument("file", help="CSV file, or archive written by export parquet")
+    command.add_argument(
+        "--no-recompute",
+        dest="recompute",
+        action="store_false",
+        help="leave the ratings as they are",
+    )
+    command.add_argument("--rejected", help="CSV file with the rejected rows")
+    command.set_defaults(func=import_file)
+
+    command = commands.add_parser("export", help="write the database to a file")
+    command.add_argument(
+        "kind", choices=["players", "matches", "parquet", "sqlite", "sql"]
+    )
+    command.add_argument("file")
+    command.add_argument(
+        "--compress", action="store_true", help="gzip the sqlite and sql exports"
+    )
+    command.set_defaults(func=export_file)
+
+    command = commands.add_parser(
+        "check", help="check the database and the stored ratings"
+    )
+    command.add_argument(
+        "--limit", type=int, default=10, help="problems printed by check"
+    )
+    command.set_defaults(func=check)
+
+    command = commands.add_parser(
+        "benchmark", help="run the benchmark suite on a synthetic league"
+    )
+    command.set_defaults(func=benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    cli = parser()
+    # The options of the benchmark are the ones of benchmarks.suite
+    args, rest = cli.parse_known_args(argv)
+    if rest and args.command != "benchmark":
+        cli.error(f"unrecognized arguments: {' '.join(rest)}")
+    args.arguments = rest
+    # SQLite would create an empty database in place of a mistyped path
+    if args.command not in ("migrate", "benchmark") and not os.path.exists(
+        args.database
+    ):
+        print(
+            f"error: database not found: {args.database}, run migrate to create it",
+            file=sys.stderr,
+        )
+        return 1
+    if args.command != "benchmark":
+        # Read by the connection pool and the migrations when first imported
+        os.environ["DATABASE_PATH"] = args.database
+
+    try:
+        return args.func(args)
+    except (ValueError, OSError) as e:
+        # Invalid arguments or rows, and missing or unreadable files
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+import atexit
+import functools
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from .metrics import InstrumentedConnection
+
+# Read once, when this module is first imported, and used as the default path
+# of the connection pool, the migrations and the exports: scripts running on
+# another database set the environment variable before importing it
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "./database.db")
+
+# Milliseconds a connection waits on a locked database before giving up
+BUSY_TIMEOUT = 5000
+# Bytes of the database file read through memory mapping
+MMAP_SIZE = 256 * 1024 * 1024
+# Page cache per connection, negative values are in KiB
+CACHE_SIZE = -16 * 1024
+# Attempts made by retry_on_busy before giving up on a locked database
+BUSY_RETRIES = 5
+
+
+class ConnectionPool:
+    """
+    Hands out one tuned SQLite connection per thread.
+
+    Connections are reused for the lifetime of their thread and closed once the
+    thread is gone, or when the pool itself is closed.
+    """
+
+    def __init__(
+        self,
+        path=DATABASE_PATH,
+        busy_timeout=BUSY_TIMEOUT,
+        mmap_size=MMAP_SIZE,
+        cache_size=CACHE_SIZE,
+        factory=InstrumentedConnection,
+    ):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.factory = factory
+
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._probe = None
+
+    def connect(self):
+        # Connections are only used by the thread that requested them, but may
+        # be closed by another one when that thread is gone
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        return conn
+
+    def connection(self):
+        thread = threading.current_thread()
+
+        with self._lock:
+            entry = self._connections.get(thread.ident)
+            if entry is not None and entry[0] is thread:
+                return entry[1]
+
+            self._close_stale()
+
+        conn = self.connect()
+        with self._lock:
+            self._connections[thread.ident] = (thread, conn)
+        return conn
+
+    def _close_stale(self):
+        for ident, (thread, conn) in list(self._connections.items()):
+            if not thread.is_alive():
+                del self._connections[ident]
+                conn.close()
+
+    def data_version(self):
+        """
+        Returns a token that changes every time a write is committed to the
+        database, by any connection of any process.
+
+        PRAGMA data_version only reflects the commits of other connections, so it
+        is read from a dedicated connection that never writes.
+        """
+        with self._lock:
+            if self._probe is None:
+                self._probe = self.connect()
+            return self._probe.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            for _, conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+
+            if self._probe is not None:
+                self._probe.close()
+                self._probe = None
+
+
+def create_pool(path=DATABASE_PATH, **kwargs):
+    pool = ConnectionPool(path, **kwargs)
+    atexit.register(pool.close)
+    return pool
+
+
+def upgrade_database(path=DATABASE_PATH, revision="head"):
+    # Run the Alembic migrations against the given database file
+    from alembic import command
+    from alembic.config import Config
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    config = Config(os.path.join(root, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(root, "database"))
+    config.attributes["database_path"] = path
+    command.upgrade(config, revision)
+
+
+@contextmanager
+def immediate_transaction(conn):
+    """
+    Runs the block in a single transaction holding the write lock from the start,
+    so that concurrent writers cannot interleave between its reads and writes.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def is_busy_error(e):
+    return isinstance(e, sqlite3.OperationalError) and (
+        "locked" in str(e) or "busy" in str(e)
+    )
+
+
+def retry_on_busy(func=None, retries=BUSY_RETRIES, backoff=0.05):
+    """
+    Retries the decorated function when the database stays locked for longer than
+    the busy timeout, waiting a randomized, exponentially growing delay in between.
+    """
+    if func is None:
+        return functools.partial(retry_on_busy, retries=retries, backoff=backoff)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(retries):
+            try:
+                return func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e) or attempt == retries - 1:
+                    raise
+                time.sleep(backoff * 2**attempt * (1 + random.random()))
+
+    return wrapper
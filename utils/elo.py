@@ -1,131 +1,1087 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 from . import get_db_cursor, get_db_engine
-from .games import get_player_aliases
+from .db import immediate_transaction, retry_on_busy
 
+INITIAL_ELO = 1000
+K_FACTOR = 40
+# Rating difference at which the stronger side is expected to win 10 times out of 11
+SCALE = 400
+# Replays shorter than this run in process: starting the workers costs more
+PARALLEL_MIN_MATCHES = 5_000
+# Matches replayed between two progress reports
+PROGRESS_EVERY = 1_000
 
-def get_all_matches():
+
+def get_all_matches(since=None):
     conn = get_db_engine()
     c = get_db_cursor(conn)
 
-    # Retrieve all matches from the database
+    # Retrieve all matches from the database, or only the ones played from the
+    # (timestamp, id) position given by since
+    where, params = "", []
+    if since is not None:
+        where, params = "WHERE (timestamp, id) >= (?, ?)", list(since)
+
     c.execute(
-        """
+        f"""
         SELECT 
             id,
             locale,
-            blue_team_att,
-            blue_team_def,
-            red_team_att,
-            red_team_def,
+            blue_team_att_id,
+            blue_team_def_id,
+            red_team_att_id,
+            red_team_def_id,
             match_type,
             blue_score,
-            red_score
+            red_score,
+            timestamp
         FROM matches 
-        ORDER BY timestamp ASC
-    """
+        {where}
+        ORDER BY timestamp ASC, id ASC
+    """,
+        params,
     )
     matches = c.fetchall()
     return matches
 
 
-def reset_player_scores():
-    all_players = get_player_aliases()
+def get_match_position(conn, match_id):
+    # Position of a match in the replay order
+    return conn.execute(
+        "SELECT timestamp, id FROM matches WHERE id = ?", [match_id]
+    ).fetchone()
+
 
+def get_player_state(player_ids=None):
     conn = get_db_engine()
     c = get_db_cursor(conn)
 
-    for p in all_players:
-        # Reset all player scores to the original value
-        c.execute(
+    # Map the id of every player, or only of the given ones, to its position in
+    # the in-memory rating arrays
+    where, params = "", []
+    if player_ids is not None:
+        where = f"WHERE id IN ({', '.join('?' * len(player_ids))})"
+        params = list(player_ids)
+
+    c.execute(
+        f"""
+        SELECT
+            id,
+            COALESCE(elo, ?),
+            COALESCE(games_played, 0),
+            COALESCE(games_won, 0)
+        FROM players
+        {where}
+        ORDER BY id
+        """,
+        [INITIAL_ELO, *params],
+    )
+    players = c.fetchall()
+
+    ids = np.array([p[0] for p in players], dtype=np.int64)
+    index = {p[0]: i for i, p in enumerate(players)}
+    elo = np.array([p[1] for p in players], dtype=np.float64)
+    games_played = np.array([p[2] for p in players], dtype=np.int64)
+    games_won = np.array([p[3] for p in players], dtype=np.int64)
+    return ids, index, elo, games_played, games_won
+
+
+def get_locale_state(conn, locale, ids):
+    # Locale ratings aligned with the arrays of get_player_state, players that
+    # never played in the locale start from the initial values
+    elo = np.full(len(ids), INITIAL_ELO, dtype=np.float64)
+    games_played = np.zeros(len(ids), dtype=np.int64)
+    games_won = np.zeros(len(ids), dtype=np.int64)
+
+    index = {player_id: i for i, player_id in enumerate(ids.tolist())}
+    for player_id, elo_, games_played_, games_won_ in conn.execute(
+        """
+        SELECT player_id, elo, games_played, games_won
+        FROM locale_ratings
+        WHERE locale = ?
+        """,
+        [locale],
+    ):
+        if player_id in index:
+            p = index[player_id]
+            elo[p], games_played[p], games_won[p] = elo_, games_played_, games_won_
+
+    return elo, games_played, games_won
+
+
+def has_snapshots(conn):
+    # Snapshots are missing when ratings were computed before they existed, e.g.
+    # right after migrating, and only a full replay creates them
+    return conn.execute(
+        """
+        SELECT
+            EXISTS (SELECT 1 FROM match_ratings)
+            AND EXISTS (SELECT 1 FROM locale_match_ratings)
+        """
+    ).fetchone()[0]
+
+
+def get_seasons(conn):
+    # Season starts in replay order, as (id, starts_at, carry_over) rows
+    return conn.execute(
+        "SELECT id, starts_at, carry_over FROM seasons ORDER BY starts_at"
+    ).fetchall()
+
+
+def latest_checkpoint(conn, seasons, before):
+    """
+    Returns the latest of the seasons starting before the (timestamp, id)
+    position whose checkpoint is stored, or None.
+
+    A season starting at a match's timestamp starts before that match.
+    """
+    for season in reversed(seasons):
+        if (season[1], 0) >= before:
+            continue
+        if conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM season_ratings WHERE season_id = ?)",
+            [season[0]],
+        ).fetchone()[0]:
+            return season
+    return None
+
+
+def season_boundaries(timestamps, seasons):
+    """
+    Positions in the matches, sorted by timestamp, where the given seasons start,
+    as (position, season id, carry_over) tuples in the same order.
+    """
+    positions = np.searchsorted(timestamps, [s[1] for s in seasons], side="left")
+    return [(int(p), s[0], s[2]) for p, s in zip(positions.tolist(), seasons)]
+
+
+def soft_reset(elo, carry_over):
+    # Keeps carry_over of the distance of every rating to the initial one
+    elo[:] = INITIAL_ELO + carry_over * (elo - INITIAL_ELO)
+
+
+def resolve_teams(matches, index):
+    """
+    Translates the player columns of the matches into positions of the rating arrays.
+
+    matches: rows as returned by get_all_matches.
+    index: dict mapping each player id to its position in the rating arrays.
+
+    Returns two (n_matches, 2) integer arrays for the blue and red teams, padded
+    with -1 for missing defenders or unknown players, and the blue team result.
+    """
+    teams = np.array(
+        [[index.get(m[i], -1) for i in (2, 3, 4, 5)] for m in matches],
+        dtype=np.int64,
+    ).reshape(-1, 4)
+    blue, red = teams[:, :2].copy(), teams[:, 2:].copy()
+
+    # A player listed twice in the same team only counts once
+    blue[blue[:, 0] == blue[:, 1], 1] = -1
+    red[red[:, 0] == red[:, 1], 1] = -1
+
+    blue_won = np.array([m[7] == 10 for m in matches], dtype=np.int64)
+    return blue, red, blue_won
+
+
+def replay_matches(
+    match_ids,
+    blue,
+    red,
+    blue_won,
+    elo,
+    games_played,
+    games_won,
+    k_factor=K_FACTOR,
+    scale=SCALE,
+    progress=None,
+):
+    """
+    Replays the matches in order, updating the rating arrays in place.
+
+    Matches where one of the teams has no registered player are skipped.
+    progress: called now and then with the fraction of the matches replayed.
+    Returns one snapshot row per player and match:
+    (match_id, player position, elo_before, elo_after, games_played_before,
+    games_played_after, games_won_before, games_won_after).
+    """
+    replayed = (blue.max(axis=1) >= 0) & (red.max(axis=1) >= 0)
+
+    # Ratings depend on the previous match, so this part has to stay sequential:
+    # plain lists are much faster than numpy scalars for single items.
+    ratings = elo.tolist()
+    played = games_played.tolist()
+    won = games_won.tolist()
+    snapshots = []
+    total = int(replayed.sum())
+    for i, (match_id, blue_team, red_team, result) in enumerate(
+        zip(
+            np.asarray(match_ids)[replayed].tolist(),
+            blue[replayed].tolist(),
+            red[replayed].tolist(),
+            blue_won[replayed].tolist(),
+        )
+    ):
+        if progress is not None and i % PROGRESS_EVERY == 0:
+            progress(i / total)
+
+        blue_team = [p for p in blue_team if p >= 0]
+        red_team = [p for p in red_team if p >= 0]
+
+        blue_team_new_elo, red_team_new_elo = calculate_elo_rating(
+            [ratings[p] for p in blue_team],
+            [ratings[p] for p in red_team],
+            result,
+            k_factor=k_factor,
+            scale=scale,
+        )
+
+        for team, new_elo, team_won in (
+            (blue_team, blue_team_new_elo, result),
+            (red_team, red_team_new_elo, 1 - result),
+        ):
+            for p, rating in zip(team, new_elo):
+                snapshots.append(
+                    (
+                        match_id,
+                        p,
+                        ratings[p],
+                        rating,
+                        played[p],
+                        played[p] + 1,
+                        won[p],
+                        won[p] + team_won,
+                    )
+                )
+                ratings[p] = rating
+                played[p] += 1
+                won[p] += team_won
+
+    elo[:] = ratings
+    games_played[:] = played
+    games_won[:] = won
+    return snapshots
+
+
+def replay_seasons(
+    match_ids,
+    blue,
+    red,
+    blue_won,
+    elo,
+    games_played,
+    games_won,
+    boundaries=(),
+    progress=None,
+):
+    """
+    Replays the matches as replay_matches does, applying the soft reset of each
+    season at its start.
+
+    boundaries: (position in the matches, season id, carry_over) of the seasons
+                starting during the replay, in order, as given by
+                season_boundaries. Seasons starting after the last match are
+                reset at the end.
+
+    Returns the snapshots, and a dict mapping each season id to its checkpoint:
+    copies of the rating arrays right before its reset.
+    """
+    snapshots, checkpoints = [], {}
+    total = max(len(match_ids), 1)
+    start = 0
+    for end, season_id, carry_over in [*boundaries, (len(match_ids), None, None)]:
+        segment_progress = None
+        if progress is not None:
+
+            def segment_progress(fraction, start=start, end=end):
+                progress((start + fraction * (end - start)) / total)
+
+        snapshots += replay_matches(
+            match_ids[start:end],
+            blue[start:end],
+            red[start:end],
+            blue_won[start:end],
+            elo,
+            games_played,
+            games_won,
+            progress=segment_progress,
+        )
+        if season_id is not None:
+            checkpoints[season_id] = (elo.copy(), games_played.copy(), games_won.copy())
+            soft_reset(elo, carry_over)
+        start = end
+
+    return snapshots, checkpoints
+
+
+def replay_job(
+    match_ids, blue, red, blue_won, elo, games_played, games_won, boundaries=()
+):
+    # Worker processes get copies of the arrays, so the new state is returned
+    snapshots, checkpoints = replay_seasons(
+        match_ids, blue, red, blue_won, elo, games_played, games_won, boundaries
+    )
+    return elo, games_played, games_won, snapshots, checkpoints
+
+
+def replay_pools(
+    jobs,
+    match_ids,
+    blue,
+    red,
+    blue_won,
+    elo,
+    games_played,
+    games_won,
+    boundaries=(),
+    progress=None,
+):
+    """
+    Replays the global ratings in process while the locale jobs, a dict mapping
+    each locale to the arguments of replay_job, run in parallel in a process pool.
+    Progress is reported for the global replay.
+
+    Returns the global snapshots and checkpoints, see replay_seasons, and a dict
+    mapping each locale to the result of its replay_job.
+    """
+    if len(match_ids) < PARALLEL_MIN_MATCHES or (os.cpu_count() or 1) < 2:
+        replay = replay_seasons(
+            match_ids,
+            blue,
+            red,
+            blue_won,
+            elo,
+            games_played,
+            games_won,
+            boundaries,
+            progress=progress,
+        )
+        return replay, {locale: replay_job(*args) for locale, args in jobs.items()}
+
+    workers = min(len(jobs), os.cpu_count())
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            locale: pool.submit(replay_job, *args) for locale, args in jobs.items()
+        }
+        replay = replay_seasons(
+            match_ids,
+            blue,
+            red,
+            blue_won,
+            elo,
+            games_played,
+            games_won,
+            boundaries,
+            progress=progress,
+        )
+        return replay, {locale: f.result() for locale, f in futures.items()}
+
+
+def save_player_scores(conn, ids, elo, games_played, games_won):
+    win_rate = [
+        won / played if played else None
+        for won, played in zip(games_won.tolist(), games_played.tolist())
+    ]
+
+    conn.executemany(
+        """
+        UPDATE players
+        SET elo = ?, games_played = ?, games_won = ?, win_rate = ?
+        WHERE id = ?;
+        """,
+        zip(
+            elo.tolist(),
+            games_played.tolist(),
+            games_won.tolist(),
+            win_rate,
+            ids.tolist(),
+        ),
+    )
+
+
+def save_match_ratings(conn, ids, snapshots):
+    # Snapshots refer to players by their position in the rating arrays
+    player_ids = ids.tolist()
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO match_ratings (
+            match_id,
+            player_id,
+            elo_before,
+            elo_after,
+            games_played_before,
+            games_played_after,
+            games_won_before,
+            games_won_after
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(s[0], player_ids[s[1]], *s[2:]) for s in snapshots],
+    )
+
+
+def save_locale_ratings(conn, locale, ids, elo, games_played, games_won):
+    win_rate = [
+        won / played if played else None
+        for won, played in zip(games_won.tolist(), games_played.tolist())
+    ]
+
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO locale_ratings (
+            locale,
+            player_id,
+            elo,
+            games_played,
+            games_won,
+            win_rate
+        )
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        zip(
+            [locale] * len(ids),
+            ids.tolist(),
+            elo.tolist(),
+            games_played.tolist(),
+            games_won.tolist(),
+            win_rate,
+        ),
+    )
+
+
+def save_locale_match_ratings(conn, locale, ids, snapshots):
+    player_ids = ids.tolist()
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO locale_match_ratings (
+            match_id,
+            player_id,
+            locale,
+            elo_before,
+            elo_after,
+            games_played_before,
+            games_played_after,
+            games_won_before,
+            games_won_after
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [(s[0], player_ids[s[1]], locale, *s[2:]) for s in snapshots],
+    )
+
+
+def save_season_ratings(
+    conn, season_id, ids, elo, games_played, games_won, locale=None
+):
+    # Checkpoint of a season, globally or for a locale. Players without games
+    # are left out, they start the season from the initial values anyway
+    played = games_played > 0
+    rows = zip(
+        ids[played].tolist(),
+        elo[played].tolist(),
+        games_played[played].tolist(),
+        games_won[played].tolist(),
+        (games_won[played] / games_played[played]).tolist(),
+    )
+
+    if locale is None:
+        conn.executemany(
             """
-            UPDATE players
-            SET elo = ?, games_played = ?, games_won = ?
-            WHERE alias = ?;
+            INSERT INTO season_ratings (
+                season_id, player_id, elo, games_played, games_won, win_rate
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [(season_id, *row) for row in rows],
+        )
+    else:
+        conn.executemany(
+            """
+            INSERT INTO season_locale_ratings (
+                season_id, locale, player_id, elo, games_played, games_won, win_rate
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
             """,
-            [1000, 0, 0, p],
+            [(season_id, locale, *row) for row in rows],
         )
-        conn.commit()
 
 
-def recompute_elo():
-    conn = get_db_engine()
+def snapshot_filter(since=None, match_id=None):
+    # SQL condition on a match_ratings row r joined to its match m, selecting the
+    # snapshots of one match, of the matches from a (timestamp, id) position
+    # onward, or all of them
+    if match_id is not None:
+        return "r.match_id = ?", [match_id]
+    if since is not None:
+        return "(m.timestamp, m.id) >= (?, ?)", list(since)
+    return "1", []
+
+
+def annotate_match_ratings(conn, since=None, match_id=None):
+    """
+    Stores the side, role and goal difference of the players in their snapshots,
+    so that the pair statistics of a match can later be taken back out of
+    pair_stats even after the match is edited.
+    """
+    condition, params = snapshot_filter(since, match_id)
+    conn.execute(
+        f"""
+        UPDATE match_ratings AS r
+        SET
+            side = CASE WHEN r.player_id IN (m.blue_team_att_id, m.blue_team_def_id)
+                THEN 'blue' ELSE 'red' END,
+            role = CASE
+                WHEN m.match_type = '1v1' THEN 'single'
+                WHEN r.player_id IN (m.blue_team_att_id, m.red_team_att_id)
+                    THEN 'attacker'
+                ELSE 'defender'
+            END,
+            goal_difference = CASE
+                WHEN r.player_id IN (m.blue_team_att_id, m.blue_team_def_id)
+                    THEN m.blue_score - m.red_score
+                ELSE m.red_score - m.blue_score
+            END
+        FROM matches AS m
+        WHERE m.id = r.match_id AND {condition}
+        """,
+        params,
+    )
+
+
+def update_pair_stats(conn, since=None, match_id=None, sign=1):
+    """
+    Adds the annotated snapshots of the selected matches to pair_stats, or takes
+    them out with sign=-1, without committing.
+
+    Every player gets a row per other player of the match, as a teammate or an
+    opponent and by the role the player had, with the games, the wins, the goal
+    difference and the Elo gained.
+    """
+    condition, params = snapshot_filter(since, match_id)
+    conn.execute(
+        f"""
+        INSERT INTO pair_stats (
+            player_id, relation, other_id, role, games, wins, goal_difference, elo_delta
+        )
+        SELECT
+            r.player_id,
+            CASE WHEN o.side = r.side THEN 'teammate' ELSE 'opponent' END,
+            o.player_id,
+            r.role,
+            ? * COUNT(*),
+            ? * SUM(r.games_won_after - r.games_won_before),
+            ? * SUM(r.goal_difference),
+            ? * SUM(r.elo_after - r.elo_before)
+        FROM match_ratings AS r
+        JOIN matches AS m ON m.id = r.match_id
+        JOIN match_ratings AS o ON o.match_id = r.match_id AND o.player_id != r.player_id
+        WHERE {condition}
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (player_id, relation, other_id, role) DO UPDATE SET
+            games = games + excluded.games,
+            wins = wins + excluded.wins,
+            goal_difference = goal_difference + excluded.goal_difference,
+            elo_delta = elo_delta + excluded.elo_delta
+        """,
+        [sign] * 4 + params,
+    )
+
+
+def played_since(conn, position, player_ids):
+    """
+    Tells whether any of the players played after the match at the (timestamp,
+    id) position, or a season started after it. Otherwise the match is the last
+    one of each of its players, and can be rated or rolled back on its own.
+    """
+    player_ids = [p for p in player_ids if p is not None]
+    players = ", ".join("?" * len(player_ids))
+    return conn.execute(
+        f"""
+        SELECT
+            EXISTS (
+                SELECT 1 FROM matches
+                WHERE (timestamp, id) > (?, ?)
+                    AND (
+                        blue_team_att_id IN ({players})
+                        OR blue_team_def_id IN ({players})
+                        OR red_team_att_id IN ({players})
+                        OR red_team_def_id IN ({players})
+                    )
+            )
+            OR EXISTS (SELECT 1 FROM seasons WHERE starts_at > ?)
+        """,
+        [*position, *player_ids * 4, position[0]],
+    ).fetchone()[0]
+
+
+def rollback_match(conn, match_id):
+    """
+    Takes a match out of the ratings by restoring the state its snapshots hold
+    from before it, then drops them, without committing.
+
+    Only valid for the last match of each of its players, see played_since.
+    """
+    update_pair_stats(conn, match_id=match_id, sign=-1)
+    conn.execute(
+        """
+        UPDATE players
+        SET
+            elo = r.elo_before,
+            games_played = r.games_played_before,
+            games_won = r.games_won_before,
+            win_rate = 1.0 * r.games_won_before / NULLIF(r.games_played_before, 0)
+        FROM match_ratings AS r
+        WHERE r.match_id = ? AND r.player_id = players.id
+        """,
+        [match_id],
+    )
+    conn.execute(
+        """
+        UPDATE locale_ratings
+        SET
+            elo = r.elo_before,
+            games_played = r.games_played_before,
+            games_won = r.games_won_before,
+            win_rate = 1.0 * r.games_won_before / NULLIF(r.games_played_before, 0)
+        FROM locale_match_ratings AS r
+        WHERE r.match_id = ?
+            AND r.locale = locale_ratings.locale
+            AND r.player_id = locale_ratings.player_id
+        """,
+        [match_id],
+    )
+    for table in ("match_ratings", "locale_match_ratings"):
+        conn.execute(f"DELETE FROM {table} WHERE match_id = ?", [match_id])
+
+
+def load_match_ratings_state(conn, position, ids, elo, games_played, games_won):
+    """
+    Rolls the rating arrays, loaded with the current player state, back to the
+    state they had right before the match at the given (timestamp, id) position.
+
+    Returns the positions of the players that played from that match onward.
+    """
     c = get_db_cursor(conn)
+    c.execute(
+        """
+        SELECT
+            r.player_id,
+            r.elo_before,
+            r.games_played_before,
+            r.games_won_before
+        FROM match_ratings r
+        JOIN matches m ON m.id = r.match_id
+        WHERE (m.timestamp, m.id) >= (?, ?)
+        ORDER BY m.timestamp DESC, m.id DESC
+        """,
+        position,
+    )
 
-    # Recalculate ELO scores for all players based on the new match information
-    all_matches = get_all_matches()
-
-    # Reset all player scores to the original value
-    reset_player_scores()
-
-    for match in all_matches:
-        locale = match[1]
-        blue_team_att = match[2]
-        blue_team_def = match[3]
-        red_team_att = match[4]
-        red_team_def = match[5]
-        match_type = match[6]
-        blue_score = match[7]
-        red_score = match[8]
-
-        # Update elo for all players:
-        # Get Elo for each player
-        blue_team_elo = c.execute(
-            "SELECT alias, elo, games_played, games_won FROM players WHERE alias IN (?, ?)",
-            [blue_team_att, blue_team_def],
-        ).fetchall()
-        red_team_elo = c.execute(
-            "SELECT alias, elo, games_played, games_won FROM players WHERE alias IN (?, ?)",
-            [red_team_att, red_team_def],
-        ).fetchall()
+    # The earliest snapshot of each player wins
+    index = {player_id: i for i, player_id in enumerate(ids.tolist())}
+    touched = set()
+    for player_id, elo_before, games_played_before, games_won_before in c.fetchall():
+        if player_id not in index:
+            continue
+        p = index[player_id]
+        elo[p] = elo_before
+        games_played[p] = games_played_before
+        games_won[p] = games_won_before
+        touched.add(p)
 
-        blue_team_new_elo, red_team_new_elo = calculate_elo_rating(
-            [_[1] for _ in blue_team_elo],
-            [_[1] for _ in red_team_elo],
-            1 * (blue_score == 10),
-            k_factor=40,
-        )
-
-        for i, (player_, _, games_played_, games_won_) in enumerate(blue_team_elo):
-            new_games_played_ = games_played_ + 1
-            new_games_won_ = games_won_ + 1 * (blue_score == 10)
-            new_win_rate = new_games_won_ / new_games_played_
-            c.execute(
-                """
-                UPDATE players
-                SET elo = ?, games_played = ?, games_won = ?, win_rate = ?
-                WHERE alias = ?;
-                """,
-                [
-                    blue_team_new_elo[i],
-                    new_games_played_,
-                    new_games_won_,
-                    new_win_rate,
-                    player_,
-                ],
+    return touched
+
+
+def load_locale_ratings_state(conn, position, ids, locales):
+    """
+    Loads the current ratings of the given locales, and of every locale with
+    snapshots from the (timestamp, id) position onward, rolled back to the state
+    they had right before the match at that position.
+
+    Returns a dict mapping each locale to its rating arrays and the positions of
+    the players that played in it from that match onward.
+    """
+    c = get_db_cursor(conn)
+    c.execute(
+        """
+        SELECT
+            r.locale,
+            r.player_id,
+            r.elo_before,
+            r.games_played_before,
+            r.games_won_before
+        FROM locale_match_ratings r
+        JOIN matches m ON m.id = r.match_id
+        WHERE (m.timestamp, m.id) >= (?, ?)
+        ORDER BY m.timestamp DESC, m.id DESC
+        """,
+        position,
+    )
+    snapshots = c.fetchall()
+
+    # A match may have moved to another locale since its snapshots were taken
+    states = {
+        locale: (*get_locale_state(conn, locale, ids), set())
+        for locale in set(locales) | {s[0] for s in snapshots}
+    }
+
+    # The earliest snapshot of each player wins
+    index = {player_id: i for i, player_id in enumerate(ids.tolist())}
+    for (
+        locale,
+        player_id,
+        elo_before,
+        games_played_before,
+        games_won_before,
+    ) in snapshots:
+        if player_id not in index:
+            continue
+        p = index[player_id]
+        elo, games_played, games_won, touched = states[locale]
+        elo[p] = elo_before
+        games_played[p] = games_played_before
+        games_won[p] = games_won_before
+        touched.add(p)
+
+    return states
+
+
+def initial_locale_state(ids):
+    return (
+        np.full(len(ids), INITIAL_ELO, dtype=np.float64),
+        np.zeros(len(ids), dtype=np.int64),
+        np.zeros(len(ids), dtype=np.int64),
+        set(),
+    )
+
+
+def load_season_checkpoint(conn, season, ids, locales):
+    """
+    Loads the ratings at the start of the season, once soft reset, globally and
+    for the given locales and every locale of the checkpoint. Players missing
+    from the checkpoint start from the initial values.
+
+    Returns the global rating arrays, and a dict mapping each locale to its
+    rating arrays and the positions of the players of its checkpoint.
+    """
+    season_id, _, carry_over = season
+    index = {player_id: i for i, player_id in enumerate(ids.tolist())}
+
+    elo, games_played, games_won, _ = initial_locale_state(ids)
+    for player_id, elo_, games_played_, games_won_ in conn.execute(
+        """
+        SELECT player_id, elo, games_played, games_won
+        FROM season_ratings
+        WHERE season_id = ?
+        """,
+        [season_id],
+    ):
+        if player_id in index:
+            p = index[player_id]
+            elo[p], games_played[p], games_won[p] = elo_, games_played_, games_won_
+    soft_reset(elo, carry_over)
+
+    rows = conn.execute(
+        """
+        SELECT locale, player_id, elo, games_played, games_won
+        FROM season_locale_ratings
+        WHERE season_id = ?
+        """,
+        [season_id],
+    ).fetchall()
+    states = {
+        locale: initial_locale_state(ids)
+        for locale in set(locales) | {row[0] for row in rows}
+    }
+    for locale, player_id, elo_, games_played_, games_won_ in rows:
+        if player_id in index:
+            p = index[player_id]
+            locale_elo, locale_played, locale_won, touched = states[locale]
+            locale_elo[p] = elo_
+            locale_played[p] = games_played_
+            locale_won[p] = games_won_
+            touched.add(p)
+    for locale_elo, *_ in states.values():
+        soft_reset(locale_elo, carry_over)
+
+    return (elo, games_played, games_won), states
+
+
+def compute_replay(
+    conn, from_match_id=None, progress=None, since=None, exclude=(), checkpoint=False
+):
+    """
+    Replays the match history in memory, see replay_history. Only reads from
+    the database.
+
+    progress: called now and then with the fraction of the matches replayed.
+    exclude: ids of matches left out of the replay, e.g. one about to be deleted.
+    checkpoint: start from the latest season checkpoint before the changed
+                match, or from scratch, even when its snapshots could be used,
+                e.g. when they include the soft reset of a deleted season.
+
+    Returns the new ratings and snapshots, to be stored with save_replay.
+    """
+    ids, index, elo, games_played, games_won = get_player_state()
+    seasons = get_seasons(conn)
+
+    # The replay starts right before the changed match, from its snapshots, as
+    # long as no season starts in between. Otherwise it starts from the latest
+    # season checkpoint before it, or from scratch
+    changed = since
+    if from_match_id is not None:
+        changed = get_match_position(conn, from_match_id)
+    if changed is not None and changed[0] is None:
+        changed = None
+
+    position, season = None, None
+    if changed is not None and has_snapshots(conn):
+        if not checkpoint and all((s[1], 0) < changed for s in seasons):
+            position = changed
+        else:
+            season = latest_checkpoint(conn, seasons, changed)
+            if season is not None:
+                position = (season[1], 0)
+
+    matches = get_all_matches(since=position)
+    if exclude:
+        matches = [m for m in matches if m[0] not in exclude]
+    match_ids = np.array([m[0] for m in matches], dtype=np.int64)
+    locales = np.array([m[1] for m in matches], dtype=object)
+    timestamps = np.array([m[9] or "" for m in matches], dtype=str)
+    blue, red, blue_won = resolve_teams(matches, index)
+
+    if position is None:
+        # Replay from scratch
+        touched = set(range(len(ids)))
+        elo[:] = INITIAL_ELO
+        games_played[:] = 0
+        games_won[:] = 0
+        locale_states = {
+            locale: initial_locale_state(ids) for locale in set(locales.tolist())
+        }
+    elif season is None:
+        touched = load_match_ratings_state(
+            conn, position, ids, elo, games_played, games_won
+        )
+        locale_states = load_locale_ratings_state(
+            conn, position, ids, set(locales.tolist())
+        )
+    else:
+        touched = set(range(len(ids)))
+        (elo, games_played, games_won), locale_states = load_season_checkpoint(
+            conn, season, ids, set(locales.tolist())
+        )
+
+    # Seasons starting during the replay
+    if position is None:
+        later = seasons
+    elif season is None:
+        later = []
+    else:
+        later = [s for s in seasons if s[1] > season[1]]
+
+    # Recalculate ELO scores for all players based on the new match information,
+    # and for each locale on its own matches
+    jobs = {}
+    for locale, (locale_elo, locale_played, locale_won, _) in locale_states.items():
+        mask = locales == locale
+        jobs[locale] = (
+            match_ids[mask],
+            blue[mask],
+            red[mask],
+            blue_won[mask],
+            locale_elo,
+            locale_played,
+            locale_won,
+            season_boundaries(timestamps[mask], later),
+        )
+    (snapshots, checkpoints), locale_results = replay_pools(
+        jobs,
+        match_ids,
+        blue,
+        red,
+        blue_won,
+        elo,
+        games_played,
+        games_won,
+        season_boundaries(timestamps, later),
+        progress=progress,
+    )
+    touched.update(s[1] for s in snapshots)
+
+    locale_replays = {}
+    for locale, (
+        locale_elo,
+        locale_played,
+        locale_won,
+        locale_snapshots,
+        locale_checkpoints,
+    ) in locale_results.items():
+        locale_touched = locale_states[locale][3]
+        locale_touched.update(s[1] for s in locale_snapshots)
+        if later:
+            # Soft resets move every player that played before them
+            locale_touched.update(np.flatnonzero(locale_played).tolist())
+        locale_replays[locale] = (
+            locale_elo,
+            locale_played,
+            locale_won,
+            locale_snapshots,
+            sorted(locale_touched),
+            locale_checkpoints,
+        )
+
+    return {
+        "full": position is None,
+        "position": position,
+        "match_ids": match_ids.tolist(),
+        "ids": ids,
+        "elo": elo,
+        "games_played": games_played,
+        "games_won": games_won,
+        "snapshots": snapshots,
+        "touched": sorted(touched),
+        "checkpoints": checkpoints,
+        "locales": locale_replays,
+    }
+
+
+def save_replay(conn, replay):
+    """
+    Stores the result of compute_replay, without committing: the snapshots of
+    the replayed matches and their pair statistics are replaced, as are the
+    checkpoints of the seasons starting during the replay, and the final state
+    of every player that played them is written.
+    """
+    ids, touched = replay["ids"], replay["touched"]
+
+    if replay["full"]:
+        conn.execute("DELETE FROM match_ratings")
+        conn.execute("DELETE FROM locale_match_ratings")
+        conn.execute("DELETE FROM locale_ratings")
+        conn.execute("DELETE FROM pair_stats")
+        conn.execute("DELETE FROM season_ratings")
+        conn.execute("DELETE FROM season_locale_ratings")
+    else:
+        # The replaced snapshots still describe the matches as they were
+        update_pair_stats(conn, since=replay["position"], sign=-1)
+        for table in ("match_ratings", "locale_match_ratings"):
+            conn.executemany(
+                f"DELETE FROM {table} WHERE match_id = ?",
+                [(match_id,) for match_id in replay["match_ids"]],
             )
-            conn.commit()
-
-        for i, (player_, _, games_played_, games_won_) in enumerate(red_team_elo):
-            new_games_played_ = games_played_ + 1
-            new_games_won_ = games_won_ + 1 * (blue_score != 10)
-            new_win_rate = new_games_won_ / new_games_played_
-            c.execute(
-                """
-                UPDATE players
-                SET elo = ?, games_played = ?, games_won = ?, win_rate = ?
-                WHERE alias = ?;
-                """,
-                [
-                    red_team_new_elo[i],
-                    new_games_played_,
-                    new_games_won_,
-                    new_win_rate,
-                    player_,
-                ],
+        for table in ("season_ratings", "season_locale_ratings"):
+            conn.executemany(
+                f"DELETE FROM {table} WHERE season_id = ?",
+                [(season_id,) for season_id in replay["checkpoints"]],
             )
-            conn.commit()
+    save_match_ratings(conn, ids, replay["snapshots"])
+    annotate_match_ratings(conn, since=replay["position"])
+    update_pair_stats(conn, since=replay["position"])
+    save_player_scores(
+        conn,
+        ids[touched],
+        replay["elo"][touched],
+        replay["games_played"][touched],
+        replay["games_won"][touched],
+    )
+    for season_id, checkpoint in replay["checkpoints"].items():
+        save_season_ratings(conn, season_id, ids, *checkpoint)
+
+    for locale, (
+        elo,
+        games_played,
+        games_won,
+        snapshots,
+        touched,
+        checkpoints,
+    ) in replay["locales"].items():
+        save_locale_match_ratings(conn, locale, ids, snapshots)
+        save_locale_ratings(
+            conn,
+            locale,
+            ids[touched],
+            elo[touched],
+            games_played[touched],
+            games_won[touched],
+        )
+        for season_id, checkpoint in checkpoints.items():
+            save_season_ratings(conn, season_id, ids, *checkpoint, locale=locale)
+
+
+def replay_history(
+    conn, from_match_id=None, progress=None, since=None, checkpoint=False
+):
+    """
+    Replays the match history and stores the resulting ratings, without committing.
+
+    from_match_id: replay only from this match onward, starting from the rating
+                   snapshots stored right before it, or from the checkpoint of
+                   the latest season starting before it if another one started
+                   since. The whole history is replayed when it is None or no
+                   snapshots exist yet.
+    progress: called now and then with the fraction of the matches replayed.
+    since: (timestamp, id) position to replay from instead of from_match_id,
+           e.g. the start of a season.
+    checkpoint: never start from the snapshots, see compute_replay.
+    """
+    save_replay(
+        conn,
+        compute_replay(conn, from_match_id, progress, since, checkpoint=checkpoint),
+    )
+
+
+@retry_on_busy
+def recompute_elo(from_match_id=None):
+    """
+    Recomputes the player ratings by replaying the match history in a single
+    transaction, see replay_history. Raises ValueError for an unknown match.
+    """
+    conn = get_db_engine()
+    with immediate_transaction(conn):
+        if (
+            from_match_id is not None
+            and get_match_position(conn, from_match_id) is None
+        ):
+            raise ValueError(f"Unknown match: {from_match_id}")
+        replay_history(conn, from_match_id)
+
+
+def expected_score(rating, opponent_rating, scale=SCALE):
+    """
+    Expected score (win probability) of a rating against an opponent rating.
+
+    Works elementwise on numpy arrays, with broadcasting.
+    """
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / scale))
+
+
+def win_probability_matrix(ratings, teams=None, scale=SCALE):
+    """
+    Predicts the result of every pairing among players or teams at once.
+
+    ratings: Elo of each player.
+    teams: optional sequence of teams, each a sequence of positions in ratings.
+           A team plays with the average rating of its players, as in
+           calculate_elo_rating.
+
+    Returns a square matrix whose [i, j] item is the probability that player
+    (or team) i beats j.
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    if teams is not None:
+        ratings = np.array([ratings[list(team)].mean() for team in teams])
+    return expected_score(ratings[:, None], ratings[None, :], scale)
 
 
-def calculate_elo_rating(team1_rating, team2_rating, team1_result, k_factor=40):
+def calculate_elo_rating(
+    team1_rating, team2_rating, team1_result, k_factor=40, scale=400
+):
     """
     Calculates the new Elo ratings of teams after a match.
 
@@ -134,6 +1090,7 @@ def calculate_elo_rating(team1_rating, team2_rating, team1_result, k_factor=40):
     team1_result: float, the team1_result of the match (1 for a win, 0.5 for a draw, 0 for a loss).
     k_factor: int or float, the K-factor determines how much the Elo rating should change.
               (default value is 32, a commonly used value in chess)
+    scale: int or float, the rating difference that makes a win 10 times more likely than a loss.
 
     Returns updated Elo ratings for both teams as tuples.
     """
@@ -141,12 +1098,12 @@ def calculate_elo_rating(team1_rating, team2_rating, team1_result, k_factor=40):
     team2_avg_rating = sum(team2_rating) / len(team2_rating)
 
     team1_rating_change = [
-        k_factor * (team1_result - 1 / (1 + 10 ** ((team2_avg_rating - rating) / 400)))
+        k_factor * (team1_result - expected_score(rating, team2_avg_rating, scale))
         for rating in team1_rating
     ]
     team2_rating_change = [
         k_factor
-        * ((1 - team1_result) - 1 / (1 + 10 ** ((team1_avg_rating - rating) / 400)))
+        * ((1 - team1_result) - expected_score(rating, team1_avg_rating, scale))
         for rating in team2_rating
     ]
 
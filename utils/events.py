@@ -0,0 +1,334 @@
+import numpy as np
+
+from . import get_db_cursor, get_db_engine
+from .cache import versioned_cache
+from .db import immediate_transaction, retry_on_busy
+from .elo import (
+    INITIAL_ELO,
+    get_seasons,
+    replay_history,
+    replay_seasons,
+    resolve_teams,
+    season_boundaries,
+)
+
+# Events between two materialized rating snapshots
+SNAPSHOT_INTERVAL = 1000
+
+EVENT_COLUMNS = """
+            locale,
+            blue_team_att_id,
+            blue_team_def_id,
+            red_team_att_id,
+            red_team_def_id,
+            match_type,
+            blue_score,
+            red_score,
+            timestamp"""
+
+
+@versioned_cache
+def get_match_events(match_id=None, limit=100):
+    """
+    Returns the latest events of the log, or the ones of a match, newest first,
+    as (id, recorded_at, event, match id, locale, the aliases of the players,
+    match_type, blue_score, red_score) rows.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    where, params = "", []
+    if match_id is not None:
+        where, params = "WHERE e.match_id = ?", [match_id]
+
+    c.execute(
+        f"""
+        SELECT
+            e.id,
+            e.recorded_at,
+            e.event,
+            e.match_id,
+            e.locale,
+            LOWER(ba.alias),
+            LOWER(bd.alias),
+            LOWER(ra.alias),
+            LOWER(rd.alias),
+            e.match_type,
+            e.blue_score,
+            e.red_score
+        FROM match_events e
+        LEFT JOIN players ba ON ba.id = e.blue_team_att_id
+        LEFT JOIN players bd ON bd.id = e.blue_team_def_id
+        LEFT JOIN players ra ON ra.id = e.red_team_att_id
+        LEFT JOIN players rd ON rd.id = e.red_team_def_id
+        {where}
+        ORDER BY e.id DESC
+        LIMIT ?
+        """,
+        [*params, limit],
+    )
+    return c.fetchall()
+
+
+def last_event(conn):
+    return conn.execute("SELECT MAX(id) FROM match_events").fetchone()[0]
+
+
+def fold_events(conn, until=None):
+    """
+    Returns the matches as they were right after the event with id until, or as
+    they are now, folding the log: the latest event of each match gives its
+    values, unless it deleted the match.
+
+    Rows are shaped and ordered as the ones of get_all_matches.
+    """
+    where, params = "", []
+    if until is not None:
+        where, params = "WHERE id <= ?", [until]
+
+    return conn.execute(
+        f"""
+        SELECT match_id, {EVENT_COLUMNS}
+        FROM (
+            SELECT
+                *,
+                ROW_NUMBER() OVER (PARTITION BY match_id ORDER BY id DESC) AS latest
+            FROM match_events
+            {where}
+        )
+        WHERE latest = 1 AND event != 'deleted'
+        ORDER BY timestamp, match_id
+        """,
+        params,
+    ).fetchall()
+
+
+def fold_ratings(conn, until=None):
+    """
+    Derives the global player ratings right after the event with id until, or
+    after the latest one, from the log.
+
+    The fold starts from the latest rating snapshot before that event when every
+    event since created a match after all the ones logged until the snapshot,
+    and no season starts between them: only those matches are replayed.
+    Otherwise the log is folded and the matches replayed from scratch. Seasons
+    starting after the last folded match are left out.
+
+    Returns the player ids and the rating arrays aligned with them.
+    """
+    ids = np.array(
+        [row[0] for row in conn.execute("SELECT id FROM players ORDER BY id")],
+        dtype=np.int64,
+    )
+    index = {player_id: i for i, player_id in enumerate(ids.tolist())}
+    elo = np.full(len(ids), INITIAL_ELO, dtype=np.float64)
+    games_played = np.zeros(len(ids), dtype=np.int64)
+    games_won = np.zeros(len(ids), dtype=np.int64)
+
+    if until is None:
+        until = last_event(conn) or 0
+    seasons = get_seasons(conn)
+
+    base = conn.execute(
+        "SELECT MAX(event_id) FROM rating_snapshots WHERE event_id <= ?", [until]
+    ).fetchone()[0]
+    if base is not None:
+        # Position of the last match logged until the snapshot, in replay order
+        position = conn.execute(
+            """
+            SELECT COALESCE(timestamp, ''), match_id
+            FROM match_events
+            WHERE id <= ?
+            ORDER BY 1 DESC, 2 DESC
+            LIMIT 1
+            """,
+            [base],
+        ).fetchone()
+        events = conn.execute(
+            f"""
+            SELECT event, match_id, {EVENT_COLUMNS}
+            FROM match_events
+            WHERE id > ? AND id <= ?
+            ORDER BY timestamp, match_id
+            """,
+            [base, until],
+        ).fetchall()
+        latest = (events[-1][10] or "") if events else position[0]
+        if all(
+            e[0] == "created" and (e[10] or "", e[1]) > position for e in events
+        ) and all((s[1], 0) < position for s in seasons if s[1] <= latest):
+            for player_id, elo_, games_played_, games_won_ in conn.execute(
+                """
+                SELECT player_id, elo, games_played, games_won
+                FROM rating_snapshots
+                WHERE event_id = ?
+                """,
+                [base],
+            ):
+                if player_id in index:
+                    p = index[player_id]
+                    elo[p], games_played[p], games_won[p] = (
+                        elo_,
+                        games_played_,
+                        games_won_,
+                    )
+            matches, seasons = [e[1:] for e in events], []
+        else:
+            base = None
+    if base is None:
+        matches = fold_events(conn, until)
+        # Seasons starting after the last of those matches had not started yet
+        latest = (matches[-1][9] or "") if matches else ""
+        seasons = [s for s in seasons if s[1] <= latest]
+
+    timestamps = np.array([m[9] or "" for m in matches], dtype=str)
+    blue, red, blue_won = resolve_teams(matches, index)
+    replay_seasons(
+        np.array([m[0] for m in matches], dtype=np.int64),
+        blue,
+        red,
+        blue_won,
+        elo,
+        games_played,
+        games_won,
+        season_boundaries(timestamps, seasons),
+    )
+    return ids, elo, games_played, games_won
+
+
+def due_snapshot(conn):
+    """
+    Returns the latest multiple of SNAPSHOT_INTERVAL events when the ratings
+    after it are not materialized yet, or None.
+    """
+    event_id = (last_event(conn) or 0) // SNAPSHOT_INTERVAL * SNAPSHOT_INTERVAL
+    if (
+        event_id == 0
+        or conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM rating_snapshots WHERE event_id >= ?)",
+            [event_id],
+        ).fetchone()[0]
+    ):
+        return None
+    return event_id
+
+
+@retry_on_busy
+def snapshot_ratings(conn):
+    """
+    Materializes the ratings of the due snapshot, if any, see due_snapshot.
+
+    The fold may replay the whole log, so it runs on a read snapshot without
+    holding the write lock, and only its result is stored in a short
+    transaction, unless a season was started or deleted meanwhile.
+
+    Returns True when a snapshot was stored.
+    """
+    event_id = due_snapshot(conn)
+    if event_id is None:
+        return False
+
+    conn.execute("BEGIN")
+    try:
+        seasons = get_seasons(conn)
+        ids, elo, games_played, games_won = fold_ratings(conn, event_id)
+    finally:
+        conn.commit()
+
+    played = np.flatnonzero(games_played)
+    with immediate_transaction(conn):
+        # The log is append-only, the seasons are all the fold depends on
+        if due_snapshot(conn) != event_id or get_seasons(conn) != seasons:
+            return False
+        conn.executemany(
+            """
+            INSERT INTO rating_snapshots (event_id, player_id, elo, games_played, games_won)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (event_id, *row)
+                for row in zip(
+                    ids[played].tolist(),
+                    elo[played].tolist(),
+                    games_played[played].tolist(),
+                    games_won[played].tolist(),
+                )
+            ],
+        )
+    return True
+
+
+def clear_rating_snapshots(conn):
+    # Snapshots are folded with the seasons of the time, which a new or deleted
+    # season changes
+    conn.execute("DELETE FROM rating_snapshots")
+
+
+@versioned_cache
+def get_ratings_at(event_id):
+    """
+    Returns the standings right after an event of the log, as get_ranking does
+    for the current ones.
+    """
+    conn = get_db_engine()
+    ids, elo, games_played, games_won = fold_ratings(conn, event_id)
+    aliases = dict(conn.execute("SELECT id, LOWER(alias) FROM players"))
+
+    played = np.flatnonzero(games_played)
+    played = played[np.argsort(-elo[played], kind="stable")]
+    return [
+        (
+            aliases[player_id],
+            elo_,
+            games_played_,
+            games_won_,
+            games_won_ / games_played_,
+        )
+        for player_id, elo_, games_played_, games_won_ in zip(
+            ids[played].tolist(),
+            elo[played].tolist(),
+            games_played[played].tolist(),
+            games_won[played].tolist(),
+        )
+    ]
+
+
+@retry_on_busy
+def revert_edit(match_id):
+    """
+    Gives a match back the values it had before its latest edit, and replays
+    the Elo from that match onward in a single transaction. The revert is
+    logged as an edit itself, and the worker materializes the rating snapshot
+    it may make due on its next poll.
+
+    Returns False when the latest change of the match is not an edit.
+    """
+    conn = get_db_engine()
+    with immediate_transaction(conn):
+        events = conn.execute(
+            """
+            SELECT id, event FROM match_events
+            WHERE match_id = ?
+            ORDER BY id DESC
+            LIMIT 2
+            """,
+            [match_id],
+        ).fetchall()
+        if len(events) < 2 or events[0][1] != "edited":
+            return False
+
+        conn.execute(
+            f"""
+            UPDATE matches
+            SET ({EVENT_COLUMNS}) = (
+                SELECT {EVENT_COLUMNS}
+                FROM match_events
+                WHERE id = ?
+            )
+            WHERE id = ?
+            """,
+            [events[1][0], match_id],
+        )
+        replay_history(conn, from_match_id=match_id)
+
+    return True
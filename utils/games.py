@@ -1,6 +1,58 @@
 from . import get_db_cursor, get_db_engine
+from .cache import versioned_cache
+from .db import immediate_transaction, retry_on_busy
+from .elo import (
+    INITIAL_ELO,
+    annotate_match_ratings,
+    compute_replay,
+    get_locale_state,
+    get_match_position,
+    get_player_state,
+    has_snapshots,
+    played_since,
+    replay_history,
+    replay_matches,
+    resolve_teams,
+    rollback_match,
+    save_locale_match_ratings,
+    save_locale_ratings,
+    save_match_ratings,
+    save_player_scores,
+    save_replay,
+    update_pair_stats,
+    win_probability_matrix,
+)
+from .events import EVENT_COLUMNS
+from .jobs import get_recompute_worker, queue_recompute, schedule_snapshot
 
+# Columns of matches referencing the players of the teams
+TEAM_COLUMNS = [
+    "blue_team_att_id",
+    "blue_team_def_id",
+    "red_team_att_id",
+    "red_team_def_id",
+]
 
+# Match rows as shown by the pages, with the aliases of the players of the
+# matches m, joined by TEAM_JOINS
+MATCH_FIELDS = """
+            m.id,
+            m.locale,
+            LOWER(ba.alias) as blue_team_att,
+            LOWER(bd.alias) as blue_team_def,
+            LOWER(ra.alias) as red_team_att,
+            LOWER(rd.alias) as red_team_def,
+            m.match_type,
+            m.blue_score,
+            m.red_score"""
+TEAM_JOINS = """
+        LEFT JOIN players ba ON ba.id = m.blue_team_att_id
+        LEFT JOIN players bd ON bd.id = m.blue_team_def_id
+        LEFT JOIN players ra ON ra.id = m.red_team_att_id
+        LEFT JOIN players rd ON rd.id = m.red_team_def_id"""
+
+
+@versioned_cache
 def get_player_aliases():
     conn = get_db_engine()
     c = get_db_cursor(conn)
@@ -13,6 +65,314 @@ def get_player_aliases():
     return [alias[0] for alias in player_aliases]
 
 
+@versioned_cache
+def get_player_ids():
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Id of every player, by alias, for the matches that reference them by id.
+    # Aliases differing only by case map to the oldest player.
+    c.execute("SELECT LOWER(alias) as alias, id FROM players ORDER BY id DESC")
+    return dict(c.fetchall())
+
+
+def player_id(alias):
+    return None if alias is None else get_player_ids().get(alias.lower())
+
+
+@versioned_cache
+def get_player_ratings():
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Current Elo of every player, by alias
+    c.execute("SELECT LOWER(alias) as alias, elo FROM players")
+    return dict(c.fetchall())
+
+
+def player_exists(alias):
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Check if the alias already exists in the database
+    c.execute("SELECT COUNT(*) FROM players WHERE alias=?", (alias,))
+    return c.fetchone()[0] > 0
+
+
+def register_player(alias):
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Insert the new player into the database with a starting Elo score of 1000
+    c.execute(
+        "INSERT INTO players (alias, elo, games_played, games_won) VALUES (?, ?, ?, ?)",
+        (alias, INITIAL_ELO, 0, 0),
+    )
+    conn.commit()
+
+
+@versioned_cache
+def get_ranking(locale=None):
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Retrieve player rankings from the database, global or for a single locale
+    if locale is None:
+        c.execute(
+            "SELECT LOWER(alias) as alias, elo, games_played, games_won, win_rate FROM players WHERE games_played > 0 ORDER BY elo DESC"
+        )
+    else:
+        c.execute(
+            """
+            SELECT
+                LOWER(p.alias) as alias,
+                r.elo,
+                r.games_played,
+                r.games_won,
+                r.win_rate
+            FROM locale_ratings r
+            JOIN players p ON p.id = r.player_id
+            WHERE r.locale = ? AND r.games_played > 0
+            ORDER BY r.elo DESC
+            """,
+            (locale,),
+        )
+    return c.fetchall()
+
+
+@versioned_cache
+def get_win_probabilities():
+    """
+    Returns the aliases of the ranked players, best first, and the matrix of
+    their predicted win probabilities against each other.
+    """
+    ranking = get_ranking()
+    return [row[0] for row in ranking], win_probability_matrix(
+        [row[1] for row in ranking]
+    )
+
+
+@versioned_cache
+def get_pair_stats(alias, relation, other=None, role=None):
+    """
+    Returns the record of a player with each of their teammates or opponents,
+    as (alias, games, wins, goal_difference, elo_delta) rows, most games first.
+
+    relation: "teammate" or "opponent".
+    other: only the record with this player.
+    role: only the games played as "attacker", "defender" or "single" (1v1).
+    """
+    player, opponent = player_id(alias), player_id(other)
+    if player is None or (other is not None and opponent is None):
+        return []
+
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    conditions = ["s.player_id = ?", "s.relation = ?"]
+    params = [player, relation]
+    if other is not None:
+        conditions.append("s.other_id = ?")
+        params.append(opponent)
+    if role is not None:
+        conditions.append("s.role = ?")
+        params.append(role)
+
+    c.execute(
+        f"""
+        SELECT
+            LOWER(o.alias) as alias,
+            SUM(s.games) as games,
+            SUM(s.wins) as wins,
+            SUM(s.goal_difference) as goal_difference,
+            SUM(s.elo_delta) as elo_delta
+        FROM pair_stats s
+        JOIN players o ON o.id = s.other_id
+        WHERE {" AND ".join(conditions)}
+        GROUP BY s.other_id
+        HAVING SUM(s.games) > 0
+        ORDER BY games DESC, alias
+        """,
+        params,
+    )
+    return c.fetchall()
+
+
+def get_head_to_head(alias, other):
+    """
+    Returns the (games, wins, goal_difference, elo_delta) of a player against
+    another one, as opponents.
+    """
+    rows = get_pair_stats(alias, "opponent", other)
+    return rows[0][1:] if rows else (0, 0, 0, 0.0)
+
+
+@versioned_cache
+def get_rating_history(alias):
+    """
+    Returns the games of a player in replay order, as (timestamp, elo, won) rows
+    with the Elo right after each game, from the stored rating snapshots.
+    """
+    player = player_id(alias)
+    if player is None:
+        return []
+
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    c.execute(
+        """
+        SELECT
+            m.timestamp,
+            r.elo_after,
+            r.games_won_after - r.games_won_before as won
+        FROM match_ratings r
+        JOIN matches m ON m.id = r.match_id
+        WHERE r.player_id = ?
+        ORDER BY m.timestamp, m.id
+        """,
+        (player,),
+    )
+    return c.fetchall()
+
+
+@versioned_cache
+def get_recent_matches(limit=10):
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    # Retrieve the last matches from the database
+    c.execute(
+        f"""
+        SELECT {MATCH_FIELDS}, m.timestamp
+        FROM matches m
+        {TEAM_JOINS}
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT ?
+    """,
+        (limit,),
+    )
+    return c.fetchall()
+
+
+@versioned_cache
+def get_matches_page(
+    limit=10,
+    before=None,
+    after=None,
+    alias=None,
+    locale=None,
+    match_type=None,
+    date_from=None,
+    date_to=None,
+):
+    """
+    Retrieves a page of matches, newest first, using keyset pagination on
+    (timestamp, id) so that every page costs the same whatever its depth.
+
+    before: (timestamp, id) of the last match of the current page, to get the
+            next, older, page.
+    after: (timestamp, id) of the first match of the current page, to get the
+           previous, newer, page.
+    alias, locale, match_type: only return the matches matching these values.
+    date_from, date_to: only return the matches played between these dates,
+                        both included.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    filters, params = [], []
+    if locale is not None:
+        filters.append("m.locale = ?")
+        params.append(locale)
+    if match_type is not None:
+        filters.append("m.match_type = ?")
+        params.append(match_type)
+    if date_from is not None:
+        filters.append("m.timestamp >= ?")
+        params.append(str(date_from))
+    if date_to is not None:
+        filters.append("m.timestamp < date(?, '+1 day')")
+        params.append(str(date_to))
+
+    order = "DESC"
+    if before is not None:
+        filters.append("(m.timestamp, m.id) < (?, ?)")
+        params.extend(before)
+    elif after is not None:
+        filters.append("(m.timestamp, m.id) > (?, ?)")
+        params.extend(after)
+        order = "ASC"
+
+    if alias is None:
+        where = f"WHERE {' AND '.join(filters)}" if filters else ""
+        query = f"""
+        SELECT {MATCH_FIELDS}, m.timestamp
+        FROM matches m
+        {TEAM_JOINS}
+        {where}
+        ORDER BY m.timestamp {order}, m.id {order}
+        LIMIT ?
+        """
+        params.append(limit)
+    else:
+        player = player_id(alias)
+        if player is None:
+            return []
+
+        # One index walk per player column, each reading at most one page
+        subqueries = []
+        for col in TEAM_COLUMNS:
+            where = " AND ".join([f"m.{col} = ?", *filters])
+            subqueries.append(
+                f"""
+            SELECT * FROM (
+                SELECT m.id, m.timestamp
+                FROM matches m
+                WHERE {where}
+                ORDER BY m.timestamp {order}, m.id {order}
+                LIMIT ?
+            )"""
+            )
+        query = f"""
+        SELECT {MATCH_FIELDS}, m.timestamp
+        FROM ({" UNION ".join(subqueries)}
+        ) page
+        JOIN matches m ON m.id = page.id
+        {TEAM_JOINS}
+        ORDER BY m.timestamp {order}, m.id {order}
+        LIMIT ?
+        """
+        params = [*([player, *params, limit] * 4), limit]
+
+    c.execute(query, params)
+    matches = c.fetchall()
+
+    # Pages are always returned newest first
+    if order == "ASC":
+        matches.reverse()
+    return matches
+
+
+def get_match_info(game_id):
+    # Retrieve match information from the database based on the game_id
+
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    c.execute(
+        f"""
+        SELECT {MATCH_FIELDS}
+        FROM matches m
+        {TEAM_JOINS}
+        WHERE m.id = ?
+    """,
+        (game_id,),
+    )
+    match = c.fetchone()
+    return match
+
+
 def valid_goals(blue_score, red_score):
     return blue_score == 10 or red_score == 10
 
@@ -21,3 +381,233 @@ def valid_teams(blue_team_att, blue_team_def, red_team_att, red_team_def):
     if blue_team_def is None and red_team_def is None and blue_team_att != red_team_att:
         return True
     return len({blue_team_att, blue_team_def, red_team_att, red_team_def}) == 4
+
+
+@retry_on_busy
+def register_match(
+    locale,
+    blue_team_att,
+    blue_team_def,
+    red_team_att,
+    red_team_def,
+    match_type,
+    blue_score,
+    red_score,
+):
+    """
+    Registers a match and updates the Elo of its players in a single transaction:
+    on its own, unless some of them played matches timestamped after it.
+
+    Returns the id of the new match.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    with immediate_transaction(conn):
+        team_ids = [
+            player_id(alias)
+            for alias in (blue_team_att, blue_team_def, red_team_att, red_team_def)
+        ]
+        c.execute(
+            "INSERT INTO matches (locale, blue_team_att_id, blue_team_def_id, red_team_att_id, red_team_def_id, match_type, blue_score, red_score) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (locale, *team_ids, match_type, blue_score, red_score),
+        )
+        match_id = c.lastrowid
+
+        if not has_snapshots(conn):
+            replay_history(conn)
+        elif played_since(conn, get_match_position(conn, match_id), team_ids):
+            # Matches timestamped after it, e.g. imported ones, are replayed
+            replay_history(conn, from_match_id=match_id)
+        else:
+            rate_match(
+                conn, match_id, locale, team_ids, match_type, blue_score, red_score
+            )
+
+    schedule_snapshot(conn)
+    return match_id
+
+
+def rate_match(conn, match_id, locale, team_ids, match_type, blue_score, red_score):
+    """
+    Updates the Elo of the players of a match, globally and in its locale, and
+    stores its snapshots, without committing.
+
+    Only valid for the last match of each of its players, see played_since.
+    """
+    ids, index, elo, games_played, games_won = get_player_state(team_ids)
+    blue, red, blue_won = resolve_teams(
+        [(match_id, locale, *team_ids, match_type, blue_score, red_score)],
+        index,
+    )
+    snapshots = replay_matches(
+        [match_id], blue, red, blue_won, elo, games_played, games_won
+    )
+    save_player_scores(conn, ids, elo, games_played, games_won)
+    save_match_ratings(conn, ids, snapshots)
+    annotate_match_ratings(conn, match_id=match_id)
+    update_pair_stats(conn, match_id=match_id)
+
+    elo, games_played, games_won = get_locale_state(conn, locale, ids)
+    snapshots = replay_matches(
+        [match_id], blue, red, blue_won, elo, games_played, games_won
+    )
+    save_locale_ratings(conn, locale, ids, elo, games_played, games_won)
+    save_locale_match_ratings(conn, locale, ids, snapshots)
+
+
+@retry_on_busy
+def delete_match(game_id):
+    """
+    Deletes a match and takes it out of the ratings in a single transaction.
+    The match stays in the event log, and restore_match brings it back.
+
+    When it is the last match of each of its players, e.g. one registered twice
+    by mistake, its rating changes are rolled back from its own snapshots.
+    Otherwise the matches played after it are replayed.
+
+    Returns False when the match does not exist.
+    """
+    conn = get_db_engine()
+
+    with immediate_transaction(conn):
+        match = conn.execute(
+            f"SELECT timestamp, id, {', '.join(TEAM_COLUMNS)} FROM matches WHERE id = ?",
+            [game_id],
+        ).fetchone()
+        if match is None:
+            return False
+
+        if has_snapshots(conn) and not played_since(conn, match[:2], match[2:]):
+            rollback_match(conn, game_id)
+            conn.execute("DELETE FROM matches WHERE id = ?", [game_id])
+        else:
+            # The replay starts from the snapshots of the match, dropped with it
+            replay = compute_replay(conn, from_match_id=game_id, exclude={game_id})
+            update_pair_stats(conn, match_id=game_id, sign=-1)
+            for table in ("match_ratings", "locale_match_ratings"):
+                conn.execute(f"DELETE FROM {table} WHERE match_id = ?", [game_id])
+            conn.execute("DELETE FROM matches WHERE id = ?", [game_id])
+            save_replay(conn, replay)
+
+    schedule_snapshot(conn)
+    return True
+
+
+@retry_on_busy
+def restore_match(game_id):
+    """
+    Brings a deleted match back from the event log, with its id and timestamp,
+    and rates it in a single transaction: on its own when it is the last match
+    of each of its players, otherwise by replaying from it.
+
+    Returns False when the latest change of the match is not its deletion.
+    """
+    conn = get_db_engine()
+
+    with immediate_transaction(conn):
+        event = conn.execute(
+            """
+            SELECT id, event FROM match_events
+            WHERE match_id = ?
+            ORDER BY id DESC
+            LIMIT 1
+            """,
+            [game_id],
+        ).fetchone()
+        if event is None or event[1] != "deleted":
+            return False
+
+        conn.execute(
+            f"""
+            INSERT INTO matches (id, {EVENT_COLUMNS})
+            SELECT match_id, {EVENT_COLUMNS}
+            FROM match_events
+            WHERE id = ?
+            """,
+            [event[0]],
+        )
+        match = conn.execute(
+            f"""
+            SELECT timestamp, id, locale, {', '.join(TEAM_COLUMNS)}, match_type, blue_score, red_score
+            FROM matches
+            WHERE id = ?
+            """,
+            [game_id],
+        ).fetchone()
+
+        if has_snapshots(conn) and not played_since(conn, match[:2], match[3:7]):
+            rate_match(conn, game_id, match[2], match[3:7], *match[7:])
+        else:
+            replay_history(conn, from_match_id=game_id)
+
+    schedule_snapshot(conn)
+    return True
+
+
+@retry_on_busy
+def edit_match(
+    game_id,
+    locale,
+    blue_team_att,
+    blue_team_def,
+    red_team_att,
+    red_team_def,
+    match_type,
+    blue_score,
+    red_score,
+    background=False,
+):
+    """
+    Updates a match and replays the Elo from that match onward in a single
+    transaction.
+
+    background: queue the replay as a job for the background worker instead,
+                in the same transaction as the update.
+
+    Returns the id of the queued job, or None.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    with immediate_transaction(conn):
+        # Update the match information in the database based on the game_id
+        c.execute(
+            """
+            UPDATE matches 
+            SET 
+                locale = ?,
+                blue_team_att_id = ?,
+                blue_team_def_id = ?,
+                red_team_att_id = ?,
+                red_team_def_id = ?,
+                match_type = ?,
+                blue_score = ?,
+                red_score = ?
+            WHERE id = ?
+        """,
+            (
+                locale,
+                player_id(blue_team_att),
+                player_id(blue_team_def),
+                player_id(red_team_att),
+                player_id(red_team_def),
+                match_type,
+                blue_score,
+                red_score,
+                game_id,
+            ),
+        )
+        if background:
+            job_id = queue_recompute(conn, from_match_id=game_id)
+        else:
+            replay_history(conn, from_match_id=game_id)
+            job_id = None
+
+    # The worker also materializes the due snapshot after running the job
+    if job_id is not None:
+        get_recompute_worker().wake()
+    else:
+        schedule_snapshot(conn)
+    return job_id
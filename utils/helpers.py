@@ -1,13 +1,37 @@
 import base64
 import os
+import time
 import streamlit as st
 from streamlit.components.v1 import html
 from typing import Union
 
+from .cache import clear_caches
+from .jobs import get_job
+
 
 def clear_cache():
-    st.experimental_memo.clear()
-    st.experimental_singleton.clear()
+    # The connection pool stays: its connections are closed when the app exits
+    if hasattr(st, "cache_data"):
+        st.cache_data.clear()
+    else:
+        st.experimental_memo.clear()
+    clear_caches()
+
+
+def wait_for_job(job_id, text="Recomputing ELO scores...", interval=0.2):
+    """
+    Shows the progress of a background job until it ends, then returns it.
+
+    Interacting with the page stops the wait, not the job.
+    """
+    bar = st.progress(0.0, text=text)
+    job = get_job(job_id)
+    while job is not None and job["status"] in ("queued", "running"):
+        bar.progress(job["progress"], text=text)
+        time.sleep(interval)
+        job = get_job(job_id)
+    bar.empty()
+    return job
 
 
 def session_values(prefix: str = None) -> dict:
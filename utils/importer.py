@@ -0,0 +1,249 @@
+import pandas as pd
+
+from . import get_db_engine
+from .db import immediate_transaction, retry_on_busy
+from .elo import replay_history
+from .games import TEAM_COLUMNS, get_player_ids
+
+# Rows read from the CSV files at a time
+CHUNK_SIZE = 10_000
+
+PLAYER_COLUMNS = ["alias", "elo", "games_played", "games_won", "win_rate"]
+MATCH_COLUMNS = [
+    "locale",
+    "blue_team_att",
+    "blue_team_def",
+    "red_team_att",
+    "red_team_def",
+    "match_type",
+    "blue_score",
+    "red_score",
+    "timestamp",
+]
+ALIAS_COLUMNS = ["blue_team_att", "blue_team_def", "red_team_att", "red_team_def"]
+
+
+def read_csv_chunks(source, columns, text_columns, chunksize=CHUNK_SIZE):
+    # Uploaded files may have been read already, e.g. for a preview or by an
+    # attempt that hit a locked database
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+    chunks = pd.read_csv(
+        source,
+        chunksize=chunksize,
+        dtype={col: str for col in text_columns},
+        keep_default_na=False,
+        na_values=[""],
+    )
+    for chunk in chunks:
+        missing = [col for col in columns if col not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(missing)}")
+        yield chunk[columns]
+
+
+def valid_goals_mask(df):
+    # Vectorized valid_goals
+    return (df["blue_score"] == 10) | (df["red_score"] == 10)
+
+
+def valid_teams_mask(df):
+    # Vectorized valid_teams: missing players compare equal to each other, as
+    # None does in the set built by valid_teams
+    missing = df[ALIAS_COLUMNS].isna()
+
+    def same(a, b):
+        return (df[a] == df[b]).fillna(False) | (missing[a] & missing[b])
+
+    one_vs_one = (
+        missing["blue_team_def"]
+        & missing["red_team_def"]
+        & ~same("blue_team_att", "red_team_att")
+    )
+
+    distinct = pd.Series(True, index=df.index)
+    for i, a in enumerate(ALIAS_COLUMNS):
+        for b in ALIAS_COLUMNS[i + 1 :]:
+            distinct &= ~same(a, b)
+
+    return one_vs_one | distinct
+
+
+def reject(rejected, df, mask, reason):
+    if mask.any():
+        rows = df[mask].copy()
+        # Chunks keep numbering rows from the start of the file, so this is the
+        # line of the row in the CSV file, counting the header
+        rows.insert(0, "line", rows.index + 2)
+        rows.insert(1, "reason", reason)
+        rejected.append(rows)
+    return df[~mask]
+
+
+def validate_matches(df, player_ids):
+    """
+    Splits a chunk of matches in valid rows and rejected rows.
+
+    player_ids: dict mapping each lowercase alias to the id of its player.
+
+    Returns the valid rows, with the ids of the players in place of their
+    aliases, and a list of frames with the rejected rows, with the line they
+    come from and the reason they were rejected.
+    """
+    rejected = []
+    df = df.copy()
+    df["blue_score"] = pd.to_numeric(df["blue_score"], errors="coerce")
+    df["red_score"] = pd.to_numeric(df["red_score"], errors="coerce")
+
+    df = reject(
+        rejected,
+        df,
+        df["blue_score"].isna() | df["red_score"].isna(),
+        "Scores must be numbers",
+    )
+    df = reject(
+        rejected,
+        df,
+        (df["blue_score"] % 1 != 0) | (df["red_score"] % 1 != 0),
+        "Scores must be whole numbers",
+    )
+    df = reject(
+        rejected,
+        df,
+        df["blue_team_att"].isna() | df["red_team_att"].isna(),
+        "Attackers are required",
+    )
+    df = reject(
+        rejected,
+        df,
+        ~valid_teams_mask(df),
+        "Player names must be different",
+    )
+    df = reject(
+        rejected,
+        df,
+        ~valid_goals_mask(df),
+        "One team must have scored ten goals",
+    )
+
+    ids = df[ALIAS_COLUMNS].apply(lambda col: col.str.lower().map(player_ids))
+    df = reject(
+        rejected,
+        df,
+        (df[ALIAS_COLUMNS].notna() & ids.isna()).any(axis=1),
+        "Unknown player alias",
+    )
+
+    df = df.astype({"blue_score": int, "red_score": int})
+    df[ALIAS_COLUMNS] = ids.loc[df.index].astype("Int64")
+    return df, rejected
+
+
+def validate_players(df, seen):
+    rejected = []
+    df = reject(rejected, df, df["alias"].isna(), "Alias is required")
+
+    duplicated = df["alias"].duplicated() | df["alias"].isin(seen)
+    df = reject(rejected, df, duplicated, "Player alias already exists")
+    seen.update(df["alias"])
+
+    return df, rejected
+
+
+def to_rows(df):
+    # Plain Python values with None for missing cells, as sqlite3 expects
+    df = df.astype(object)
+    return df.where(df.notna(), None).itertuples(index=False, name=None)
+
+
+def rejection_report(rejected, columns):
+    if not rejected:
+        return pd.DataFrame(columns=["line", "reason", *columns])
+    return pd.concat(rejected, ignore_index=True)
+
+
+@retry_on_busy
+def import_players(source, chunksize=CHUNK_SIZE, recompute=True):
+    """
+    Replaces the players table with the rows of a CSV file in a single transaction.
+
+    Players already registered keep their id, so that their matches still refer
+    to them, and players missing from the file are removed unless they have
+    matches.
+
+    source: path or file-like object, read in chunks of chunksize rows.
+    recompute: replay the match history for the new players once they are loaded.
+
+    Returns the number of imported players and a frame with the rejected rows.
+    """
+    conn = get_db_engine()
+    imported, rejected, seen = 0, [], set()
+
+    with immediate_transaction(conn):
+        for chunk in read_csv_chunks(source, PLAYER_COLUMNS, ["alias"], chunksize):
+            valid, rejected_ = validate_players(chunk, seen)
+            rejected.extend(rejected_)
+
+            rows = list(to_rows(valid))
+            conn.executemany(
+                "UPDATE players SET elo = ?, games_played = ?, games_won = ?, win_rate = ? WHERE alias = ?",
+                [(*row[1:], row[0]) for row in rows],
+            )
+            # Only new aliases take a new id
+            conn.executemany(
+                "INSERT INTO players (alias, elo, games_played, games_won, win_rate) "
+                "SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM players WHERE alias = ?)",
+                [(*row, row[0]) for row in rows],
+            )
+            imported += len(valid)
+
+        has_matches = " UNION ALL ".join(
+            f"SELECT 1 FROM matches WHERE {col} = ?" for col in TEAM_COLUMNS
+        )
+        conn.executemany(
+            f"DELETE FROM players WHERE id = ? AND NOT EXISTS ({has_matches})",
+            [
+                (player,) * (len(TEAM_COLUMNS) + 1)
+                for alias, player in conn.execute("SELECT alias, id FROM players")
+                if alias not in seen
+            ],
+        )
+
+        if recompute:
+            replay_history(conn)
+
+    return imported, rejection_report(rejected, PLAYER_COLUMNS)
+
+
+@retry_on_busy
+def import_matches(source, chunksize=CHUNK_SIZE, recompute=True):
+    """
+    Replaces the matches table with the rows of a CSV file in a single transaction.
+
+    source: path or file-like object, read in chunks of chunksize rows.
+    recompute: replay the imported history once all the matches are loaded.
+
+    Returns the number of imported matches and a frame with the rejected rows.
+    """
+    conn = get_db_engine()
+    imported, rejected = 0, []
+    text_columns = ["locale", *ALIAS_COLUMNS, "match_type", "timestamp"]
+
+    with immediate_transaction(conn):
+        player_ids = get_player_ids()
+        conn.execute("DELETE FROM matches")
+        for chunk in read_csv_chunks(source, MATCH_COLUMNS, text_columns, chunksize):
+            valid, rejected_ = validate_matches(chunk, player_ids)
+            rejected.extend(rejected_)
+
+            conn.executemany(
+                "INSERT INTO matches(locale, blue_team_att_id, blue_team_def_id, red_team_att_id, red_team_def_id, match_type, blue_score, red_score, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                to_rows(valid),
+            )
+            imported += len(valid)
+
+        if recompute:
+            replay_history(conn)
+
+    return imported, rejection_report(rejected, MATCH_COLUMNS)
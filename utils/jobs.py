@@ -0,0 +1,254 @@
+import os
+import threading
+import traceback
+
+from . import cache_resource, get_db_engine
+from .db import immediate_transaction, retry_on_busy
+from .elo import compute_replay, get_match_position, save_replay
+from .events import due_snapshot, snapshot_ratings
+
+# Replays attempted off the write lock before replaying under it, when other
+# connections keep writing meanwhile
+OPTIMISTIC_ATTEMPTS = 3
+# Seconds the worker sleeps before looking for jobs queued by other processes
+POLL_INTERVAL = 5
+
+JOB_COLUMNS = [
+    "id",
+    "from_match_id",
+    "status",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+]
+
+
+def queue_recompute(conn, from_match_id=None):
+    """
+    Queues a recompute from the given match, or of the whole history, without
+    committing: the job exists only if the caller's transaction commits.
+
+    Returns the id of the job.
+    """
+    return conn.execute(
+        "INSERT INTO recompute_jobs (from_match_id) VALUES (?)", [from_match_id]
+    ).lastrowid
+
+
+def schedule_snapshot(conn):
+    # Rating snapshots are materialized by the worker, off the write lock of
+    # the change that made one due
+    if due_snapshot(conn) is not None:
+        get_recompute_worker().wake()
+
+
+@retry_on_busy
+def submit_recompute(from_match_id=None):
+    """
+    Queues a recompute and wakes the background worker up.
+
+    Returns the id of the job.
+    """
+    conn = get_db_engine()
+    with immediate_transaction(conn):
+        job_id = queue_recompute(conn, from_match_id)
+
+    get_recompute_worker().wake()
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Returns the job as a dict of its JOB_COLUMNS and its progress, from 0 to 1,
+    or None if it does not exist.
+    """
+    conn = get_db_engine()
+    row = conn.execute(
+        f"SELECT {', '.join(JOB_COLUMNS)} FROM recompute_jobs WHERE id = ?",
+        [job_id],
+    ).fetchone()
+    if row is None:
+        return None
+
+    job = dict(zip(JOB_COLUMNS, row))
+    if job["status"] == "done":
+        job["progress"] = 1.0
+    else:
+        job["progress"] = get_recompute_worker().progress.get(job_id, 0.0)
+    return job
+
+
+def earliest_match(conn, match_ids):
+    # The replay covering all the given ones: None stands for the whole history
+    positions = [
+        get_match_position(conn, m) if m is not None else None for m in match_ids
+    ]
+    if any(p is None or p[0] is None for p in positions):
+        return None
+    return min(positions)[1]
+
+
+def data_version(conn):
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        return True
+    return True
+
+
+class RecomputeWorker:
+    """
+    Runs the queued recompute jobs on a daemon thread, and materializes the
+    due rating snapshots, see snapshot_ratings.
+
+    All the jobs queued when the worker wakes up are coalesced into one replay,
+    from the earliest of their matches. The replay is computed in memory on a
+    read snapshot, without holding the write lock, then stored in one short
+    transaction that also marks the jobs done. A crash at any point leaves the
+    previous ratings in place and the jobs running under the id of the dead
+    process, requeued by the next worker to start.
+    """
+
+    def __init__(self):
+        # Progress of the running jobs, by id
+        self.progress = {}
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run, name="recompute-worker", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def wake(self):
+        self._wakeup.set()
+
+    def run(self):
+        resumed = False
+        while True:
+            try:
+                if not resumed:
+                    self.resume()
+                    resumed = True
+                while self.run_pending():
+                    pass
+                snapshot_ratings(get_db_engine())
+            except Exception:
+                traceback.print_exc()
+
+            self._wakeup.wait(POLL_INTERVAL)
+            self._wakeup.clear()
+
+    @retry_on_busy
+    def resume(self):
+        # Jobs left running by a process that died, or by this one before its
+        # worker started again. The workers of the other processes keep theirs
+        conn = get_db_engine()
+        with immediate_transaction(conn):
+            jobs = conn.execute(
+                "SELECT id, owner FROM recompute_jobs WHERE status = 'running'"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE recompute_jobs SET status = 'queued', owner = NULL WHERE id = ?",
+                [
+                    (job_id,)
+                    for job_id, owner in jobs
+                    if owner is None or owner == os.getpid() or not process_alive(owner)
+                ],
+            )
+
+    @retry_on_busy
+    def claim(self):
+        conn = get_db_engine()
+        # Polls only take the write lock when there is something to claim
+        if not conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM recompute_jobs WHERE status = 'queued')"
+        ).fetchone()[0]:
+            return []
+
+        with immediate_transaction(conn):
+            jobs = conn.execute(
+                "SELECT id, from_match_id FROM recompute_jobs WHERE status = 'queued' ORDER BY id"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE recompute_jobs SET status = 'running', owner = ?, started_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [(os.getpid(), job[0]) for job in jobs],
+            )
+        return jobs
+
+    def run_pending(self):
+        """
+        Runs all the queued jobs as one replay. Returns False if there were none.
+        """
+        jobs = self.claim()
+        if not jobs:
+            return False
+
+        job_ids = [job[0] for job in jobs]
+        for job_id in job_ids:
+            self.progress[job_id] = 0.0
+
+        conn = get_db_engine()
+        try:
+            self.recompute(conn, job_ids, earliest_match(conn, [j[1] for j in jobs]))
+        except Exception as e:
+            self.finish(conn, job_ids, "failed", str(e))
+        finally:
+            for job_id in job_ids:
+                self.progress.pop(job_id, None)
+        return True
+
+    @retry_on_busy
+    def recompute(self, conn, job_ids, from_match_id):
+        def progress(fraction):
+            for job_id in job_ids:
+                self.progress[job_id] = fraction
+
+        for _ in range(OPTIMISTIC_ATTEMPTS):
+            # Any commit of another connection after this changes the version
+            version = data_version(conn)
+            conn.execute("BEGIN")
+            try:
+                replay = compute_replay(conn, from_match_id, progress)
+            finally:
+                conn.commit()
+
+            with immediate_transaction(conn):
+                if data_version(conn) == version:
+                    save_replay(conn, replay)
+                    self.mark(conn, job_ids, "done")
+                    return
+
+        # The history kept changing meanwhile: replay holding the write lock
+        with immediate_transaction(conn):
+            save_replay(conn, compute_replay(conn, from_match_id, progress))
+            self.mark(conn, job_ids, "done")
+
+    @retry_on_busy
+    def finish(self, conn, job_ids, status, error=None):
+        with immediate_transaction(conn):
+            self.mark(conn, job_ids, status, error)
+
+    def mark(self, conn, job_ids, status, error=None):
+        conn.executemany(
+            "UPDATE recompute_jobs SET status = ?, error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            [(status, error, job_id) for job_id in job_ids],
+        )
+
+
+@cache_resource
+def get_recompute_worker():
+    return RecomputeWorker().start()
@@ -0,0 +1,66 @@
+import numpy as np
+
+from .elo import SCALE, expected_score
+
+
+def balanced_matches(ratings, limit=10, scale=SCALE):
+    """
+    Finds the most balanced 2v2 matches among a group of players.
+
+    ratings: Elo of each player.
+    limit: number of matches returned.
+
+    Returns (blue team, red team, blue win probability) tuples, teams as pairs
+    of positions in ratings, the predicted probability closest to 50% first.
+    """
+    ratings = np.asarray(ratings, dtype=np.float64)
+    if len(ratings) < 4 or limit < 1:
+        return []
+
+    # The win probability only depends on the difference between the rating
+    # sums of the teams. Every possible team, sorted by its sum: the closest
+    # sums are the teams a few positions apart in that order.
+    first, second = np.triu_indices(len(ratings), 1)
+    sums = ratings[first] + ratings[second]
+    order = np.argsort(sums, kind="stable")
+    first, second, sums = first[order], second[order], sums[order]
+
+    best_gaps = np.empty(0)
+    best_blue = np.empty(0, dtype=np.int64)
+    best_red = np.empty(0, dtype=np.int64)
+    for offset in range(1, len(sums)):
+        blue = np.arange(len(sums) - offset)
+        red = blue + offset
+        gaps = sums[red] - sums[blue]
+
+        # Teams further apart in the order only have larger gaps
+        if len(best_gaps) == limit and gaps.min() > best_gaps.max():
+            break
+
+        candidates = (
+            (first[blue] != first[red])
+            & (first[blue] != second[red])
+            & (second[blue] != first[red])
+            & (second[blue] != second[red])
+        )
+        if len(best_gaps) == limit:
+            candidates &= gaps < best_gaps.max()
+
+        best_gaps = np.concatenate((best_gaps, gaps[candidates]))
+        best_blue = np.concatenate((best_blue, blue[candidates]))
+        best_red = np.concatenate((best_red, red[candidates]))
+        if len(best_gaps) > limit:
+            kept = np.argpartition(best_gaps, limit - 1)[:limit]
+            best_gaps, best_blue, best_red = (
+                best_gaps[kept],
+                best_blue[kept],
+                best_red[kept],
+            )
+
+    kept = np.argsort(best_gaps, kind="stable")
+    best_blue, best_red = best_blue[kept], best_red[kept]
+    probabilities = expected_score(sums[best_blue] / 2, sums[best_red] / 2, scale)
+    return [
+        ((int(first[b]), int(second[b])), (int(first[r]), int(second[r])), float(p))
+        for b, r, p in zip(best_blue, best_red, probabilities)
+    ]
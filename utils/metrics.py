@@ -0,0 +1,289 @@
+import bisect
+import collections
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Statements slower than this are kept in the slow query log
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_MS", 100)) / 1000
+SLOW_QUERY_LOG_SIZE = 100
+PREFIX = "table_football"
+
+WHITESPACE = re.compile(r"\s+")
+# Lists of placeholders, e.g. of IN clauses, whatever their length
+PLACEHOLDERS = re.compile(r"\?(?:\s*,\s*\?)+")
+# Statements keyed by their SQL text, which is the same object for most calls
+STATEMENTS = {}
+MAX_STATEMENTS = 10_000
+
+
+def statement_name(sql):
+    name = STATEMENTS.get(sql)
+    if name is None:
+        name = PLACEHOLDERS.sub("?, ...", WHITESPACE.sub(" ", sql).strip())
+        if len(STATEMENTS) < MAX_STATEMENTS:
+            STATEMENTS[sql] = name
+    return name
+
+
+class Histogram:
+    __slots__ = ("buckets", "sum", "count", "max")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        # Upper bound of the bucket holding the quantile, the largest value seen
+        # for the last bucket
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    """
+    Thread safe registry of the query and page timings of the process.
+    """
+
+    def __init__(self, slow_query_seconds=SLOW_QUERY_SECONDS):
+        self.slow_query_seconds = slow_query_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.queries = collections.defaultdict(Histogram)
+            self.rows = collections.Counter()
+            self.pages = collections.defaultdict(Histogram)
+            self.slow_queries = collections.deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+    def observe_query(self, sql, seconds, rows):
+        name = statement_name(sql)
+        with self._lock:
+            self.queries[name].observe(seconds)
+            self.rows[name] += rows
+            if seconds >= self.slow_query_seconds:
+                self.slow_queries.append((time.time(), seconds, rows, name))
+
+    def observe_page(self, page, seconds):
+        with self._lock:
+            self.pages[page].observe(seconds)
+
+    def query_stats(self):
+        with self._lock:
+            return [
+                {
+                    "statement": name,
+                    "calls": h.count,
+                    "total_ms": h.sum * 1000,
+                    "mean_ms": h.sum / h.count * 1000,
+                    "p95_ms": h.quantile(0.95) * 1000,
+                    "max_ms": h.max * 1000,
+                    "rows": self.rows[name],
+                }
+                for name, h in self.queries.items()
+            ]
+
+    def page_stats(self):
+        with self._lock:
+            return [
+                {
+                    "page": page,
+                    "renders": h.count,
+                    "mean_ms": h.sum / h.count * 1000,
+                    "p95_ms": h.quantile(0.95) * 1000,
+                    "max_ms": h.max * 1000,
+                }
+                for page, h in self.pages.items()
+            ]
+
+    def slow_query_log(self):
+        with self._lock:
+            return [
+                {
+                    "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)),
+                    "ms": seconds * 1000,
+                    "rows": rows,
+                    "statement": name,
+                }
+                for t, seconds, rows, name in reversed(self.slow_queries)
+            ]
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            lines += histogram_lines(
+                f"{PREFIX}_query_duration_seconds",
+                "Time spent executing and fetching SQL statements.",
+                "statement",
+                self.queries,
+            )
+            lines += [
+                f"# HELP {PREFIX}_query_rows_total Rows fetched by SQL statements.",
+                f"# TYPE {PREFIX}_query_rows_total counter",
+            ]
+            lines += [
+                f'{PREFIX}_query_rows_total{{statement="{escape(name)}"}} {rows}'
+                for name, rows in self.rows.items()
+            ]
+            lines += [
+                f"# HELP {PREFIX}_slow_queries Statements in the slow query log.",
+                f"# TYPE {PREFIX}_slow_queries gauge",
+                f"{PREFIX}_slow_queries {len(self.slow_queries)}",
+            ]
+            lines += histogram_lines(
+                f"{PREFIX}_page_render_seconds",
+                "Time spent running the page scripts.",
+                "page",
+                self.pages,
+            )
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def histogram_lines(metric, help, label, histograms):
+    lines = [f"# HELP {metric} {help}", f"# TYPE {metric} histogram"]
+    for key, h in histograms.items():
+        key = escape(key)
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, "+Inf"), h.buckets):
+            cumulative += count
+            lines.append(
+                f'{metric}_bucket{{{label}="{key}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{metric}_sum{{{label}="{key}"}} {h.sum}')
+        lines.append(f'{metric}_count{{{label}="{key}"}} {h.count}')
+    return lines
+
+
+METRICS = Metrics()
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor recording the time and rows of every statement in METRICS.
+
+    SQLite runs most of a query while its rows are fetched, so a statement is
+    recorded once its rows are exhausted, or when the cursor runs another one
+    or is closed.
+    """
+
+    _pending = None
+
+    def _record(self):
+        if self._pending is not None:
+            METRICS.observe_query(*self._pending)
+            self._pending = None
+
+    def _fetched(self, start, rows, done):
+        if self._pending is not None:
+            self._pending[1] += time.perf_counter() - start
+            self._pending[2] += rows
+            if done:
+                self._record()
+
+    def execute(self, sql, parameters=()):
+        self._record()
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending = [sql, time.perf_counter() - start, 0]
+
+    def executemany(self, sql, seq_of_parameters):
+        self._record()
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            METRICS.observe_query(sql, time.perf_counter() - start, 0)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        size = self.arraysize if size is None else size
+        rows = super().fetchmany(size)
+        self._fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows), True)
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(start, 0, True)
+            raise
+        self._fetched(start, 1, False)
+        return row
+
+    def close(self):
+        self._record()
+        super().close()
+
+    def __del__(self):
+        self._record()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """
+    Connection whose cursors record their statements in METRICS, see
+    InstrumentedCursor.
+    """
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    # sqlite3.Connection.execute does not go through cursor()
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+@contextmanager
+def timed_page(page):
+    """
+    Records the time spent running the body as a render of the page, including
+    when it is cut short by st.stop or a rerun.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe_page(page, time.perf_counter() - start)
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import tempfile
+import zipfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from . import get_db_engine
+from .db import DATABASE_PATH, immediate_transaction, retry_on_busy
+from .elo import replay_history
+
+# Rows per Arrow batch, each written as one Parquet row group
+ROW_GROUP_SIZE = 64 * 1024
+
+# Columns and types of the exported tables. SQLite column types are only
+# affinities, e.g. players.elo is declared INTEGER but holds floats, so they are
+# spelled out rather than read from the schema
+SCHEMAS = {
+    "players": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("alias", pa.string()),
+            ("elo", pa.float64()),
+            ("games_played", pa.int64()),
+            ("games_won", pa.float64()),
+            ("win_rate", pa.float64()),
+        ]
+    ),
+    "matches": pa.schema(
+        [
+            ("id", pa.int64()),
+            ("locale", pa.string()),
+            ("blue_team_att_id", pa.int64()),
+            ("blue_team_def_id", pa.int64()),
+            ("red_team_att_id", pa.int64()),
+            ("red_team_def_id", pa.int64()),
+            ("match_type", pa.string()),
+            ("blue_score", pa.int64()),
+            ("red_score", pa.int64()),
+            ("timestamp", pa.string()),
+        ]
+    ),
+    "match_ratings": pa.schema(
+        [
+            ("match_id", pa.int64()),
+            ("player_id", pa.int64()),
+            ("elo_before", pa.float64()),
+            ("elo_after", pa.float64()),
+            ("games_played_before", pa.int64()),
+            ("games_played_after", pa.int64()),
+            ("games_won_before", pa.int64()),
+            ("games_won_after", pa.int64()),
+            ("side", pa.string()),
+            ("role", pa.string()),
+            ("goal_difference", pa.int64()),
+        ]
+    ),
+    "locale_match_ratings": pa.schema(
+        [
+            ("match_id", pa.int64()),
+            ("player_id", pa.int64()),
+            ("locale", pa.string()),
+            ("elo_before", pa.float64()),
+            ("elo_after", pa.float64()),
+            ("games_played_before", pa.int64()),
+            ("games_played_after", pa.int64()),
+            ("games_won_before", pa.int64()),
+            ("games_won_after", pa.int64()),
+        ]
+    ),
+}
+# Tables restored by import_parquet, the rating history is replayed from them
+RESTORED_TABLES = ["players", "matches"]
+
+
+def entry_name(table):
+    return f"{table}.parquet"
+
+
+def write_table(conn, table, out, batch_size=ROW_GROUP_SIZE):
+    """
+    Streams a table to a Parquet file, one row group per batch of rows fetched
+    from the cursor, so that at most one batch is held in memory.
+
+    Returns the number of rows written.
+    """
+    schema = SCHEMAS[table]
+    cursor = conn.execute(f"SELECT {', '.join(schema.names)} FROM {table}")
+    rows = 0
+    with pq.ParquetWriter(out, schema, compression="zstd") as writer:
+        while batch := cursor.fetchmany(batch_size):
+            # sqlite3 hands out rows of Python objects, converted column by column
+            columns = zip(*batch)
+            writer.write_batch(
+                pa.record_batch(
+                    [pa.array(c, type=f.type) for c, f in zip(columns, schema)],
+                    schema=schema,
+                )
+            )
+            rows += len(batch)
+    return rows
+
+
+def export_parquet(dest, tables=tuple(SCHEMAS), source=DATABASE_PATH):
+    """
+    Writes the given tables to dest as a zip archive of Parquet files, one per
+    table, e.g. players.parquet.
+
+    All the tables are read under one read transaction, so they are consistent
+    with each other while writers keep working meanwhile. The archive entries are
+    stored uncompressed, Parquet columns being compressed already.
+
+    Returns the number of rows written by table.
+    """
+    conn = sqlite3.connect(source)
+    rows = {}
+    try:
+        conn.execute("BEGIN")
+        with zipfile.ZipFile(dest, "w", zipfile.ZIP_STORED) as archive:
+            for table in tables:
+                with archive.open(entry_name(table), "w", force_zip64=True) as out:
+                    rows[table] = write_table(conn, table, out)
+    finally:
+        conn.close()
+    return rows
+
+
+def read_batches(path, table, batch_size=ROW_GROUP_SIZE):
+    schema = SCHEMAS[table]
+    parquet = pq.ParquetFile(path)
+
+    missing = [name for name in schema.names if name not in parquet.schema_arrow.names]
+    if missing:
+        raise ValueError(f"Missing columns in {table}: {', '.join(missing)}")
+
+    for batch in parquet.iter_batches(batch_size, columns=schema.names):
+        yield zip(*(column.to_pylist() for column in batch.columns))
+
+
+@retry_on_busy
+def import_parquet(source, recompute=True):
+    """
+    Replaces the players and the matches with the ones of an archive written by
+    export_parquet, in a single transaction. Ids are kept, so matches still refer
+    to their players.
+
+    source: path or file-like object of the archive. The ratings history in it
+            is not read back, it is replayed from the matches instead.
+    recompute: replay the match history once it is loaded.
+
+    Returns the number of rows imported by table.
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+    conn = get_db_engine()
+    rows = {}
+    with tempfile.TemporaryDirectory() as tmp, zipfile.ZipFile(source) as archive:
+        # Parquet files are read from their footer, which needs random access
+        paths = {}
+        for table in RESTORED_TABLES:
+            try:
+                paths[table] = archive.extract(entry_name(table), tmp)
+            except KeyError:
+                raise ValueError(f"Missing {entry_name(table)} in the archive")
+
+        with immediate_transaction(conn):
+            for table in RESTORED_TABLES:
+                names = SCHEMAS[table].names
+                conn.execute(f"DELETE FROM {table}")
+                rows[table] = 0
+                for batch in read_batches(paths[table], table):
+                    cursor = conn.executemany(
+                        f"INSERT INTO {table} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+                        batch,
+                    )
+                    rows[table] += cursor.rowcount
+
+            if recompute:
+                replay_history(conn)
+
+    return rows
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Points of the Elo chart sent to the browser, whatever the number of games
+MAX_CHART_POINTS = 400
+
+
+def lttb(x, y, threshold=MAX_CHART_POINTS):
+    """
+    Downsamples a series with the Largest-Triangle-Three-Buckets algorithm,
+    which keeps its visual shape (peaks and drops) with far fewer points.
+
+    x, y: 1d arrays of the same length, x increasing.
+    threshold: number of points kept, including the first and the last.
+
+    Returns the indices of the points kept, in order.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    # The points between the first and the last are split into threshold - 2
+    # buckets; each keeps the point forming the largest triangle with the point
+    # kept in the previous bucket and the average of the next bucket
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end : edges[i + 2]].mean()
+            next_y = y[end : edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(areas.argmax())
+        kept[i + 1] = previous
+    return kept
+
+
+def streaks(won):
+    """
+    Returns the current streak of a player, positive for wins and negative for
+    losses, and their longest winning and losing streaks.
+
+    won: results of the player's games in order, 1 for a win and 0 for a loss.
+    """
+    won = np.asarray(won, dtype=bool)
+    if not len(won):
+        return 0, 0, 0
+
+    # Lengths of the runs of equal results
+    breaks = np.flatnonzero(won[1:] != won[:-1]) + 1
+    lengths = np.diff(np.concatenate(([0], breaks, [len(won)])))
+    results = won[np.concatenate(([0], breaks))]
+
+    current = lengths[-1] if results[-1] else -lengths[-1]
+    longest_win = lengths[results].max(initial=0)
+    longest_loss = lengths[~results].max(initial=0)
+    return int(current), int(longest_win), int(longest_loss)
@@ -0,0 +1,249 @@
+"""
+Checks that the queries issued by the pages are served by indexes.
+
+Runs the data access functions used by the pages against a copy of the database,
+collects every statement they execute and prints its EXPLAIN QUERY PLAN. Exits
+with an error when any plan falls back to a full table scan, other than the ones
+a scenario needs by design (e.g. a full replay reading every player).
+
+    python -m utils.query_plans [--database ./database.db]
+
+The Admin imports and exports read or replace whole tables and are not checked.
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+
+# A table scan not going through any index, e.g. "SCAN players"
+FULL_SCAN = re.compile(r"^SCAN (\w+)$")
+# Literals are replaced to tell apart the statements run by executemany
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+PLANNED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def scenarios(alias, match):
+    from . import get_db_engine
+    from .elo import recompute_elo
+    from .games import (
+        delete_match,
+        edit_match,
+        get_head_to_head,
+        get_match_info,
+        get_matches_page,
+        get_pair_stats,
+        get_player_aliases,
+        get_player_ratings,
+        get_ranking,
+        get_rating_history,
+        get_recent_matches,
+        player_exists,
+        register_match,
+        register_player,
+        restore_match,
+    )
+    from .events import (
+        get_match_events,
+        get_ratings_at,
+        revert_edit,
+        snapshot_ratings,
+    )
+    from .seasons import get_season_list, get_season_ranking, start_season
+
+    def season_ranking():
+        # The season started by the scenario before, which has ended since
+        seasons = get_season_list()
+        return get_season_ranking(seasons[-1][0], match[1])
+
+    def delete_latest():
+        # Rolled back from its own snapshots
+        return delete_match(get_recent_matches(1)[0][0])
+
+    def edit_and_revert():
+        # Swaps the teams of the match, then reverts that edit
+        edit_match(
+            match[0], match[1], *match[4:6], *match[2:4], match[6], match[8], match[7]
+        )
+        return revert_edit(match[0])
+
+    # Scans allowed to full replays
+    replay_scans = {
+        "players",
+        "match_ratings",
+        "locale_match_ratings",
+        "locale_ratings",
+        "pair_stats",
+    }
+
+    # name, function, tables it may scan entirely
+    return [
+        ("player aliases", get_player_aliases, set()),
+        ("player ranking", get_ranking, set()),
+        # The matchmaker picks among every player
+        ("player ratings", get_player_ratings, {"players"}),
+        ("locale ranking", lambda: get_ranking(match[1]), set()),
+        ("recent matches", get_recent_matches, set()),
+        ("history page", lambda: get_matches_page(before=(match[-1], match[0])), set()),
+        # The alias to id map holds every player; the page is the few matches
+        # read through the player indexes
+        (
+            "history by player",
+            lambda: get_matches_page(alias=alias),
+            {"players", "page"},
+        ),
+        (
+            "history by locale and type",
+            lambda: get_matches_page(locale=match[1], match_type=match[6]),
+            set(),
+        ),
+        (
+            "history by date",
+            lambda: get_matches_page(date_from="2023-01-01", date_to="2023-12-31"),
+            set(),
+        ),
+        ("match info", lambda: get_match_info(match[0]), set()),
+        # Players are resolved through the alias to id map, as above
+        ("rating history", lambda: get_rating_history(alias), {"players"}),
+        ("head to head", lambda: get_head_to_head(alias, match[4]), {"players"}),
+        (
+            "partners by role",
+            lambda: get_pair_stats(alias, "teammate", role="defender"),
+            {"players"},
+        ),
+        ("player exists", lambda: player_exists(alias), set()),
+        ("player registration", lambda: register_player("query-plans"), set()),
+        ("match registration", lambda: register_match(*match[1:9]), {"players"}),
+        # Run by the worker once a write made a snapshot due
+        ("rating snapshot", lambda: snapshot_ratings(get_db_engine()), {"players"}),
+        # Replays keep the state of every player in memory
+        ("match edit", lambda: edit_match(*match[:9]), {"players"}),
+        ("match changes", lambda: get_match_events(match[0]), set()),
+        ("edit revert", edit_and_revert, {"players"}),
+        # Older than the matches registered by the scenarios before: the ones
+        # after it are replayed
+        ("match delete", lambda: delete_match(match[0]), {"players"}),
+        ("match restore", lambda: restore_match(match[0]), {"players"}),
+        ("latest match delete", delete_latest, set()),
+        ("incremental recompute", lambda: recompute_elo(match[0]), {"players"}),
+        ("full recompute", recompute_elo, replay_scans),
+        # Backdated before every match, so it is replayed from scratch
+        (
+            "season start",
+            lambda: start_season("query-plans", "2000-01-01 00:00:00", 0.5),
+            replay_scans | {"season_ratings", "season_locale_ratings"},
+        ),
+        ("season list", get_season_list, set()),
+        # The latest events, read backwards in id order up to the limit
+        ("audit log", get_match_events, {"e"}),
+        # Folds the whole log, the season start dropped the rating snapshots
+        ("standings at an event", lambda: get_ratings_at(1), {"players"}),
+        ("season ranking", season_ranking, set()),
+    ]
+
+
+def explain(conn, sql):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+
+
+def collect_statements(conn, func):
+    statements = {}
+
+    def trace(sql):
+        sql = sql.strip()
+        if sql.upper().startswith(PLANNED):
+            statements.setdefault(LITERALS.sub("?", sql), sql)
+
+    conn.set_trace_callback(trace)
+    try:
+        func()
+    finally:
+        conn.set_trace_callback(None)
+    return list(statements.values())
+
+
+def check_query_plans(out=sys.stdout):
+    """
+    Runs every scenario against the current database and returns the list of
+    (scenario, statement, plan) that fall back to a full table scan.
+    """
+    from . import get_db_engine
+    from .cache import clear_caches
+    from .games import get_recent_matches
+
+    conn = get_db_engine()
+    alias = conn.execute("SELECT alias FROM players LIMIT 1").fetchone()[0]
+    # The newest match, with the aliases of its players
+    match = get_recent_matches(1)[0]
+
+    failures = []
+    for name, func, allowed in scenarios(alias, match):
+        print(f"== {name}", file=out)
+        # Cached reads would not reach the database
+        clear_caches()
+        for sql in collect_statements(conn, func):
+            plan = explain(conn, sql)
+            scans = [
+                line
+                for line in plan
+                if FULL_SCAN.match(line) and FULL_SCAN.match(line)[1] not in allowed
+            ]
+            print(f"   {' '.join(sql.split())[:100]}", file=out)
+            for line in plan:
+                print(f"     {'!!' if line in scans else '--'} {line}", file=out)
+            if scans:
+                failures.append((name, sql, plan))
+
+    return failures
+
+
+def seed(conn):
+    # The scenarios need a few players and one match to work with
+    conn.executemany(
+        "INSERT OR IGNORE INTO players (alias, elo, games_played, games_won) VALUES (?, ?, ?, ?)",
+        [(f"query-plans-{i}", 1000, 0, 0) for i in range(4)],
+    )
+    if conn.execute("SELECT COUNT(*) FROM matches").fetchone()[0] == 0:
+        conn.execute(
+            "INSERT INTO matches (locale, blue_team_att_id, blue_team_def_id, red_team_att_id, red_team_def_id, match_type, blue_score, red_score) "
+            "SELECT 'IT', "
+            + ", ".join(
+                f"(SELECT id FROM players WHERE alias = 'query-plans-{i}')"
+                for i in range(4)
+            )
+            + ", '2v2', 10, 5"
+        )
+    conn.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--database", default=os.environ.get("DATABASE_PATH", "./database.db")
+    )
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # The scenarios write, so they run on a snapshot
+        path = os.path.join(tmp, "database.db")
+        os.environ["DATABASE_PATH"] = path
+
+        from . import get_db_engine
+        from .backup import snapshot_database
+        from .db import upgrade_database
+
+        snapshot_database(path, args.database)
+        upgrade_database(path)
+        seed(get_db_engine())
+
+        failures = check_query_plans()
+
+    if failures:
+        print(f"{len(failures)} statements fall back to a full table scan")
+        return 1
+    print("All statements are served by indexes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+from . import get_db_cursor, get_db_engine
+from .cache import versioned_cache
+from .db import immediate_transaction, retry_on_busy
+from .elo import replay_history
+from .events import clear_rating_snapshots
+
+
+@versioned_cache
+def get_season_list():
+    """
+    Returns the seasons as (id, name, starts_at, carry_over, ends_at) rows,
+    latest first. ends_at is None for the current season.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    c.execute(
+        """
+        SELECT
+            id,
+            name,
+            starts_at,
+            carry_over,
+            LEAD(starts_at) OVER (ORDER BY starts_at) AS ends_at
+        FROM seasons
+        ORDER BY starts_at DESC
+        """
+    )
+    return c.fetchall()
+
+
+@versioned_cache
+def get_season_ranking(season_id, locale=None):
+    """
+    Returns the final standings of an ended season, as get_ranking does, with
+    the games played and won during the season only.
+
+    The standings are the checkpoint of the next season, taken right before its
+    soft reset, minus the counters of the season's own checkpoint.
+    """
+    conn = get_db_engine()
+    c = get_db_cursor(conn)
+
+    table, join, where, params = "season_ratings", "", "", []
+    if locale is not None:
+        table, join, where, params = (
+            "season_locale_ratings",
+            "AND s.locale = e.locale",
+            "AND e.locale = ?",
+            [locale],
+        )
+
+    c.execute(
+        f"""
+        WITH season AS (
+            SELECT
+                id,
+                (
+                    SELECT n.id
+                    FROM seasons n
+                    WHERE n.starts_at > seasons.starts_at
+                    ORDER BY n.starts_at
+                    LIMIT 1
+                ) AS next_id
+            FROM seasons
+            WHERE id = ?
+        ),
+        standings AS (
+            SELECT
+                LOWER(p.alias) AS alias,
+                e.elo,
+                e.games_played - COALESCE(s.games_played, 0) AS games_played,
+                e.games_won - COALESCE(s.games_won, 0) AS games_won
+            FROM season
+            JOIN {table} e ON e.season_id = season.next_id
+            JOIN players p ON p.id = e.player_id
+            LEFT JOIN {table} s
+                ON s.season_id = season.id AND s.player_id = e.player_id {join}
+            WHERE e.games_played > COALESCE(s.games_played, 0) {where}
+        )
+        SELECT alias, elo, games_played, games_won, 1.0 * games_won / games_played
+        FROM standings
+        ORDER BY elo DESC
+        """,
+        [season_id, *params],
+    )
+    return c.fetchall()
+
+
+@retry_on_busy
+def start_season(name, starts_at=None, carry_over=1.0):
+    """
+    Starts a season, now or at a past starts_at timestamp, and replays the
+    matches played since then in a single transaction.
+
+    carry_over: share of the distance of every rating to the initial one kept
+                at the start of the season, from 0 (hard reset) to 1 (no reset).
+
+    Returns the id of the new season.
+    """
+    if not 0 <= carry_over <= 1:
+        raise ValueError("The carry over must be between 0 and 1")
+
+    conn = get_db_engine()
+    with immediate_transaction(conn):
+        now = conn.execute("SELECT CURRENT_TIMESTAMP").fetchone()[0]
+        starts_at = starts_at or now
+        # Matches registered from now on must not be replayed before a reset
+        if starts_at > now:
+            raise ValueError("Seasons cannot start in the future")
+        if conn.execute(
+            "SELECT 1 FROM seasons WHERE starts_at = ?", [starts_at]
+        ).fetchone():
+            raise ValueError("Another season starts at the same time")
+
+        season_id = conn.execute(
+            "INSERT INTO seasons (name, starts_at, carry_over) VALUES (?, ?, ?)",
+            [name, starts_at, carry_over],
+        ).lastrowid
+        replay_history(conn, since=(starts_at, 0))
+        clear_rating_snapshots(conn)
+
+    return season_id
+
+
+@retry_on_busy
+def delete_season(season_id):
+    """
+    Deletes a season, merging it into the previous one, and replays the matches
+    played since the start of the previous one in a single transaction.
+    """
+    conn = get_db_engine()
+    with immediate_transaction(conn):
+        row = conn.execute(
+            "SELECT starts_at FROM seasons WHERE id = ?", [season_id]
+        ).fetchone()
+        if row is None:
+            return
+
+        conn.execute("DELETE FROM season_ratings WHERE season_id = ?", [season_id])
+        conn.execute(
+            "DELETE FROM season_locale_ratings WHERE season_id = ?", [season_id]
+        )
+        conn.execute("DELETE FROM seasons WHERE id = ?", [season_id])
+        # The snapshots of the matches played since its start include its soft
+        # reset, so they cannot be replayed from
+        replay_history(conn, since=(row[0], 0), checkpoint=True)
+        clear_rating_snapshots(conn)
@@ -0,0 +1,181 @@
+"""
+Sweeps the Elo parameters over the match history.
+
+Replays the whole history once for a grid of K-factors and scales, all the grid
+points at once, and scores how well the ratings before each match predicted
+its result (log-loss and Brier score, lower is better).
+
+    python -m utils.sweep [--k-factor 10 80 --k-steps 40] [--scale 200 800 --scale-steps 25]
+"""
+import argparse
+import math
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def sweep(
+    blue,
+    red,
+    blue_won,
+    n_players,
+    k_factors,
+    scales,
+    initial_elo=1000,
+    burn_in=0,
+    boundaries=(),
+):
+    """
+    Replays the matches for every (k_factor, scale) pair, as replay_seasons
+    does.
+
+    blue, red, blue_won: arrays as returned by resolve_teams.
+    n_players: size of the rating arrays the team positions refer to.
+    k_factors, scales: 1d arrays of the same length, one grid point each.
+    burn_in: number of replayed matches not scored, while ratings settle.
+    boundaries: seasons starting during the replay, as given by
+                season_boundaries, soft reset at their start.
+
+    Returns the log-loss and the Brier score of every grid point, and the final
+    ratings as a (n_players, n_points) array.
+    """
+    k_factors = np.asarray(k_factors, dtype=np.float64)
+    # 10 ** (x / scale) as an exponential, which is cheaper
+    exponents = math.log(10) / np.asarray(scales, dtype=np.float64)
+
+    ratings = np.full((n_players, len(k_factors)), initial_elo, dtype=np.float64)
+    log_loss = np.zeros(len(k_factors))
+    brier = np.zeros(len(k_factors))
+
+    replayed = (blue.max(axis=1) >= 0) & (red.max(axis=1) >= 0)
+    # Carry overs of the soft resets due before each replayed match, by its
+    # index among them
+    resets = {}
+    for position, _, carry_over in boundaries:
+        resets.setdefault(int(replayed[:position].sum()), []).append(carry_over)
+
+    def soft_reset(carry_overs):
+        for carry_over in carry_overs:
+            ratings[:] = initial_elo + carry_over * (ratings - initial_elo)
+
+    scored = 0
+    for i, (blue_team, red_team, result) in enumerate(
+        zip(
+            blue[replayed].tolist(),
+            red[replayed].tolist(),
+            blue_won[replayed].tolist(),
+        )
+    ):
+        soft_reset(resets.pop(i, ()))
+        blue_team = [p for p in blue_team if p >= 0]
+        red_team = [p for p in red_team if p >= 0]
+
+        blue_ratings = ratings[blue_team]
+        red_ratings = ratings[red_team]
+        blue_avg = blue_ratings.mean(axis=0)
+        red_avg = red_ratings.mean(axis=0)
+
+        if i >= burn_in:
+            # Expected score of the blue team, from the team averages. The
+            # log-loss is -log(expected) or -log(1 - expected), computed without
+            # overflowing for confident predictions
+            z = (red_avg - blue_avg) * exponents
+            expected = 1 / (1 + np.exp(z))
+            log_loss += np.logaddexp(0, z if result else -z)
+            brier += (expected - result) ** 2
+            scored += 1
+
+        # Same update as calculate_elo_rating, for every grid point at once
+        ratings[blue_team] = blue_ratings + k_factors * (
+            result - 1 / (1 + np.exp((red_avg - blue_ratings) * exponents))
+        )
+        ratings[red_team] = red_ratings + k_factors * (
+            (1 - result) - 1 / (1 + np.exp((blue_avg - red_ratings) * exponents))
+        )
+
+    # Seasons starting after the last match
+    for i in sorted(resets):
+        soft_reset(resets[i])
+
+    scored = max(scored, 1)
+    return log_loss / scored, brier / scored, ratings
+
+
+def parameter_grid(k_range, k_steps, scale_range, scale_steps):
+    k_factors, scales = np.meshgrid(
+        np.linspace(*k_range, k_steps), np.linspace(*scale_range, scale_steps)
+    )
+    return k_factors.ravel(), scales.ravel()
+
+
+def sweep_history(k_factors, scales, burn_in=0):
+    """
+    Sweeps the parameters over the whole match history of the database, with
+    the soft resets of its seasons.
+
+    Returns a DataFrame with the k_factor, scale, log_loss and brier of every
+    grid point, best log-loss first.
+    """
+    from . import get_db_engine
+    from .elo import (
+        INITIAL_ELO,
+        get_all_matches,
+        get_player_state,
+        get_seasons,
+        resolve_teams,
+        season_boundaries,
+    )
+
+    ids, index, *_ = get_player_state()
+    matches = get_all_matches()
+    blue, red, blue_won = resolve_teams(matches, index)
+    timestamps = np.array([m[9] or "" for m in matches], dtype=str)
+
+    log_loss, brier, _ = sweep(
+        blue,
+        red,
+        blue_won,
+        len(ids),
+        k_factors,
+        scales,
+        initial_elo=INITIAL_ELO,
+        burn_in=burn_in,
+        boundaries=season_boundaries(timestamps, get_seasons(get_db_engine())),
+    )
+    results = pd.DataFrame(
+        {"k_factor": k_factors, "scale": scales, "log_loss": log_loss, "brier": brier}
+    )
+    return results.sort_values("log_loss", ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--k-factor", type=float, nargs=2, default=[10, 80], metavar=("MIN", "MAX")
+    )
+    parser.add_argument("--k-steps", type=int, default=40)
+    parser.add_argument(
+        "--scale", type=float, nargs=2, default=[200, 800], metavar=("MIN", "MAX")
+    )
+    parser.add_argument("--scale-steps", type=int, default=25)
+    parser.add_argument(
+        "--burn-in", type=int, default=0, help="matches replayed but not scored"
+    )
+    parser.add_argument("--top", type=int, default=10, help="grid points printed")
+    parser.add_argument("--output", help="CSV file with every grid point")
+    args = parser.parse_args(argv)
+
+    k_factors, scales = parameter_grid(
+        args.k_factor, args.k_steps, args.scale, args.scale_steps
+    )
+    results = sweep_history(k_factors, scales, args.burn_in)
+
+    if args.output:
+        results.to_csv(args.output, index=False)
+    print(results.head(args.top).to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())